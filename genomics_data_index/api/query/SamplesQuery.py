@@ -26,6 +26,16 @@ class SamplesQuery(abc.ABC):
     def sample_set(self) -> SampleSet:
         pass
 
+    @property
+    @abc.abstractmethod
+    def unknown_set(self) -> SampleSet:
+        """
+        The set of samples for which it is unknown whether or not they match this query (e.g., samples
+        with missing/masked data at a queried position). This is disjoint from sample_set.
+        :return: The set of samples with unknown status for this query.
+        """
+        pass
+
     @abc.abstractmethod
     def join(self, data_frame: pd.DataFrame, sample_ids_column: str = None,
              sample_names_column: str = None, default_isa_kind: str = 'names',
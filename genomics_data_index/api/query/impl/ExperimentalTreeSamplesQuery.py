@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Callable, Set
+from typing import Callable, Set, Union
 
 from ete3 import Tree, TreeNode
 
@@ -9,6 +9,7 @@ from genomics_data_index.api.query.impl.MutationTreeSamplesQuery import Mutation
 from genomics_data_index.api.query.impl.WrappedSamplesQuery import WrappedSamplesQuery
 from genomics_data_index.configuration.connector.DataIndexConnection import DataIndexConnection
 from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeView import TreeView
 
 
 class ExperimentalTreeSamplesQuery(MutationTreeSamplesQuery):
@@ -19,21 +20,33 @@ class ExperimentalTreeSamplesQuery(MutationTreeSamplesQuery):
     """
 
     def __init__(self, connection: DataIndexConnection, wrapped_query: SamplesQuery,
-                 tree: Tree, universe_tree: Tree,
+                 tree: Union[Tree, TreeView], universe_tree: Union[Tree, TreeView],
                  alignment_length: int, reference_name: str, reference_included: bool):
         super().__init__(connection=connection, wrapped_query=wrapped_query,
                          tree=tree, alignment_length=alignment_length,
                          reference_name=reference_name,
                          reference_included=reference_included)
-        self._universe_tree = universe_tree
+        self._universe_tree_view = self._as_tree_view(universe_tree)
+
+    def _as_tree_view(self, tree: Union[Tree, TreeView]) -> TreeView:
+        return tree if isinstance(tree, TreeView) else TreeView(tree)
+
+    @property
+    def _tree(self) -> Tree:
+        # Trees are stored as (lazily created) views of the universe tree so that new queries don't copy the tree
+        return self._tree_view.tree
+
+    @_tree.setter
+    def _tree(self, tree: Union[Tree, TreeView]):
+        self._tree_view = self._as_tree_view(tree)
 
     @property
     def universe_tree(self) -> Tree:
-        return self._universe_tree
+        return self._universe_tree_view.tree.copy(method='cpickle')
 
     def reset_universe(self) -> SamplesQuery:
         wrapped_reset_universe = self._wrapped_query.reset_universe()
-        universe_tree = self._tree_copy_prune(from_query=wrapped_reset_universe, preserve_branch_length=True)
+        universe_tree = self._tree_view_prune(from_query=wrapped_reset_universe, preserve_branch_length=True)
         return ExperimentalTreeSamplesQuery(connection=self._query_connection,
                                             wrapped_query=wrapped_reset_universe,
                                             tree=universe_tree,
@@ -42,49 +55,46 @@ class ExperimentalTreeSamplesQuery(MutationTreeSamplesQuery):
                                             reference_name=self.reference_name,
                                             reference_included=self.reference_included)
 
-    def _tree_copy(self) -> Tree:
-        return self._tree.copy(method='cpickle')
-
-    def _universe_tree_copy(self) -> Tree:
-        return self._universe_tree.copy(method='cpickle')
-
-    def _tree_copy_prune(self, from_query: SamplesQuery = None, preserve_branch_length: bool = True) -> Tree:
-        tree = self._universe_tree_copy()
+    def _tree_view_prune(self, from_query: SamplesQuery = None, preserve_branch_length: bool = True) -> TreeView:
         if from_query is not None:
             query = from_query
         else:
             query = self
 
         if self.reference_included:
-            nodes_to_keep = query.tolist() + [self.reference_name]
+            extra_leaves = [self.reference_name]
         else:
-            nodes_to_keep = query.tolist()
-        tree.prune(nodes_to_keep, preserve_branch_length=preserve_branch_length)
-        return tree
+            extra_leaves = []
+        return self._universe_tree_view.prune(query.sample_set, sample_service=self._query_connection.sample_service,
+                                              extra_leaves=extra_leaves,
+                                              preserve_branch_length=preserve_branch_length)
 
     def set_outgroup(self, sample_name: str) -> SamplesQuery:
-        tree = self._tree_copy()
-        tree.set_outgroup(sample_name)
-        return self._create_from_tree_internal(tree)
+        # The tree is only modified when it is used, so check the sample is in the tree now
+        if sample_name not in self._tree_view.leaf_names:
+            raise ValueError(f'Node names not found: {[sample_name]}')
+        return self._create_from_tree_internal(self._tree_view.apply(lambda tree: tree.set_outgroup(sample_name)))
 
     def relabel_samples(self, rename_func: Callable[[str], str]) -> SamplesQuery:
-        tree = self._tree_copy()
-        for node in tree.traverse("postorder"):
-            if node.is_leaf():
-                node.name = rename_func(node.name)
-        return self._create_from_tree_internal(tree)
+        # Rename now so that errors from rename_func are raised here instead of when the tree is used
+        new_names = {name: rename_func(name) for name in self._tree_view.leaf_names}
+
+        def relabel(tree: Tree):
+            for node in tree.traverse("postorder"):
+                if node.is_leaf():
+                    node.name = new_names[node.name]
+
+        return self._create_from_tree_internal(self._tree_view.apply(relabel, leaf_names=list(new_names.values())))
 
     def prune(self, preserve_branch_length: bool = True) -> SamplesQuery:
         """
         Prunes tree down to whatever the current query is.
         """
-        tree = self._tree_copy_prune(preserve_branch_length=preserve_branch_length)
+        tree = self._tree_view_prune(preserve_branch_length=preserve_branch_length)
         return self._create_from_tree_internal(tree)
 
     def label_internal_nodes(self) -> SamplesQuery:
-        tree = self._tree_copy()
-        self._label_internal_nodes_recursive(tree)
-        return self._create_from_tree_internal(tree)
+        return self._create_from_tree_internal(self._tree_view.apply(self._label_internal_nodes_recursive))
 
     def _label_internal_nodes_recursive(self, node: TreeNode) -> Set[str]:
         if node.is_leaf():
@@ -99,20 +109,20 @@ class ExperimentalTreeSamplesQuery(MutationTreeSamplesQuery):
             return children_names
 
     def _wrap_create(self, wrapped_query: SamplesQuery, universe_set: SampleSet = None) -> WrappedSamplesQuery:
-        tree = self._tree_copy_prune(from_query=wrapped_query, preserve_branch_length=True)
+        tree = self._tree_view_prune(from_query=wrapped_query, preserve_branch_length=True)
         return ExperimentalTreeSamplesQuery(connection=self._query_connection,
                                             wrapped_query=wrapped_query,
                                             tree=tree,
-                                            universe_tree=self._universe_tree,
+                                            universe_tree=self._universe_tree_view,
                                             alignment_length=self._alignment_length,
                                             reference_name=self.reference_name,
                                             reference_included=self.reference_included)
 
-    def _create_from_tree_internal(self, tree: Tree) -> SamplesQuery:
+    def _create_from_tree_internal(self, tree: Union[Tree, TreeView]) -> SamplesQuery:
         return ExperimentalTreeSamplesQuery(connection=self._query_connection,
                                             wrapped_query=self._wrapped_query,
                                             tree=tree,
-                                            universe_tree=self._universe_tree,
+                                            universe_tree=self._universe_tree_view,
                                             alignment_length=self._alignment_length,
                                             reference_name=self.reference_name,
                                             reference_included=self.reference_included)
@@ -126,8 +136,8 @@ class ExperimentalTreeSamplesQuery(MutationTreeSamplesQuery):
         """
         return ExperimentalTreeSamplesQuery(connection=query._query_connection,
                                             wrapped_query=query._wrapped_query,
-                                            tree=query.tree,
-                                            universe_tree=query.tree,
+                                            tree=query._tree,
+                                            universe_tree=query._tree,
                                             alignment_length=query._alignment_length,
                                             reference_name=query.reference_name,
                                             reference_included=query.reference_included)
@@ -15,9 +15,9 @@ class KmerTreeSamplesQuery(TreeSamplesQuery):
         super().__init__(connection=connection, wrapped_query=wrapped_query, tree=tree)
 
     def _wrap_create(self, wrapped_query: SamplesQuery, universe_set: SampleSet = None) -> WrappedSamplesQuery:
-        tree = self.tree
+        tree = self._tree
         if isinstance(tree, ClusterTree):
-            tree = cast(ClusterTree, self.tree)
+            tree = cast(ClusterTree, self._tree)
         else:
             raise Exception(f'Incorrect type of tree [{tree}]. Expected [{ClusterTree.__class__}], got [{type(tree)}].')
 
@@ -7,6 +7,7 @@ from genomics_data_index.api.query.impl.TreeSamplesQuery import TreeSamplesQuery
 from genomics_data_index.api.query.impl.WrappedSamplesQuery import WrappedSamplesQuery
 from genomics_data_index.configuration.connector.DataIndexConnection import DataIndexConnection
 from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeIndex import TreeIndex
 
 
 class MutationTreeSamplesQuery(TreeSamplesQuery):
@@ -51,22 +52,13 @@ class MutationTreeSamplesQuery(TreeSamplesQuery):
 
         sample_name_ids = self._get_sample_name_ids()
 
-        sample_leaves = self._tree.get_leaves_by_name(sample_names)
-        if len(sample_leaves) != 1:
-            raise Exception(
-                f'Invalid number of matching leaves for sample [{sample_names}], leaves {sample_leaves}')
-
-        sample_node = sample_leaves[0]
+        tree_index = TreeIndex.get(self._tree)
+        distances = tree_index.leaf_distances(sample_names) * distance_multiplier
 
         found_samples_set = set()
-        leaves = self._tree.get_leaves()
-        for leaf in leaves:
-            if leaf.name not in sample_name_ids:
-                continue
-            sample_distance_to_other_sample = sample_node.get_distance(leaf) * distance_multiplier
-
-            if sample_distance_to_other_sample <= distance:
-                found_samples_set.add(sample_name_ids[leaf.name])
+        for leaf_name, sample_distance_to_other_sample in zip(tree_index.leaf_names, distances):
+            if leaf_name in sample_name_ids and sample_distance_to_other_sample <= distance:
+                found_samples_set.add(sample_name_ids[leaf_name])
 
         found_samples = SampleSet(found_samples_set)
         return self.intersect(found_samples, f'within({distance} {units} of {sample_names})')
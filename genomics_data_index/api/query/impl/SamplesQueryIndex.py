@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Union, List, Set, Tuple
+from typing import Union, List, Set, Tuple, cast
 
 import numpy as np
 import pandas as pd
@@ -28,13 +28,19 @@ class SamplesQueryIndex(SamplesQuery):
     def __init__(self, connection: DataIndexConnection,
                  universe_set: SampleSet,
                  sample_set: SampleSet,
-                 queries_collection: QueriesCollection = QueriesCollection.create_empty()):
+                 queries_collection: QueriesCollection = QueriesCollection.create_empty(),
+                 unknown_set: SampleSet = None):
         super().__init__()
         self._query_connection = connection
         self._universe_set = universe_set
         self._sample_set = sample_set
         self._queries_collection = queries_collection
 
+        if unknown_set is None:
+            self._unknown_set = SampleSet.create_empty()
+        else:
+            self._unknown_set = unknown_set
+
     @property
     def universe_set(self) -> SampleSet:
         return self._universe_set
@@ -43,6 +49,10 @@ class SamplesQueryIndex(SamplesQuery):
     def sample_set(self) -> SampleSet:
         return self._sample_set
 
+    @property
+    def unknown_set(self) -> SampleSet:
+        return self._unknown_set
+
     def reset_universe(self) -> SamplesQuery:
         return self._create_from(sample_set=self._sample_set, universe_set=self._sample_set,
                                  queries_collection=self._queries_collection)
@@ -69,13 +79,15 @@ class SamplesQueryIndex(SamplesQuery):
 
     def intersect(self, sample_set: SampleSet, query_message: str = None) -> SamplesQuery:
         intersected_set = self._intersect_sample_set(sample_set)
+        intersected_unknown_set = self.unknown_set.intersection(sample_set)
 
         if query_message is None:
             query_message = f'intersect(samples={len(sample_set)}'
 
         queries_collection = self._queries_collection.append(query_message)
         return self._create_from(sample_set=intersected_set, universe_set=self._universe_set,
-                                 queries_collection=queries_collection)
+                                 queries_collection=queries_collection,
+                                 unknown_set=intersected_unknown_set)
 
     def _intersect_sample_set(self, other: SampleSet) -> SampleSet:
         return self.sample_set.intersection(other)
@@ -83,6 +95,20 @@ class SamplesQueryIndex(SamplesQuery):
     def _union_sample_set(self, other: SampleSet) -> SampleSet:
         return self.sample_set.union(other)
 
+    def _and_unknown_set(self, present_set: SampleSet, other_present_set: SampleSet,
+                         other_unknown_set: SampleSet) -> SampleSet:
+        """
+        Gets the unknown set for an "and" of this query with another (three-valued logic). A sample is unknown
+        if it is not present in both queries but is either present or unknown in each of them.
+        :param present_set: The set of samples present in the result of the "and".
+        :param other_present_set: The set of present samples in the other query.
+        :param other_unknown_set: The set of unknown samples in the other query.
+        :return: The set of unknown samples in the result of the "and".
+        """
+        self_present_or_unknown = self.sample_set.union(self.unknown_set)
+        other_present_or_unknown = other_present_set.union(other_unknown_set)
+        return self_present_or_unknown.intersection(other_present_or_unknown).minus(present_set)
+
     def _get_has_kinds(self) -> List[str]:
         return self.HAS_KINDS
 
@@ -105,11 +131,11 @@ class SamplesQueryIndex(SamplesQuery):
     def summary(self) -> pd.DataFrame:
         present = len(self)
         total = len(self.universe_set)
-        unknown = pd.NA
-        absent = total - present
+        unknown = len(self.unknown_set)
+        absent = total - present - unknown
         per_present = (present / total) * 100
         per_absent = (absent / total) * 100
-        per_unknown = pd.NA
+        per_unknown = (unknown / total) * 100
 
         return pd.DataFrame([{
             'Query': self._queries_collection.query_expression(),
@@ -152,18 +178,24 @@ class SamplesQueryIndex(SamplesQuery):
     def and_(self, other):
         if isinstance(other, SamplesQuery):
             intersect_set = self._intersect_sample_set(other.sample_set)
+            unknown_set = self._and_unknown_set(present_set=intersect_set,
+                                                other_present_set=other.sample_set,
+                                                other_unknown_set=other.unknown_set)
             queries_collection = self._queries_collection.append(str(other))
             return self._create_from(intersect_set, universe_set=self._universe_set,
-                                     queries_collection=queries_collection)
+                                     queries_collection=queries_collection,
+                                     unknown_set=unknown_set)
         else:
             raise Exception(f'Cannot perform an "and" on object {other}')
 
     def or_(self, other: SamplesQuery) -> SamplesQuery:
         if isinstance(other, SamplesQuery):
             union_set = self._union_sample_set(other.sample_set)
+            unknown_set = self.unknown_set.union(other.unknown_set).minus(union_set)
             queries_collection = self._queries_collection.append(f'OR({str(other)}')
             return self._create_from(union_set, universe_set=self._universe_set,
-                                     queries_collection=queries_collection)
+                                     queries_collection=queries_collection,
+                                     unknown_set=unknown_set)
         else:
             raise Exception(f'Cannot perform an "or" on object {other}')
 
@@ -171,10 +203,11 @@ class SamplesQueryIndex(SamplesQuery):
         return self.sample_set.is_empty()
 
     def complement(self):
-        complement_set = self.universe_set.minus(self.sample_set)
+        complement_set = self.universe_set.minus(self.sample_set).minus(self.unknown_set)
         query_collection = self._queries_collection.append('complement')
         return self._create_from(sample_set=complement_set, universe_set=self._universe_set,
-                                 queries_collection=query_collection)
+                                 queries_collection=query_collection,
+                                 unknown_set=self.unknown_set)
 
     @property
     def tree(self):
@@ -224,13 +257,35 @@ class SamplesQueryIndex(SamplesQuery):
 
         if query_feature.id in found_set_dict:
             found_set = found_set_dict[query_feature.id]
-            intersect_found = self._intersect_sample_set(found_set)
         else:
-            intersect_found = SampleSet.create_empty()
+            found_set = SampleSet.create_empty()
+
+        intersect_found = self._intersect_sample_set(found_set)
+        feature_unknown_set = self._find_unknown_sample_set(query_feature).minus(found_set)
+        unknown_set = self._and_unknown_set(present_set=intersect_found,
+                                            other_present_set=found_set,
+                                            other_unknown_set=feature_unknown_set)
 
         queries_collection = self._queries_collection.append(query_feature)
         return self._create_from(intersect_found, universe_set=self._universe_set,
-                                 queries_collection=queries_collection)
+                                 queries_collection=queries_collection,
+                                 unknown_set=unknown_set)
+
+    def _find_unknown_sample_set(self, query_feature: QueryFeature) -> SampleSet:
+        sample_service = self._query_connection.sample_service
+        if query_feature.is_unknown():
+            return SampleSet.create_empty()
+        elif isinstance(query_feature, QueryFeatureMutation):
+            return sample_service.find_unknown_sample_set_by_feature(cast(QueryFeatureMutation, query_feature))
+        elif isinstance(query_feature, QueryFeatureMLST):
+            unknown_feature = query_feature.to_unknown()
+            unknown_set_dict = sample_service.find_sample_sets_by_features([unknown_feature])
+            if unknown_feature.id in unknown_set_dict:
+                return unknown_set_dict[unknown_feature.id]
+            else:
+                return SampleSet.create_empty()
+        else:
+            return SampleSet.create_empty()
 
     def _prepare_sample_names_query_message(self, sample_names: Union[str, List[str]],
                                             query_message_prefix: str,
@@ -319,8 +374,9 @@ class SamplesQueryIndex(SamplesQuery):
                                                                        ncores=ncores)
 
     def _create_from(self, sample_set: SampleSet, universe_set: SampleSet,
-                     queries_collection: QueriesCollection) -> SamplesQuery:
+                     queries_collection: QueriesCollection, unknown_set: SampleSet = None) -> SamplesQuery:
         return SamplesQueryIndex(connection=self._query_connection,
                                  universe_set=universe_set,
                                  sample_set=sample_set,
-                                 queries_collection=queries_collection)
+                                 queries_collection=queries_collection,
+                                 unknown_set=unknown_set)
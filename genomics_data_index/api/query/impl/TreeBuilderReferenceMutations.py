@@ -1,4 +1,6 @@
 import logging
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import Union, Iterable, Tuple
 
 from ete3 import Tree
@@ -33,7 +35,8 @@ class TreeBuilderReferenceMutations(TreeBuilder):
                       ncores: int = 1,
                       align_type: str = 'full',
                       include_reference: bool = True,
-                      extra_params: str = None) -> Tuple[Tree, int, SampleSet]:
+                      extra_params: str = None,
+                      use_alignment_cache: bool = False) -> Tuple[Tree, int, SampleSet]:
         sample_service = self._database_connection.sample_service
         alignment_service = self._database_connection.alignment_service
         tree_service = self._database_connection.tree_service
@@ -53,12 +56,17 @@ class TreeBuilderReferenceMutations(TreeBuilder):
                            f'that are found on reference [{self._reference_name}]')
 
         logger.info('Building build_tree using "iqtree" for {len(tree_samples_set)}) samples')
-        alignment_data = alignment_service.construct_alignment(reference_name=self._reference_name,
-                                                               samples=samples_names,
-                                                               align_type=align_type,
-                                                               include_reference=include_reference)
-        tree_data, out = tree_service.build_tree(alignment_data, tree_build_type='iqtree',
-                                                 num_cores=ncores, align_type=align_type,
-                                                 extra_params=extra_params)
+        with TemporaryDirectory() as tmp_dir:
+            alignment_file = Path(tmp_dir) / 'alignment.fasta'
+            alignment_length = alignment_service.write_alignment(output_file=alignment_file,
+                                                                 reference_name=self._reference_name,
+                                                                 samples=list(samples_names),
+                                                                 align_type=align_type,
+                                                                 include_reference=include_reference,
+                                                                 ncores=ncores,
+                                                                 use_cache=use_alignment_cache)
+            tree_data, out = tree_service.build_tree(alignment_file, tree_build_type='iqtree',
+                                                     num_cores=ncores, align_type=align_type,
+                                                     extra_params=extra_params)
 
-        return tree_data, alignment_data.get_alignment_length(), tree_samples_set
+        return tree_data, alignment_length, tree_samples_set
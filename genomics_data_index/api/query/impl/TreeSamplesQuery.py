@@ -11,7 +11,7 @@ from genomics_data_index.api.query.SamplesQuery import SamplesQuery
 from genomics_data_index.api.query.impl.WrappedSamplesQuery import WrappedSamplesQuery
 from genomics_data_index.api.viewer.TreeStyler import TreeStyler, HighlightStyle
 from genomics_data_index.configuration.connector import DataIndexConnection
-from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.CladeIndex import CladeIndex
 
 logger = logging.getLogger(__name__)
 
@@ -28,30 +28,8 @@ class TreeSamplesQuery(WrappedSamplesQuery, abc.ABC):
         if isinstance(sample_names, str):
             sample_names = [sample_names]
 
-        sample_name_ids = self._get_sample_name_ids()
-        sample_leaves_list = []
-        for name in sample_names:
-            sample_leaves = self._tree.get_leaves_by_name(name)
-            if len(sample_leaves) != 1:
-                raise Exception(
-                    f'Invalid number of matching leaves for sample [{name}], leaves {sample_leaves}')
-            else:
-                sample_leaves_list.append(sample_leaves[0])
-
-        if len(sample_leaves_list) == 0:
-            raise Exception(f'Should at least have some leaves in the tree matching sample_names={sample_names}')
-        elif len(sample_leaves_list) == 1:
-            found_sample_names = sample_names
-        else:
-            first_sample_leaf = sample_leaves_list.pop()
-            ancestor_node = first_sample_leaf.get_common_ancestor(sample_leaves_list)
-            found_sample_names = ancestor_node.get_leaf_names()
-
-        found_samples_list = []
-        for name in found_sample_names:
-            if name in sample_name_ids:
-                found_samples_list.append(sample_name_ids[name])
-        found_samples = SampleSet(found_samples_list)
+        clade_index = CladeIndex.get(self._tree, self._query_connection.sample_service)
+        found_samples = clade_index.mrca_samples(sample_names)
         return self.intersect(found_samples, f'within(mrca of {sample_names})')
 
     def _isin_internal(self, data: Union[str, List[str], pd.Series], kind: str, **kwargs) -> SamplesQuery:
@@ -125,7 +103,8 @@ class TreeSamplesQuery(WrappedSamplesQuery, abc.ABC):
                     annotate_label_fontsize: int = 12,
                     show_leaf_names: bool = True) -> TreeStyler:
 
-        return TreeStyler.create(tree=self._tree.copy(method='deepcopy'),
+        # The tree is not modified by the TreeStyler so there is no need to copy it
+        return TreeStyler.create(tree=self._tree,
                                  initial_style=initial_style,
                                  mode=mode,
                                  highlight_style=highlight_style,
@@ -152,8 +131,13 @@ class TreeSamplesQuery(WrappedSamplesQuery, abc.ABC):
                                  annotate_box_label_color=annotate_box_label_color,
                                  annotate_arc_span=annotate_arc_span,
                                  annotate_label_fontsize=annotate_label_fontsize,
-                                 show_leaf_names=show_leaf_names)
+                                 show_leaf_names=show_leaf_names,
+                                 sample_service=self._query_connection.sample_service)
 
     @property
     def tree(self):
-        return self._tree
+        """
+        A copy of the tree of this query. The tree of this query is shared with other queries (and indexes of the tree)
+        so only copies are handed out.
+        """
+        return self._tree.copy(method='cpickle')
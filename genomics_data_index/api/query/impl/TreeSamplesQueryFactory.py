@@ -98,7 +98,7 @@ class TreeSamplesQueryFactory:
                                      include_reference: bool = True):
         return self._create_tree_samples_query_from_tree(kind=kind,
                                                          connection=connection, wrapped_query=wrapped_query,
-                                                         tree=reference_genome.tree,
+                                                         tree=reference_genome.shared_tree(),
                                                          alignment_length=reference_genome.tree_alignment_length,
                                                          reference_name=reference_genome.name,
                                                          include_reference=include_reference)
@@ -31,6 +31,10 @@ class WrappedSamplesQuery(SamplesQuery, abc.ABC):
     def sample_set(self) -> SampleSet:
         return self._wrapped_query.sample_set
 
+    @property
+    def unknown_set(self) -> SampleSet:
+        return self._wrapped_query.unknown_set
+
     def reset_universe(self) -> SamplesQuery:
         return self._wrap_create(self._wrapped_query.reset_universe())
 
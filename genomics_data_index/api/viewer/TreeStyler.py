@@ -2,16 +2,24 @@ from __future__ import annotations
 
 import copy
 import logging
-from typing import List, Dict, Any, Union, Iterable, Tuple
+from typing import List, Dict, Any, Union, Iterable, Tuple, Set
 
 from ete3 import Tree, NodeStyle, TreeStyle, CircleFace, TextFace, RectFace, Face
 
 from genomics_data_index.api.query.SamplesQuery import SamplesQuery
+from genomics_data_index.storage.CladeIndex import CladeIndex
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.service.SampleService import SampleService
 
 logger = logging.getLogger(__name__)
 
 
 class TreeStyler:
+    """
+    Styles a tree for rendering. Calls to annotate() and highlight() only record what to draw
+    (see TreeAnnotation and TreeHighlight), which is applied all at once to a single copy of the tree
+    when the tree is rendered. The tree passed to a TreeStyler is never modified.
+    """
     MODES = ['r', 'c']
     ANNOTATE_KINDS = ['circle', 'rect', 'rectangle']
 
@@ -30,7 +38,11 @@ class TreeStyler:
                  annotate_margin: int = 0,
                  annotate_show_box_label: bool = False,
                  annotate_box_label_color: str = 'white',
-                 annotate_label_fontsize: int = 12):
+                 annotate_label_fontsize: int = 12,
+                 sample_service: SampleService = None,
+                 annotations: Tuple[TreeAnnotation, ...] = (),
+                 highlights: Tuple[TreeHighlight, ...] = (),
+                 legend_items: Tuple[Tuple[str, str, str], ...] = ()):
         self._tree = tree
         self._default_highlight_styles = default_highlight_styles
         self._tree_style = tree_style
@@ -49,6 +61,10 @@ class TreeStyler:
         self._annotate_show_box_label = annotate_show_box_label
         self._annotate_box_label_color = annotate_box_label_color
         self._annotate_label_fontsize = annotate_label_fontsize
+        self._sample_service = sample_service
+        self._annotations = annotations
+        self._highlights = highlights
+        self._legend_items = legend_items
 
         if annotate_kind not in self.ANNOTATE_KINDS:
             raise Exception(f'Invalid value for annotate_kind={annotate_kind}.'
@@ -149,11 +165,6 @@ class TreeStyler:
         else:
             label_present = None
 
-        if isinstance(samples, SamplesQuery):
-            sample_names = set(samples.tolist(names=True))
-        else:
-            sample_names = set(samples)
-
         if box_width is None:
             face_width = self._annotate_box_width
         else:
@@ -164,46 +175,20 @@ class TreeStyler:
         else:
             face_height = box_height
 
-        ts = copy.deepcopy(self._tree_style)
-        if label is not None:
-            text = label.get('text', None)
-            fsize = label.get('fontsize', self._annotate_label_fontsize)
-            ftype = label.get('font', 'Verdana')
-            color = label.get('color', 'black')
-            tf = TextFace(text, fsize=fsize, ftype=ftype, fgcolor=color)
-            tf.margin_bottom = 10
-            tf.margin_left = 10
-            tf.margin_right = 10
-            tf.margin_top = 10
-            tf.hz_align = 1
-            ts.aligned_header.add_face(tf, self._annotate_column)
-            ts.aligned_foot.add_face(tf, self._annotate_column)
-
-        # Annotate nodes
-        tree = self._tree.copy(method='deepcopy')
-        for leaf in tree.iter_leaves():
-            if leaf.name in sample_names:
-                annotate_face = self._build_annotate_face(width=face_width, height=face_height,
-                                                          border_color=self._annotate_border_color,
-                                                          bgcolor=color_present, opacity=self._annotate_opacity_present,
-                                                          label=label_present)
-            else:
-                annotate_face = self._build_annotate_face(width=face_width, height=face_height,
-                                                          border_color=self._annotate_border_color,
-                                                          bgcolor=color_absent, opacity=self._annotate_opacity_absent,
-                                                          label=None)
-
-            leaf.add_face(annotate_face, column=self._annotate_column, position='aligned')
+        annotation = TreeAnnotation(samples=self._selected_samples(samples), column=self._annotate_column,
+                                    label=label, label_present=label_present,
+                                    width=face_width, height=face_height,
+                                    color_present=color_present, color_absent=color_absent)
 
         # Add legend item
         if legend_label is not None:
-            color_face, text_face = self._build_legend_item(color=color_present, legend_label=legend_label,
-                                                            kind=self._annotate_kind)
-            ts.legend.add_face(color_face, column=0)
-            ts.legend.add_face(text_face, column=1)
+            legend_items = self._legend_items + ((color_present, legend_label, self._annotate_kind),)
+        else:
+            legend_items = self._legend_items
 
-        return TreeStyler(tree, default_highlight_styles=self._default_highlight_styles,
-                          tree_style=ts, legend_fsize=self._legend_fsize, legend_nsize=self._legend_nsize,
+        return TreeStyler(self._tree, default_highlight_styles=self._default_highlight_styles,
+                          tree_style=self._tree_style, legend_fsize=self._legend_fsize,
+                          legend_nsize=self._legend_nsize,
                           annotate_column=self._annotate_column + 1,
                           annotate_color_present=self._annotate_color_present,
                           annotate_color_absent=self._annotate_color_absent,
@@ -217,7 +202,11 @@ class TreeStyler:
                           annotate_margin=self._annotate_margin,
                           annotate_show_box_label=self._annotate_show_box_label,
                           annotate_box_label_color=self._annotate_box_label_color,
-                          annotate_label_fontsize=self._annotate_label_fontsize)
+                          annotate_label_fontsize=self._annotate_label_fontsize,
+                          sample_service=self._sample_service,
+                          annotations=self._annotations + (annotation,),
+                          highlights=self._highlights,
+                          legend_items=legend_items)
 
     def highlight(self, samples: Union[SamplesQuery, Iterable[str]],
                   nstyle: NodeStyle = None, legend_color: str = None,
@@ -229,37 +218,17 @@ class TreeStyler:
         else:
             new_default_styles = self._default_highlight_styles
 
-        if isinstance(samples, SamplesQuery):
-            sample_names = samples.tolist(names=True)
-            query_expression = samples.query_expression()
-        else:
-            sample_names = set(samples)
-            query_expression = f'set({len(sample_names)} samples)'
+        highlight = TreeHighlight(samples=self._selected_samples(samples), nstyle=nstyle)
 
         # Add legend item
         if legend_label is not None:
-            ts = copy.deepcopy(self._tree_style)
-            color_face, text_face = self._build_legend_item(color=legend_color, legend_label=legend_label,
-                                                            kind='rect')
-            ts.legend.add_face(color_face, column=0)
-            ts.legend.add_face(text_face, column=1)
+            legend_items = self._legend_items + ((legend_color, legend_label, 'rect'),)
         else:
-            ts = self._tree_style
-
-        # Highlight nodes
-        tree = copy.deepcopy(self._tree)
-        for name in sample_names:
-            nodes = tree.get_leaves_by_name(name)
-            if len(nodes) == 0:
-                logger.warning(f'Could not find sample=[{name}] in tree. Not highlighting.')
-            elif len(nodes) > 1:
-                raise Exception(f'More than one node in the tree matched sample=[{name}]')
-            else:
-                node = nodes[0]
-                node.set_style(nstyle)
+            legend_items = self._legend_items
 
-        return TreeStyler(tree, default_highlight_styles=new_default_styles,
-                          tree_style=ts, legend_fsize=self._legend_fsize, legend_nsize=self._legend_nsize,
+        return TreeStyler(self._tree, default_highlight_styles=new_default_styles,
+                          tree_style=self._tree_style, legend_fsize=self._legend_fsize,
+                          legend_nsize=self._legend_nsize,
                           annotate_column=self._annotate_column,
                           annotate_color_present=self._annotate_color_present,
                           annotate_color_absent=self._annotate_color_absent,
@@ -273,12 +242,112 @@ class TreeStyler:
                           annotate_margin=self._annotate_margin,
                           annotate_show_box_label=self._annotate_show_box_label,
                           annotate_box_label_color=self._annotate_box_label_color,
-                          annotate_label_fontsize=self._annotate_label_fontsize)
+                          annotate_label_fontsize=self._annotate_label_fontsize,
+                          sample_service=self._sample_service,
+                          annotations=self._annotations,
+                          highlights=self._highlights + (highlight,),
+                          legend_items=legend_items)
+
+    def _selected_samples(self, samples: Union[SamplesQuery, Iterable[str]]) -> Union[SampleSet, Set[str]]:
+        """
+        Gets the samples to record for an annotation or highlight. If possible this is the SampleSet of the query
+        (so no database query is needed), otherwise it is the set of sample names.
+        """
+        if isinstance(samples, SamplesQuery):
+            if self._sample_service is not None:
+                return samples.sample_set
+            else:
+                return set(samples.tolist(names=True))
+        else:
+            return set(samples)
+
+    def _leaf_names_in(self, samples: Union[SampleSet, Set[str]]) -> Set[str]:
+        if isinstance(samples, SampleSet):
+            return set(CladeIndex.get(self._tree, self._sample_service).leaf_names_in(samples))
+        else:
+            return samples
+
+    def _warn_samples_not_in_tree(self, samples: Union[SampleSet, Set[str]]) -> None:
+        # Samples given by name are checked against the leaves of the tree when highlighting
+        if isinstance(samples, SampleSet):
+            missing_samples = samples.minus(CladeIndex.get(self._tree, self._sample_service).leaf_samples)
+            if not missing_samples.is_empty():
+                for sample in self._sample_service.find_samples_by_ids(missing_samples):
+                    logger.warning(f'Could not find sample=[{sample.name}] in tree. Not highlighting.')
+
+    def _build_header_face(self, label: Dict[str, Any]) -> Face:
+        text = label.get('text', None)
+        fsize = label.get('fontsize', self._annotate_label_fontsize)
+        ftype = label.get('font', 'Verdana')
+        color = label.get('color', 'black')
+        tf = TextFace(text, fsize=fsize, ftype=ftype, fgcolor=color)
+        tf.margin_bottom = 10
+        tf.margin_left = 10
+        tf.margin_right = 10
+        tf.margin_top = 10
+        tf.hz_align = 1
+        return tf
+
+    def _styled_tree_style(self) -> TreeStyle:
+        ts = copy.deepcopy(self._tree_style)
+        for annotation in self._annotations:
+            if annotation.label is not None:
+                tf = self._build_header_face(annotation.label)
+                ts.aligned_header.add_face(tf, annotation.column)
+                ts.aligned_foot.add_face(tf, annotation.column)
+
+        for color, legend_label, kind in self._legend_items:
+            color_face, text_face = self._build_legend_item(color=color, legend_label=legend_label, kind=kind)
+            ts.legend.add_face(color_face, column=0)
+            ts.legend.add_face(text_face, column=1)
+
+        return ts
+
+    def _styled_tree(self) -> Tree:
+        tree = self._tree.copy(method='cpickle')
+        if len(self._annotations) == 0 and len(self._highlights) == 0:
+            return tree
+
+        leaves_by_name = {}
+        for leaf in tree.iter_leaves():
+            leaves_by_name.setdefault(leaf.name, []).append(leaf)
+
+        # Highlight nodes (later highlights replace the style of earlier highlights)
+        for highlight in self._highlights:
+            self._warn_samples_not_in_tree(highlight.samples)
+            for name in self._leaf_names_in(highlight.samples):
+                nodes = leaves_by_name.get(name, [])
+                if len(nodes) == 0:
+                    logger.warning(f'Could not find sample=[{name}] in tree. Not highlighting.')
+                elif len(nodes) > 1:
+                    raise Exception(f'More than one node in the tree matched sample=[{name}]')
+                else:
+                    nodes[0].set_style(highlight.nstyle)
+
+        # Annotate nodes, with the faces for present and absent samples shared by all leaves in the column
+        for annotation in self._annotations:
+            sample_names = self._leaf_names_in(annotation.samples)
+            present_face = self._build_annotate_face(width=annotation.width, height=annotation.height,
+                                                     border_color=self._annotate_border_color,
+                                                     bgcolor=annotation.color_present,
+                                                     opacity=self._annotate_opacity_present,
+                                                     label=annotation.label_present)
+            absent_face = self._build_annotate_face(width=annotation.width, height=annotation.height,
+                                                    border_color=self._annotate_border_color,
+                                                    bgcolor=annotation.color_absent,
+                                                    opacity=self._annotate_opacity_absent,
+                                                    label=None)
+            for name, leaves in leaves_by_name.items():
+                annotate_face = present_face if name in sample_names else absent_face
+                for leaf in leaves:
+                    leaf.add_face(annotate_face, column=annotation.column, position='aligned')
+
+        return tree
 
     def render(self, file_name: str = '%%inline', w: int = None, h: int = None,
                tree_style: TreeStyle = None, units: str = 'px', dpi: int = 90):
         if tree_style is None:
-            tree_style = self._tree_style
+            tree_style = self._styled_tree_style()
 
         # Set default width if no width or height specified
         # Do this here instead of as a default method value since at least one of
@@ -287,16 +356,16 @@ class TreeStyler:
         if w is None and h is None:
             w = 400
 
-        return self._tree.render(file_name=file_name, w=w, h=h, tree_style=tree_style,
-                                 units=units, dpi=dpi)
+        return self._styled_tree().render(file_name=file_name, w=w, h=h, tree_style=tree_style,
+                                          units=units, dpi=dpi)
 
     @property
     def tree(self) -> Tree:
-        return copy.deepcopy(self._tree)
+        return self._styled_tree()
 
     @property
     def tree_style(self) -> TreeStyle:
-        return copy.deepcopy(self._tree_style)
+        return self._styled_tree_style()
 
     @classmethod
     def create(cls, tree: Tree,
@@ -325,7 +394,8 @@ class TreeStyler:
                annotate_box_label_color: str = 'white',
                annotate_arc_span: int = 350,
                annotate_label_fontsize: int = 12,
-               show_leaf_names: bool = True) -> TreeStyler:
+               show_leaf_names: bool = True,
+               sample_service: SampleService = None) -> TreeStyler:
         if initial_style is not None:
             tree_style_elements = {'mode': mode, 'annotate_guiding_lines': annotate_guiding_lines,
                                    'figure_margin': figure_margin, 'show_border': show_border,
@@ -396,7 +466,35 @@ class TreeStyler:
                           annotate_margin=annotate_margin,
                           annotate_show_box_label=annotate_show_box_label,
                           annotate_box_label_color=annotate_box_label_color,
-                          annotate_label_fontsize=annotate_label_fontsize)
+                          annotate_label_fontsize=annotate_label_fontsize,
+                          sample_service=sample_service)
+
+
+class TreeAnnotation:
+    """
+    An annotation column recorded by TreeStyler.annotate(): the samples present in the column and how to draw them.
+    """
+
+    def __init__(self, samples: Union[SampleSet, Set[str]], column: int, label: Dict[str, Any],
+                 label_present: Dict[str, Any], width: int, height: int, color_present: str, color_absent: str):
+        self.samples = samples
+        self.column = column
+        self.label = label
+        self.label_present = label_present
+        self.width = width
+        self.height = height
+        self.color_present = color_present
+        self.color_absent = color_absent
+
+
+class TreeHighlight:
+    """
+    A highlight recorded by TreeStyler.highlight(): the samples to highlight and the style to highlight them with.
+    """
+
+    def __init__(self, samples: Union[SampleSet, Set[str]], nstyle: NodeStyle):
+        self.samples = samples
+        self.nstyle = nstyle
 
 
 class HighlightStyle:
@@ -13,7 +13,6 @@ import click
 import click_config_file
 import coloredlogs
 import pandas as pd
-from Bio import AlignIO
 
 import genomics_data_index.storage.service.FeatureService as FeatureService
 from genomics_data_index.cli import yaml_config_provider
@@ -25,8 +24,6 @@ from genomics_data_index.storage.io.mlst.MLSTSampleDataPackage import MLSTSample
 from genomics_data_index.storage.io.mlst.MLSTSistrReader import MLSTSistrReader
 from genomics_data_index.storage.io.mlst.MLSTTSeemannFeaturesReader import MLSTTSeemannFeaturesReader
 from genomics_data_index.storage.io.mutation.NucleotideSampleDataPackage import NucleotideSampleDataPackage
-from genomics_data_index.storage.io.processor.MultipleProcessSampleFilesProcessor import \
-    MultipleProcessSampleFilesProcessor
 from genomics_data_index.storage.io.processor.NullSampleFilesProcessor import NullSampleFilesProcessor
 from genomics_data_index.storage.model.QueryFeatureMLST import QueryFeatureMLST
 from genomics_data_index.storage.model.QueryFeatureMutation import QueryFeatureMutation
@@ -45,6 +42,18 @@ LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 
 click.option = partial(click.option, show_default=True)
 
+use_alignment_cache_option = click.option('--use-alignment-cache/--no-use-alignment-cache', default=False,
+                                          help='Select alignment rows from an alignment of all samples which is kept '
+                                               'in the index and updated as samples are added (uses disk space and '
+                                               'memory proportional to all samples in the index)')
+
+tree_drift_threshold_option = click.option('--tree-drift-threshold',
+                                           help='When building a tree and a tree already exists, new samples are '
+                                                'placed into the existing tree until the number of samples placed '
+                                                'since the tree was last fully rebuilt exceeds this fraction of the '
+                                                'samples in the tree',
+                                           default=TreeService.DEFAULT_DRIFT_THRESHOLD, type=click.FloatRange(min=0))
+
 
 def setup_logging(log_level: str) -> None:
     if log_level == 'DEBUG':
@@ -104,7 +113,8 @@ def load(ctx):
 
 
 def load_variants_common(ctx, data_package: NucleotideSampleDataPackage, reference_file, input, build_tree, align_type,
-                         extra_tree_params: str):
+                         extra_tree_params: str, tree_drift_threshold: float = TreeService.DEFAULT_DRIFT_THRESHOLD,
+                         use_alignment_cache: bool = False):
     reference_service = ctx.obj['data_index_connection'].reference_service
     variation_service = cast(VariationService, ctx.obj['data_index_connection'].variation_service)
     sample_service = cast(SampleService, ctx.obj['data_index_connection'].sample_service)
@@ -123,15 +133,23 @@ def load_variants_common(ctx, data_package: NucleotideSampleDataPackage, referen
         reference_name = get_genome_name(reference_file)
 
         variation_service.insert(feature_scope_name=reference_name,
-                                 data_package=data_package)
+                                 data_package=data_package,
+                                 ncores=ncores)
         click.echo(f'Loaded variants from [{input}] into database')
 
         if build_tree:
-            tree_service.rebuild_tree(reference_name=reference_name,
-                                      align_type=align_type,
-                                      num_cores=ncores,
-                                      extra_params=extra_tree_params)
-            click.echo('Finished building tree of all samples')
+            result = tree_service.place_samples(reference_name=reference_name,
+                                                align_type=align_type,
+                                                num_cores=ncores,
+                                                extra_params=extra_tree_params,
+                                                drift_threshold=tree_drift_threshold,
+                                                use_alignment_cache=use_alignment_cache)
+            if result == TreeService.SAMPLES_PLACED:
+                click.echo('Finished placing samples into existing tree')
+            elif result == TreeService.TREE_REBUILT:
+                click.echo('Finished building tree of all samples')
+            else:
+                click.echo('No new samples to add to existing tree')
 
 
 @load.command(name='snippy')
@@ -143,27 +161,23 @@ def load_variants_common(ctx, data_package: NucleotideSampleDataPackage, referen
               type=click.Choice(CoreAlignmentService.ALIGN_TYPES))
 @click.option('--extra-tree-params', help='Extra parameters to tree-building software',
               default=None)
-def load_snippy(ctx, snippy_dir: Path, reference_file: Path, build_tree: bool, align_type: str, extra_tree_params: str):
-    ncores = ctx.obj['ncores']
-
+@tree_drift_threshold_option
+@use_alignment_cache_option
+def load_snippy(ctx, snippy_dir: Path, reference_file: Path, build_tree: bool, align_type: str, extra_tree_params: str,
+                tree_drift_threshold: float, use_alignment_cache: bool):
     snippy_dir = Path(snippy_dir)
     reference_file = Path(reference_file)
     click.echo(f'Loading {snippy_dir}')
     sample_dirs = [snippy_dir / d for d in listdir(snippy_dir) if path.isdir(snippy_dir / d)]
 
-    with TemporaryDirectory() as preprocess_dir:
-        if ncores > 1:
-            file_processor = MultipleProcessSampleFilesProcessor(preprocess_dir=Path(preprocess_dir),
-                                                                 processing_cores=ncores)
-        else:
-            file_processor = NullSampleFilesProcessor.instance()
-
-        data_package = NucleotideSampleDataPackage.create_from_snippy(sample_dirs,
-                                                                      sample_files_processor=file_processor)
+    # Files are preprocessed in parallel (using ncores) when sample data is persisted during insert
+    data_package = NucleotideSampleDataPackage.create_from_snippy(
+        sample_dirs, sample_files_processor=NullSampleFilesProcessor.instance())
 
-        load_variants_common(ctx=ctx, data_package=data_package, reference_file=reference_file,
-                             input=snippy_dir, build_tree=build_tree, align_type=align_type,
-                             extra_tree_params=extra_tree_params)
+    load_variants_common(ctx=ctx, data_package=data_package, reference_file=reference_file,
+                         input=snippy_dir, build_tree=build_tree, align_type=align_type,
+                         extra_tree_params=extra_tree_params, tree_drift_threshold=tree_drift_threshold,
+                         use_alignment_cache=use_alignment_cache)
 
 
 @load.command(name='vcf')
@@ -175,10 +189,12 @@ def load_snippy(ctx, snippy_dir: Path, reference_file: Path, build_tree: bool, a
               type=click.Choice(CoreAlignmentService.ALIGN_TYPES))
 @click.option('--extra-tree-params', help='Extra parameters to tree-building software',
               default=None)
-def load_vcf(ctx, vcf_fofns: str, reference_file: str, build_tree: bool, align_type: str, extra_tree_params: str):
+@tree_drift_threshold_option
+@use_alignment_cache_option
+def load_vcf(ctx, vcf_fofns: str, reference_file: str, build_tree: bool, align_type: str, extra_tree_params: str,
+             tree_drift_threshold: float, use_alignment_cache: bool):
     vcf_fofns = Path(vcf_fofns)
     reference_file = Path(reference_file)
-    ncores = ctx.obj['ncores']
 
     click.echo(f'Loading files listed in {vcf_fofns}')
     sample_vcf_map = {}
@@ -192,20 +208,16 @@ def load_vcf(ctx, vcf_fofns: str, reference_file: str, build_tree: bool, align_t
         if not pd.isna(row['Mask File']):
             mask_files_map[row['Sample']] = row['Mask File']
 
-    with TemporaryDirectory() as preprocess_dir:
-        if ncores > 1:
-            file_processor = MultipleProcessSampleFilesProcessor(preprocess_dir=Path(preprocess_dir),
-                                                                 processing_cores=ncores)
-        else:
-            file_processor = NullSampleFilesProcessor.instance()
-
-        data_package = NucleotideSampleDataPackage.create_from_sequence_masks(sample_vcf_map=sample_vcf_map,
-                                                                              masked_genomic_files_map=mask_files_map,
-                                                                              sample_files_processor=file_processor)
+    # Files are preprocessed in parallel (using ncores) when sample data is persisted during insert
+    data_package = NucleotideSampleDataPackage.create_from_sequence_masks(
+        sample_vcf_map=sample_vcf_map,
+        masked_genomic_files_map=mask_files_map,
+        sample_files_processor=NullSampleFilesProcessor.instance())
 
-        load_variants_common(ctx=ctx, data_package=data_package, reference_file=reference_file,
-                             input=Path(vcf_fofns), build_tree=build_tree, align_type=align_type,
-                             extra_tree_params=extra_tree_params)
+    load_variants_common(ctx=ctx, data_package=data_package, reference_file=reference_file,
+                         input=Path(vcf_fofns), build_tree=build_tree, align_type=align_type,
+                         extra_tree_params=extra_tree_params, tree_drift_threshold=tree_drift_threshold,
+                         use_alignment_cache=use_alignment_cache)
 
 
 @load.command(name='kmer')
@@ -330,6 +342,8 @@ def analysis(ctx):
               type=click.Choice(CoreAlignmentService.ALIGN_TYPES))
 @click.option('--extra-tree-params', help='Extra parameters to tree-building software',
               default=None)
+@tree_drift_threshold_option
+@use_alignment_cache_option
 @click.option('--use-conda/--no-use-conda', help="Use (or don't use) conda for dependency management for pipeline.",
               default=False)
 @click.option('--include-mlst/--no-include-mlst', help="Enable/disable including basic MLST in results.",
@@ -350,7 +364,7 @@ def analysis(ctx):
               required=False)
 @click.argument('assembled_genomes', type=click.Path(exists=True), nargs=-1)
 def assembly(ctx, reference_file: str, index: bool, clean: bool, build_tree: bool, align_type: str,
-             extra_tree_params: str, use_conda: bool,
+             extra_tree_params: str, tree_drift_threshold: float, use_alignment_cache: bool, use_conda: bool,
              include_mlst: bool, include_kmer: bool, kmer_size: List[int], kmer_scaled: int,
              batch_size: int,
              assembly_input_file: str, assembled_genomes: List[str]):
@@ -397,7 +411,8 @@ def assembly(ctx, reference_file: str, index: bool, clean: bool, build_tree: boo
         try:
             logger.info(f'Indexing processed VCF files defined in [{processed_files_fofn}]')
             ctx.invoke(load_vcf, vcf_fofns=str(processed_files_fofn), reference_file=reference_file,
-                       build_tree=build_tree, align_type=align_type, extra_tree_params=extra_tree_params)
+                       build_tree=build_tree, align_type=align_type, extra_tree_params=extra_tree_params,
+                       tree_drift_threshold=tree_drift_threshold, use_alignment_cache=use_alignment_cache)
         except Exception as e:
             logger.exception(e)
             logger.error(f"Error while indexing. Please verify files in [{snakemake_directory}] are correct.")
@@ -442,9 +457,9 @@ def export_tree(ctx, name: List[str], ascii: bool):
     for ref_name in name:
         reference = ctx.obj['data_index_connection'].reference_service.find_reference_genome(ref_name)
         if ascii:
-            click.echo(str(reference.tree))
+            click.echo(str(reference.shared_tree()))
         else:
-            click.echo(reference.tree.write())
+            click.echo(reference.shared_tree().write())
 
 
 @main.group()
@@ -462,10 +477,13 @@ def build(ctx):
               type=click.Choice(CoreAlignmentService.ALIGN_TYPES))
 @click.option('--sample', help='Sample to include in alignment (can list more than one).',
               multiple=True, type=str)
-def alignment(ctx, output_file: Path, reference_name: str, align_type: str, sample: List[str]):
+@use_alignment_cache_option
+def alignment(ctx, output_file: Path, reference_name: str, align_type: str, sample: List[str],
+              use_alignment_cache: bool):
     alignment_service = ctx.obj['data_index_connection'].alignment_service
     reference_service = ctx.obj['data_index_connection'].reference_service
     sample_service = ctx.obj['data_index_connection'].sample_service
+    ncores = ctx.obj['ncores']
 
     if not reference_service.exists_reference_genome(reference_name):
         logger.error(f'Reference genome [{reference_name}] does not exist')
@@ -477,14 +495,14 @@ def alignment(ctx, output_file: Path, reference_name: str, align_type: str, samp
         logger.error(f'Samples {set(sample) - found_samples} do not exist')
         sys.exit(1)
 
-    alignment_data = alignment_service.construct_alignment(reference_name=reference_name,
-                                                           samples=sample,
-                                                           align_type=align_type,
-                                                           include_reference=True)
-
-    with open(output_file, 'w') as f:
-        AlignIO.write(alignment_data, f, 'fasta')
-        click.echo(f'Wrote alignment to [{output_file}]')
+    alignment_service.write_alignment(output_file=Path(output_file),
+                                      reference_name=reference_name,
+                                      samples=sample,
+                                      align_type=align_type,
+                                      include_reference=True,
+                                      ncores=ncores,
+                                      use_cache=use_alignment_cache)
+    click.echo(f'Wrote alignment to [{output_file}]')
 
 
 @build.command()
@@ -499,8 +517,9 @@ def alignment(ctx, output_file: Path, reference_name: str, align_type: str, samp
               multiple=True, type=str)
 @click.option('--extra-params', help='Extra parameters to tree-building software',
               default=None)
+@use_alignment_cache_option
 def tree(ctx, output_file: Path, reference_name: str, align_type: str,
-         tree_build_type: str, sample: List[str], extra_params: str):
+         tree_build_type: str, sample: List[str], extra_params: str, use_alignment_cache: bool):
     alignment_service = ctx.obj['data_index_connection'].alignment_service
     tree_service = ctx.obj['data_index_connection'].tree_service
     reference_service = ctx.obj['data_index_connection'].reference_service
@@ -521,15 +540,20 @@ def tree(ctx, output_file: Path, reference_name: str, align_type: str,
         logger.error(f'align_type=[{align_type}] is not supported for tree_build_type=[{tree_build_type}]')
         sys.exit(1)
 
-    alignment_data = alignment_service.construct_alignment(reference_name=reference_name,
-                                                           samples=sample,
-                                                           align_type=align_type,
-                                                           include_reference=True)
-
     log_file = f'{output_file}.log'
 
-    tree_data, out = tree_service.build_tree(alignment_data, tree_build_type=tree_build_type,
-                                             num_cores=ncores, align_type=align_type, extra_params=extra_params)
+    with TemporaryDirectory() as tmp_dir:
+        alignment_file = Path(tmp_dir) / 'alignment.fasta'
+        alignment_service.write_alignment(output_file=alignment_file,
+                                          reference_name=reference_name,
+                                          samples=sample,
+                                          align_type=align_type,
+                                          include_reference=True,
+                                          ncores=ncores,
+                                          use_cache=use_alignment_cache)
+
+        tree_data, out = tree_service.build_tree(alignment_file, tree_build_type=tree_build_type,
+                                                 num_cores=ncores, align_type=align_type, extra_params=extra_params)
     tree_data.write(outfile=output_file)
     click.echo(f'Wrote tree to [{output_file}]')
     with open(log_file, 'w') as log:
@@ -551,7 +575,8 @@ def rebuild(ctx):
               type=click.Choice(CoreAlignmentService.ALIGN_TYPES))
 @click.option('--extra-params', help='Extra parameters to tree-building software',
               default=None)
-def rebuild_tree(ctx, reference: List[str], align_type: str, extra_params: str):
+@use_alignment_cache_option
+def rebuild_tree(ctx, reference: List[str], align_type: str, extra_params: str, use_alignment_cache: bool):
     tree_service = ctx.obj['data_index_connection'].tree_service
     reference_service = ctx.obj['data_index_connection'].reference_service
     ncores = ctx.obj['ncores']
@@ -571,10 +596,34 @@ def rebuild_tree(ctx, reference: List[str], align_type: str, extra_params: str):
         tree_service.rebuild_tree(reference_name=reference_name,
                                   align_type=align_type,
                                   num_cores=ncores,
-                                  extra_params=extra_params)
+                                  extra_params=extra_params,
+                                  use_alignment_cache=use_alignment_cache)
         logger.info(f'Finished rebuilding tree')
 
 
+@rebuild.command(name='unknown-index')
+@click.pass_context
+@click.argument('reference', type=str, nargs=-1)
+def rebuild_unknown_index(ctx, reference: List[str]):
+    variation_service = cast(VariationService, ctx.obj['data_index_connection'].variation_service)
+    reference_service = ctx.obj['data_index_connection'].reference_service
+
+    if len(reference) == 0:
+        logger.error('Must define name of reference genome to use. '
+                     'To see available genomes try "variants list genomes"')
+        sys.exit(1)
+
+    for reference_name in reference:
+        if not reference_service.exists_reference_genome(reference_name):
+            logger.error(f'Reference genome [{reference_name}] does not exist')
+            sys.exit(1)
+
+    for reference_name in reference:
+        logger.info(f'Started rebuilding index of unknown regions for reference genome [{reference_name}]')
+        variation_service.rebuild_unknown_samples_index(reference_name)
+        logger.info(f'Finished rebuilding index of unknown regions')
+
+
 @main.group()
 @click.pass_context
 def query(ctx):
@@ -654,3 +703,12 @@ UNITS = ['B', 'KB', 'MB', 'GB']
 def db_size(ctx, unit):
     size_df = ctx.obj['data_index_connection'].db_size(unit)
     size_df.to_csv(sys.stdout, sep='\t', index=False, float_format='%0.2f', na_rep='-')
+
+
+@db.command(name='convert-masks')
+@click.pass_context
+@click.option('--overwrite/--no-overwrite', default=False, help='Overwrite existing binary mask files.')
+def db_convert_masks(ctx, overwrite: bool):
+    variation_service = cast(VariationService, ctx.obj['data_index_connection'].variation_service)
+    number_written = variation_service.convert_masks_to_binary(overwrite=overwrite)
+    click.echo(f'Wrote {number_written} binary mask files')
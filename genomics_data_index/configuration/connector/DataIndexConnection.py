@@ -133,7 +133,8 @@ class DataIndexConnection:
         database = DatabaseConnection(connection_string=database_connection,
                                       database_path_translator=dpt)
 
-        reference_service = ReferenceService(database, filesystem_storage.reference_dir)
+        reference_service = ReferenceService(database, filesystem_storage.reference_dir,
+                                             cache_dir=filesystem_storage.genome_cache_dir)
         sample_service = SampleService(database)
         variation_service = VariationService(database_connection=database,
                                              variation_dir=filesystem_storage.variation_dir,
@@ -143,7 +144,8 @@ class DataIndexConnection:
         alignment_service = CoreAlignmentService(database=database,
                                                  reference_service=reference_service,
                                                  sample_service=sample_service,
-                                                 variation_service=variation_service)
+                                                 variation_service=variation_service,
+                                                 alignment_dir=filesystem_storage.alignment_dir)
 
         tree_service = TreeService(database, reference_service, alignment_service)
 
@@ -9,7 +9,7 @@ logger = logging.getLogger(__name__)
 
 
 class FilesystemStorage:
-    ALL_SUBDIRECTORIES = ['reference', 'kmer', 'variation', 'mlst']
+    ALL_SUBDIRECTORIES = ['reference', 'genome-cache', 'kmer', 'variation', 'mlst', 'alignment']
 
     def __init__(self, root_dir: Path):
         self._root_dir = root_dir
@@ -58,6 +58,10 @@ class FilesystemStorage:
     def reference_dir(self):
         return self._check_make_dir('reference')
 
+    @property
+    def genome_cache_dir(self):
+        return self._check_make_dir('genome-cache')
+
     @property
     def kmer_dir(self):
         return self._check_make_dir('kmer')
@@ -69,3 +73,7 @@ class FilesystemStorage:
     @property
     def mlst_dir(self):
         return self._check_make_dir('mlst')
+
+    @property
+    def alignment_dir(self):
+        return self._check_make_dir('alignment')
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable, Tuple
+
+import numpy as np
+
+from genomics_data_index.storage.util import atomic_output_files
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAlignment:
+    """
+    An alignment stored on the filesystem so that it can be updated incrementally as samples are added and
+    subsets of samples can be read without re-generating the alignment.
+
+    For each sequence of the reference genome, the alignment is stored as a row-major matrix of bytes
+    (samples x columns) which is opened as a memory-mapped array. Columns are either every position of
+    the sequence (positions=None) or a sorted list of (1-based) positions. A manifest file records the
+    samples (in row order), the sequences and the files holding the data for each sequence.
+
+    Rows are appended in place (the manifest records the number of valid rows so partially-appended rows are
+    ignored). Adding columns rewrites the data for a sequence to new files (a chunk of rows at a time), which are only
+    used once the manifest is (atomically) updated to refer to them.
+    """
+    MANIFEST_FILE = 'manifest.json'
+    VERSION = 1
+
+    # Approximate number of bytes of the alignment matrix to keep in memory at once when adding columns
+    ADD_COLUMNS_CHUNK_BYTES = 64 * 1024 * 1024
+
+    # Byte used to mark masked (missing) positions in the alignment matrices
+    MASKED = 0
+
+    def __init__(self, directory: Path, manifest: Dict):
+        self._directory = directory
+        self._manifest = manifest
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def reference_name(self) -> str:
+        return self._manifest['reference_name']
+
+    @property
+    def align_type(self) -> str:
+        return self._manifest['align_type']
+
+    @property
+    def sample_ids(self) -> List[int]:
+        return list(self._manifest['sample_ids'])
+
+    @property
+    def sample_names(self) -> List[str]:
+        return list(self._manifest['sample_names'])
+
+    @property
+    def sequence_names(self) -> List[str]:
+        return [s['name'] for s in self._manifest['sequences']]
+
+    def __len__(self) -> int:
+        return len(self._manifest['sample_ids'])
+
+    def _sequence(self, sequence_name: str) -> Dict:
+        for sequence in self._manifest['sequences']:
+            if sequence['name'] == sequence_name:
+                return sequence
+        raise Exception(f'Sequence [{sequence_name}] does not exist in alignment [{self._directory}]')
+
+    def number_columns(self, sequence_name: str) -> int:
+        return self._sequence(sequence_name)['columns']
+
+    def positions(self, sequence_name: str) -> Optional[np.ndarray]:
+        """
+        Gets the (1-based) positions of the columns for a sequence.
+        :param sequence_name: The sequence name.
+        :return: The positions of the columns, or None if the columns are every position of the sequence.
+        """
+        positions_file = self._sequence(sequence_name)['positions_file']
+        if positions_file is None:
+            return None
+        else:
+            return np.load(self._directory / positions_file)
+
+    def matrix(self, sequence_name: str) -> np.ndarray:
+        """
+        Gets a (read-only) matrix of the alignment for a sequence, with one row per sample (in the order of
+        sample_ids) and one column per position.
+        :param sequence_name: The sequence name.
+        :return: A matrix of bytes (samples x columns).
+        """
+        sequence = self._sequence(sequence_name)
+        shape = (len(self), sequence['columns'])
+        if shape[0] == 0 or shape[1] == 0:
+            return np.zeros(shape, dtype=np.uint8)
+        else:
+            return np.memmap(self._directory / sequence['matrix_file'], dtype=np.uint8, mode='r', shape=shape)
+
+    def _new_file_name(self, sequence_index: int, suffix: str) -> str:
+        return f'sequence-{sequence_index}-{uuid.uuid4().hex}{suffix}'
+
+    def _write_manifest(self, manifest: Dict) -> None:
+        manifest_file = self._directory / self.MANIFEST_FILE
+        with atomic_output_files([manifest_file]) as temp_files:
+            with open(temp_files[0], 'w') as f:
+                json.dump(manifest, f)
+        self._manifest = manifest
+
+    def _remove_unused_files(self) -> None:
+        used_files = {self.MANIFEST_FILE}
+        for sequence in self._manifest['sequences']:
+            used_files.add(sequence['matrix_file'])
+            if sequence['positions_file'] is not None:
+                used_files.add(sequence['positions_file'])
+
+        for file in self._directory.iterdir():
+            if file.name not in used_files and not file.name.startswith('.tmp-'):
+                logger.debug(f'Removing unused alignment file [{file}]')
+                file.unlink()
+
+    def append_rows(self, rows: Iterable[Tuple[int, str, Dict[str, np.ndarray]]]) -> int:
+        """
+        Appends rows for samples to the alignment.
+        :param rows: An iterable of (sample_id, sample_name, row) where row maps each sequence name to
+                     an array of bytes (one per column of the sequence).
+        :return: The number of rows appended.
+        """
+        sequences = self._manifest['sequences']
+        number_rows = len(self)
+        sample_ids = list(self._manifest['sample_ids'])
+        sample_names = list(self._manifest['sample_names'])
+        existing_sample_ids = set(sample_ids)
+
+        handles = {}
+        try:
+            for sequence in sequences:
+                matrix_file = self._directory / sequence['matrix_file']
+                handle = open(matrix_file, 'r+b')
+                # Remove any partially-appended rows from an earlier update
+                handle.truncate(number_rows * sequence['columns'])
+                handle.seek(0, os.SEEK_END)
+                handles[sequence['name']] = handle
+
+            for sample_id, sample_name, row in rows:
+                if sample_id in existing_sample_ids:
+                    raise Exception(f'Sample [{sample_name}] with id [{sample_id}] already exists in alignment')
+
+                for sequence in sequences:
+                    row_sequence = np.asarray(row[sequence['name']], dtype=np.uint8)
+                    if len(row_sequence) != sequence['columns']:
+                        raise Exception(f'Row for sample [{sample_name}] on sequence [{sequence["name"]}] has '
+                                        f'length [{len(row_sequence)}] but should be [{sequence["columns"]}]')
+                    handles[sequence['name']].write(row_sequence.tobytes())
+
+                sample_ids.append(sample_id)
+                sample_names.append(sample_name)
+                existing_sample_ids.add(sample_id)
+
+            for handle in handles.values():
+                handle.flush()
+                os.fsync(handle.fileno())
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+        number_appended = len(sample_ids) - number_rows
+        if number_appended > 0:
+            manifest = dict(self._manifest)
+            manifest['sample_ids'] = sample_ids
+            manifest['sample_names'] = sample_names
+            self._write_manifest(manifest)
+
+        return number_appended
+
+    def add_columns(self, sequence_name: str, positions: np.ndarray, columns: np.ndarray) -> None:
+        """
+        Adds columns (at new positions) to the alignment for a sequence with positions.
+        :param sequence_name: The sequence name.
+        :param positions: The (1-based) positions of the new columns, which must not already be in the alignment.
+        :param columns: A matrix (samples x new columns) of the data for existing samples at the new positions.
+        """
+        if len(positions) == 0:
+            return
+
+        existing_positions = self.positions(sequence_name)
+        if existing_positions is None:
+            raise Exception(f'Cannot add columns to sequence [{sequence_name}] which has all positions as columns')
+        elif columns.shape != (len(self), len(positions)):
+            raise Exception(f'columns has shape {columns.shape} but should be {(len(self), len(positions))}')
+        elif len(np.intersect1d(existing_positions, positions)) > 0:
+            raise Exception(f'Some positions already exist in the alignment for sequence [{sequence_name}]')
+
+        all_positions = np.concatenate([existing_positions, positions])
+        order = np.argsort(all_positions, kind='stable')
+        matrix = self.matrix(sequence_name)
+
+        sequence_index = self.sequence_names.index(sequence_name)
+        sequence = dict(self._sequence(sequence_name))
+        sequence['positions_file'] = self._new_file_name(sequence_index, '.positions.npy')
+        sequence['matrix_file'] = self._new_file_name(sequence_index, '.matrix')
+        sequence['columns'] = len(all_positions)
+        with open(self._directory / sequence['positions_file'], 'wb') as f:
+            np.save(f, all_positions[order])
+        chunk_rows = max(1, self.ADD_COLUMNS_CHUNK_BYTES // len(all_positions))
+        with open(self._directory / sequence['matrix_file'], 'wb') as f:
+            for start in range(0, len(self), chunk_rows):
+                stop = start + chunk_rows
+                chunk = np.concatenate([matrix[start:stop], columns[start:stop]], axis=1)[:, order]
+                f.write(np.ascontiguousarray(chunk).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del matrix
+
+        manifest = dict(self._manifest)
+        manifest['sequences'] = [sequence if s['name'] == sequence_name else s for s in self._manifest['sequences']]
+        self._write_manifest(manifest)
+        self._remove_unused_files()
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional[CachedAlignment]:
+        manifest_file = directory / cls.MANIFEST_FILE
+        if not manifest_file.exists():
+            return None
+
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+
+        if manifest.get('version') != cls.VERSION:
+            logger.debug(f'Ignoring cached alignment [{directory}] with version [{manifest.get("version")}]')
+            return None
+
+        return CachedAlignment(directory=directory, manifest=manifest)
+
+    @classmethod
+    def create(cls, directory: Path, reference_name: str, align_type: str,
+               sequence_columns: Dict[str, Optional[np.ndarray]],
+               sequence_lengths: Dict[str, int]) -> CachedAlignment:
+        """
+        Creates a new (empty) alignment, replacing any existing alignment in the directory.
+        :param directory: The directory to store the alignment.
+        :param reference_name: The reference genome name.
+        :param align_type: The alignment type.
+        :param sequence_columns: A map of sequence name to the (1-based) positions to use as columns
+                                 (or None to use every position of the sequence).
+        :param sequence_lengths: A map of sequence name to sequence length.
+        :return: The new alignment.
+        """
+        if not directory.exists():
+            os.makedirs(directory)
+
+        cached_alignment = CachedAlignment(directory=directory, manifest={'sequences': []})
+        sequences = []
+        for sequence_index, sequence_name in enumerate(sequence_columns):
+            positions = sequence_columns[sequence_name]
+            sequence = {
+                'name': sequence_name,
+                'matrix_file': cached_alignment._new_file_name(sequence_index, '.matrix'),
+                'positions_file': None,
+            }
+            if positions is None:
+                sequence['columns'] = sequence_lengths[sequence_name]
+            else:
+                sequence['columns'] = len(positions)
+                sequence['positions_file'] = cached_alignment._new_file_name(sequence_index, '.positions.npy')
+                with open(directory / sequence['positions_file'], 'wb') as f:
+                    np.save(f, np.asarray(positions, dtype=np.int64))
+            Path(directory / sequence['matrix_file']).touch()
+            sequences.append(sequence)
+
+        cached_alignment._write_manifest({
+            'version': cls.VERSION,
+            'reference_name': reference_name,
+            'align_type': align_type,
+            'sample_ids': [],
+            'sample_names': [],
+            'sequences': sequences,
+        })
+        cached_alignment._remove_unused_files()
+        return cached_alignment
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import logging
+import weakref
+from typing import Dict, List
+
+import numpy as np
+from ete3 import Tree
+
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeIndex import TreeIndex
+from genomics_data_index.storage.service.SampleService import SampleService
+
+logger = logging.getLogger(__name__)
+
+
+class CladeIndex:
+    """
+    An index of the samples in each clade of a tree, so that the samples descending from the most recent common
+    ancestor of a set of leaves can be found with a lowest common ancestor lookup (see TreeIndex) and a SampleSet
+    instead of walking the tree. The SampleSet of a clade is created the first time it is used and then kept
+    with the index.
+
+    Indexes are cached per tree object (see CladeIndex.get()), so a tree must not be modified after it is indexed.
+    """
+
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, tree_index: TreeIndex, sample_name_ids: Dict[str, int]):
+        self._tree_index = tree_index
+        self._leaf_sample_ids = np.array([sample_name_ids.get(name, -1) for name in tree_index.leaf_names],
+                                         dtype=np.int64)
+        self._clade_samples = {}
+
+    @property
+    def tree_index(self) -> TreeIndex:
+        return self._tree_index
+
+    @property
+    def leaf_samples(self) -> SampleSet:
+        """
+        The samples which are leaves of the tree.
+        """
+        return SampleSet(self._leaf_sample_ids[self._leaf_sample_ids != -1].tolist())
+
+    def clade_samples(self, node: int) -> SampleSet:
+        """
+        Gets the samples descending from the passed node.
+        :param node: The node (numbered in preorder, see TreeIndex).
+        :return: The samples descending from the node.
+        """
+        samples = self._clade_samples.get(node)
+        if samples is None:
+            start, end = self._tree_index.clade_leaf_range(node)
+            sample_ids = self._leaf_sample_ids[start:end]
+            samples = SampleSet(sample_ids[sample_ids != -1].tolist())
+            self._clade_samples[node] = samples
+        return samples
+
+    def leaf_names_in(self, samples: SampleSet) -> List[str]:
+        """
+        Gets the names of the leaves of the tree which are in the passed samples (in the order of leaf_names).
+        :param samples: The samples.
+        :return: The names of the leaves which are in the samples.
+        """
+        return [name for name, sample_id in zip(self._tree_index.leaf_names, self._leaf_sample_ids.tolist())
+                if sample_id != -1 and sample_id in samples]
+
+    def mrca_samples(self, names: List[str]) -> SampleSet:
+        """
+        Gets the samples descending from the most recent common ancestor of the leaves with the passed names.
+        :param names: The names of the leaves.
+        :return: The samples descending from the most recent common ancestor.
+        """
+        return self.clade_samples(self._tree_index.mrca(names))
+
+    def ancestor_clade_samples(self, name: str, levels: int) -> SampleSet:
+        """
+        Gets the samples in the same clade as the leaf with the passed name, where the clade is defined by
+        the ancestor of the leaf which is the passed number of levels above the leaf.
+        :param name: The name of the leaf.
+        :param levels: The number of levels above the leaf of the ancestor defining the clade.
+        :return: The samples descending from the ancestor.
+        """
+        return self.clade_samples(self._tree_index.ancestor(self._tree_index.leaf_node(name), levels))
+
+    @classmethod
+    def get(cls, tree: Tree, sample_service: SampleService) -> CladeIndex:
+        """
+        Gets the (cached) clade index of the passed tree, creating the index if it does not exist.
+        :param tree: The tree.
+        :param sample_service: The SampleService used to find the ids of samples in the tree.
+        :return: The clade index of the tree.
+        """
+        cached = cls._cache.get(tree)
+        if cached is None or cached[0] is not sample_service:
+            tree_index = TreeIndex.get(tree)
+            sample_name_ids = sample_service.find_sample_name_ids(set(tree_index.leaf_names))
+            cached = (sample_service, CladeIndex(tree_index, sample_name_ids))
+            cls._cache[tree] = cached
+        return cached[1]
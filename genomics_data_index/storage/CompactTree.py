@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import io
+import logging
+from typing import List
+
+import numpy as np
+from ete3 import Tree
+
+logger = logging.getLogger(__name__)
+
+
+class CompactTree:
+    """
+    A tree stored as arrays, with nodes numbered in preorder (so the root is node 0 and every parent comes before
+    its children). For each node this stores the index of the parent (-1 for the root), the branch length, the
+    support and the name. This can be converted to/from bytes much faster than parsing Newick
+    and is converted to an ete3 tree only when needed.
+    """
+
+    def __init__(self, parents: np.ndarray, branch_lengths: np.ndarray, supports: np.ndarray, names: List[str]):
+        if not (len(parents) == len(branch_lengths) == len(supports) == len(names)):
+            raise Exception('All arrays defining a CompactTree must have the same length')
+        elif len(parents) == 0 or parents[0] != -1:
+            raise Exception('The first node of a CompactTree must be the root')
+
+        self._parents = parents
+        self._branch_lengths = branch_lengths
+        self._supports = supports
+        self._names = names
+
+    @property
+    def parents(self) -> np.ndarray:
+        return self._parents
+
+    @property
+    def branch_lengths(self) -> np.ndarray:
+        return self._branch_lengths
+
+    @property
+    def supports(self) -> np.ndarray:
+        return self._supports
+
+    @property
+    def names(self) -> List[str]:
+        return self._names
+
+    @property
+    def leaf_nodes(self) -> np.ndarray:
+        is_leaf = np.ones(len(self._parents), dtype=bool)
+        is_leaf[self._parents[1:]] = False
+        return np.flatnonzero(is_leaf)
+
+    @property
+    def leaf_names(self) -> List[str]:
+        return [self._names[i] for i in self.leaf_nodes]
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    @classmethod
+    def from_tree(cls, tree: Tree) -> CompactTree:
+        """
+        Creates a CompactTree from an ete3 tree.
+        :param tree: The tree.
+        :return: The CompactTree.
+        """
+        parents = []
+        branch_lengths = []
+        supports = []
+        names = []
+
+        stack = [(tree, -1)]
+        while len(stack) > 0:
+            node, parent = stack.pop()
+            index = len(parents)
+            parents.append(parent)
+            branch_lengths.append(node.dist)
+            supports.append(node.support)
+            names.append(node.name)
+            for child in reversed(node.children):
+                stack.append((child, index))
+
+        return CompactTree(parents=np.array(parents, dtype=np.int64),
+                           branch_lengths=np.array(branch_lengths, dtype=np.float64),
+                           supports=np.array(supports, dtype=np.float64),
+                           names=names)
+
+    def to_tree(self) -> Tree:
+        """
+        Converts to an ete3 tree.
+        :return: The ete3 tree.
+        """
+        nodes = [Tree(name=name, dist=dist, support=support) for name, dist, support
+                 in zip(self._names, self._branch_lengths.tolist(), self._supports.tolist())]
+        for node, parent in zip(nodes[1:], self._parents[1:].tolist()):
+            parent_node = nodes[parent]
+            parent_node.children.append(node)
+            node.up = parent_node
+
+        return nodes[0]
+
+    def to_bytes(self) -> bytes:
+        encoded_names = [name.encode('utf-8') for name in self._names]
+        name_offsets = np.cumsum([0] + [len(name) for name in encoded_names], dtype=np.int64)
+        with io.BytesIO() as data:
+            np.savez_compressed(data, parents=self._parents, branch_lengths=self._branch_lengths,
+                                supports=self._supports, names=np.frombuffer(b''.join(encoded_names), dtype=np.uint8),
+                                name_offsets=name_offsets)
+            return data.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> CompactTree:
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            name_bytes = arrays['names'].tobytes()
+            name_offsets = arrays['name_offsets'].tolist()
+            names = [name_bytes[start:end].decode('utf-8') for start, end in zip(name_offsets[:-1], name_offsets[1:])]
+            return CompactTree(parents=arrays['parents'], branch_lengths=arrays['branch_lengths'],
+                               supports=arrays['supports'], names=names)
@@ -1,25 +1,146 @@
 from __future__ import annotations
 
-import tempfile
+import gzip
+import json
+import logging
 from pathlib import Path
-from typing import List, Set, Dict
+from typing import List, Set, Dict, Tuple
 
-from Bio import SeqIO
+import numpy as np
+from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from pybedtools import BedTool
 
+from genomics_data_index.storage.util import parse_sequence_file
+
+logger = logging.getLogger(__name__)
+
+Intervals = Dict[str, Tuple[np.ndarray, np.ndarray]]
+
 
 class MaskedGenomicRegions:
+    """
+    A set of masked regions on a genome. Regions are stored in-memory as 0-based, half-open intervals (as in BED
+    files), with a sorted array of interval starts and ends for each sequence. All set operations (merging, union,
+    intersection) are computed on these arrays so no external processes or temporary files are needed.
+
+    Masks can also be stored in a compact binary format (see write_binary()), which can be read without parsing.
+    """
+    BINARY_MAGIC = b'GDIMASK1'
+    BINARY_SUFFIX = '.mask.bin'
+
+    def __init__(self, mask: BedTool = None, intervals: Intervals = None, intervals_merged: bool = False):
+        """
+        Builds a new set of masked regions from either a pybedtools BedTool or a dictionary of intervals.
+        :param mask: A BedTool defining the masked regions.
+        :param intervals: A dictionary mapping a sequence name to a tuple of (starts, ends) arrays of intervals.
+        :param intervals_merged: True if the passed intervals are already sorted, merged, and non-empty (so they
+                                 can be used as-is without copying).
+        """
+        if mask is not None and intervals is not None:
+            raise Exception('Only one of mask or intervals can be set')
+        elif mask is not None:
+            intervals = self._bedtool_to_intervals(mask)
+        elif intervals is None:
+            intervals = {}
+
+        if intervals_merged:
+            self._intervals = intervals
+            return
+
+        self._intervals = {}
+        for sequence, (starts, ends) in intervals.items():
+            merged_starts, merged_ends = self._merge_intervals(starts, ends)
+            if len(merged_starts) > 0:
+                self._intervals[sequence] = (merged_starts, merged_ends)
+
+    @classmethod
+    def _bedtool_to_intervals(cls, mask: BedTool) -> Intervals:
+        intervals = {}
+        for i in mask:
+            if i.chrom not in intervals:
+                intervals[i.chrom] = ([], [])
+            intervals[i.chrom][0].append(i.start)
+            intervals[i.chrom][1].append(i.end)
+
+        return {sequence: (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64))
+                for sequence, (starts, ends) in intervals.items()}
+
+    @classmethod
+    def _merge_intervals(cls, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sorts and merges overlapping (or book-ended) intervals, equivalent to 'bedtools sort | bedtools merge'.
+        :param starts: The interval starts.
+        :param ends: The interval ends (not included in the interval).
+        :return: A tuple of (starts, ends) arrays of the merged intervals, sorted by position.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        non_empty = ends > starts
+        starts = starts[non_empty]
+        ends = ends[non_empty]
+        if len(starts) == 0:
+            return starts, ends
+
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        ends = ends[order]
+
+        # An interval starts a new merged interval if it begins after every previous interval ends
+        running_ends = np.maximum.accumulate(ends)
+        new_interval = np.empty(len(starts), dtype=bool)
+        new_interval[0] = True
+        new_interval[1:] = starts[1:] > running_ends[:-1]
 
-    def __init__(self, mask: BedTool):
-        self._mask = mask.sort().merge()
+        new_interval_indexes = np.flatnonzero(new_interval)
+        last_indexes = np.append(new_interval_indexes[1:] - 1, len(starts) - 1)
+        return starts[new_interval_indexes], running_ends[last_indexes]
+
+    def _check_start_position_index(self, start_position_index: str) -> None:
+        if start_position_index != '0' and start_position_index != '1':
+            raise Exception((f'Unknown value start_position_index=[{start_position_index}].'
+                             'Should be "0" or "1" to indicate which is the starting base position'))
 
     def intersect(self, other: MaskedGenomicRegions) -> MaskedGenomicRegions:
-        return MaskedGenomicRegions(self._mask.intersect(other._mask))
+        intersection = {}
+        for sequence in self._intervals.keys() & other._intervals.keys():
+            starts, ends = self._intervals[sequence]
+            other_starts, other_ends = other._intervals[sequence]
+
+            # For each interval, find the range of intervals in other which overlap it
+            first_overlaps = np.searchsorted(other_ends, starts, side='right')
+            last_overlaps = np.searchsorted(other_starts, ends, side='left')
+            number_overlaps = np.maximum(last_overlaps - first_overlaps, 0)
+
+            indexes = np.repeat(np.arange(len(starts)), number_overlaps)
+            offsets = np.arange(number_overlaps.sum()) - np.repeat(np.cumsum(number_overlaps) - number_overlaps,
+                                                                   number_overlaps)
+            other_indexes = np.repeat(first_overlaps, number_overlaps) + offsets
+
+            intersection[sequence] = (np.maximum(starts[indexes], other_starts[other_indexes]),
+                                      np.minimum(ends[indexes], other_ends[other_indexes]))
+
+        return MaskedGenomicRegions(intervals=intersection)
 
     def union(self, other: MaskedGenomicRegions) -> MaskedGenomicRegions:
-        union = self._mask.cat(other._mask, postmerge=True, force_truncate=True)
-        return MaskedGenomicRegions(union)
+        return MaskedGenomicRegions.union_all([self, other])
+
+    def _masked_positions(self, sequence: str, length: int) -> np.ndarray:
+        """
+        Gets a boolean array of length 'length' which is True for every (0-based) position on the sequence
+        within the masked regions.
+        :param sequence: The sequence name.
+        :param length: The length of the sequence.
+        :return: A boolean array of masked positions.
+        """
+        if sequence not in self._intervals:
+            return np.zeros(length, dtype=bool)
+
+        starts, ends = self._intervals[sequence]
+        boundaries = np.zeros(length + 1, dtype=np.int64)
+        np.add.at(boundaries, np.minimum(starts, length), 1)
+        np.add.at(boundaries, np.minimum(ends, length), -1)
+        return np.cumsum(boundaries[:-1]) > 0
 
     def mask_genome(self, genome_file: Path, mask_char: str = '?', remove: bool = True) -> Dict[str, SeqRecord]:
         """
@@ -31,18 +152,30 @@ class MaskedGenomicRegions:
         :return: A Dictionary mapping a sequence name to a SeqRecord containing all those regions on the sequence
                  within the masked regions removed (or masked with mask_char)
         """
-        with tempfile.TemporaryDirectory() as out_f:
-            seq_records = {}
-            output_fasta = Path(out_f) / 'masked.fasta'
-            self._mask.mask_fasta(fi=str(genome_file), fo=str(output_fasta), mc=mask_char)
-            for record in SeqIO.parse(output_fasta, 'fasta'):
-                if remove:
-                    record.seq = record.seq.ungap(mask_char)
-                seq_records[record.id] = record
-            return seq_records
+        seq_records = {}
+        name, records = parse_sequence_file(genome_file)
+        for record in records:
+            sequence_array = np.frombuffer(str(record.seq).encode(), dtype=np.uint8).copy()
+            masked_positions = self._masked_positions(record.id, len(sequence_array))
+            if remove:
+                sequence_array = sequence_array[~masked_positions]
+            else:
+                sequence_array[masked_positions] = ord(mask_char)
+
+            record.seq = Seq(sequence_array.tobytes().decode())
+            seq_records[record.id] = record
+        return seq_records
 
     def write(self, file: Path):
-        self._mask.saveas(str(file), compressed=True)
+        """
+        Writes the masked regions as a gzipped BED file (sorted by sequence name and position).
+        :param file: The file to write to.
+        :return: None.
+        """
+        with gzip.open(file, 'wt') as fh:
+            for sequence in sorted(self._intervals.keys()):
+                starts, ends = self._intervals[sequence]
+                fh.writelines(f'{sequence}\t{start}\t{end}\n' for start, end in zip(starts.tolist(), ends.tolist()))
 
     @classmethod
     def union_all(cls, masked_regions: List[MaskedGenomicRegions]):
@@ -51,98 +184,224 @@ class MaskedGenomicRegions:
         elif len(masked_regions) == 1:
             return masked_regions[0]
         else:
-            start_mask = masked_regions.pop()
-            union = start_mask._mask.cat(*[o._mask for o in masked_regions], postmerge=True, force_truncate=True)
-            return MaskedGenomicRegions(union)
+            sequence_intervals = {}
+            for mask in masked_regions:
+                for sequence, intervals in mask._intervals.items():
+                    if sequence not in sequence_intervals:
+                        sequence_intervals[sequence] = [intervals]
+                    else:
+                        sequence_intervals[sequence].append(intervals)
+
+            # Intervals from every mask are merged in a single pass per sequence
+            union = {sequence: (np.concatenate([starts for starts, ends in intervals]),
+                                np.concatenate([ends for starts, ends in intervals]))
+                     for sequence, intervals in sequence_intervals.items()}
+            return MaskedGenomicRegions(intervals=union)
 
     @classmethod
-    def from_sequences(cls, sequences: List[SeqRecord]) -> MaskedGenomicRegions:
-        def is_missing(char):
-            return char.upper() == 'N' or char == '-'
+    def _missing_intervals(cls, sequence: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the runs of missing characters ('N', 'n', or '-') in the passed sequence. This converts the sequence
+        to a numpy array of bytes and finds the boundaries of each run from the differences of the boolean
+        array of missing positions (rather than examining each character in Python).
+        :param sequence: The sequence.
+        :return: A tuple of (starts, stops) arrays defining the 0-based, half-open intervals of missing characters.
+        """
+        sequence_array = np.frombuffer(sequence.encode(), dtype=np.uint8)
+        missing = (sequence_array == ord('N')) | (sequence_array == ord('n')) | (sequence_array == ord('-'))
+
+        # Pad with False on both ends so that runs at the start/end of the sequence have boundaries
+        boundaries = np.diff(np.concatenate(([False], missing, [False])).astype(np.int8))
+        starts = np.flatnonzero(boundaries == 1)
+        stops = np.flatnonzero(boundaries == -1)
+        return starts, stops
 
-        # pybedtools internally stores as 0-based BED file intervals
+    @classmethod
+    def from_sequences(cls, sequences: List[SeqRecord]) -> MaskedGenomicRegions:
+        # Intervals are stored as 0-based BED file intervals where the stop position is not included in the interval
         # https://daler.github.io/pybedtools/intervals.html#bed-is-0-based-others-are-1-based
-        mask_intervals = []
+        sequence_intervals = {}
 
         for record in sequences:
-            start = 0
-            in_mask = False
-            for idx, char in enumerate(record.seq):
-                if in_mask:
-                    if not is_missing(char):
-                        in_mask = False
-                        # pybedtools stop position is not included in interval
-                        stop = idx
-                        mask_intervals.append((record.id, start, stop))
-                else:
-                    if is_missing(char):
-                        in_mask = True
-                        start = idx
-
-            # Finish recording last interval if it exists (e.g., if last bit of sequence was like 'NNNN')
-            if in_mask:
-                stop = len(record)
-                mask_intervals.append((record.id, start, stop))
-
-        bedtool_intervals = BedTool(mask_intervals)
-        return MaskedGenomicRegions(bedtool_intervals)
+            starts, stops = cls._missing_intervals(str(record.seq))
+            if record.id in sequence_intervals:
+                previous_starts, previous_stops = sequence_intervals[record.id]
+                starts = np.concatenate([previous_starts, starts])
+                stops = np.concatenate([previous_stops, stops])
+            sequence_intervals[record.id] = (starts, stops)
+
+        return MaskedGenomicRegions(intervals=sequence_intervals)
+
+    @classmethod
+    def binary_file(cls, file: Path) -> Path:
+        """
+        Gets the path of the binary mask file stored alongside the passed BED file.
+        :param file: The BED file.
+        :return: The path of the corresponding binary mask file.
+        """
+        name = file.name
+        if name.endswith('.bed.gz'):
+            name = name[:-len('.bed.gz')]
+        return file.parent / f'{name}{cls.BINARY_SUFFIX}'
+
+    def write_binary(self, file: Path) -> None:
+        """
+        Writes the masked regions in a compact binary format. The file contains a short header (a magic string,
+        the header length, and a JSON list of sequence names and number of intervals) followed by the int32
+        starts and then ends of the intervals for each sequence. This can be read back without any parsing
+        (see from_binary_file()).
+        :param file: The file to write to.
+        :return: None.
+        """
+        sequence_names = sorted(self._intervals.keys())
+        header = json.dumps([[name, len(self._intervals[name][0])] for name in sequence_names]).encode()
+
+        # Pad header so that interval arrays are aligned
+        data_offset = len(self.BINARY_MAGIC) + 4 + len(header)
+        header += b' ' * (-data_offset % 8)
+
+        with open(file, 'wb') as fh:
+            fh.write(self.BINARY_MAGIC)
+            fh.write(np.array([len(header)], dtype='<u4').tobytes())
+            fh.write(header)
+            for name in sequence_names:
+                starts, ends = self._intervals[name]
+                fh.write(starts.astype('<i4').tobytes())
+                fh.write(ends.astype('<i4').tobytes())
 
     @classmethod
-    def from_file(cls, file: Path) -> MaskedGenomicRegions:
-        bed_file_data = BedTool(str(file))
-        return MaskedGenomicRegions(bed_file_data)
+    def from_binary_file(cls, file: Path) -> MaskedGenomicRegions:
+        """
+        Reads masked regions written by write_binary(). The file is read in a single call and the interval arrays
+        are views on the read data (no data is parsed). The file is not kept open (so many masks can be held
+        at once without running out of file descriptors).
+        :param file: The binary mask file.
+        :return: The masked regions.
+        """
+        data = np.fromfile(file, dtype=np.uint8)
+        magic_length = len(cls.BINARY_MAGIC)
+        if data[:magic_length].tobytes() != cls.BINARY_MAGIC:
+            raise Exception(f'File [{file}] is not a binary mask file')
+
+        header_length = int(data[magic_length:magic_length + 4].view('<u4')[0])
+        offset = magic_length + 4
+        header = json.loads(data[offset:offset + header_length].tobytes())
+        offset += header_length
+
+        intervals = {}
+        for name, number_intervals in header:
+            number_bytes = 4 * number_intervals
+            starts = data[offset:offset + number_bytes].view('<i4')
+            ends = data[offset + number_bytes:offset + 2 * number_bytes].view('<i4')
+            intervals[name] = (starts, ends)
+            offset += 2 * number_bytes
+
+        return MaskedGenomicRegions(intervals=intervals, intervals_merged=True)
+
+    @classmethod
+    def from_file(cls, file: Path, use_binary: bool = True) -> MaskedGenomicRegions:
+        """
+        Reads masked regions from a BED file (which may be gzipped). Only the first three columns are used.
+        If a binary mask file exists alongside the BED file (see binary_file()) and is not older than the BED file
+        it is read instead.
+        :param file: The BED file.
+        :param use_binary: Whether to read the binary mask file alongside the BED file if it exists.
+        :return: The masked regions.
+        """
+        binary_file = cls.binary_file(file)
+        if use_binary and binary_file.exists():
+            if binary_file.stat().st_mtime >= Path(file).stat().st_mtime:
+                return cls.from_binary_file(binary_file)
+            else:
+                logger.warning(f'Binary mask file [{binary_file}] is older than [{file}], will read [{file}]')
+
+        with open(file, 'rb') as fh:
+            is_gzipped = fh.read(2) == b'\x1f\x8b'
+        _open = gzip.open if is_gzipped else open
+
+        intervals = {}
+        with _open(file, 'rt') as fh:
+            for line in fh:
+                if line.startswith(('#', 'track', 'browser')) or line.strip() == '':
+                    continue
+                values = line.split()
+                if values[0] not in intervals:
+                    intervals[values[0]] = ([], [])
+                intervals[values[0]][0].append(int(values[1]))
+                intervals[values[0]][1].append(int(values[2]))
+
+        return MaskedGenomicRegions(intervals={sequence: (np.array(starts, dtype=np.int64),
+                                                          np.array(ends, dtype=np.int64))
+                                               for sequence, (starts, ends) in intervals.items()})
 
     @classmethod
     def empty_mask(cls):
-        return MaskedGenomicRegions(BedTool('', from_string=True))
+        return MaskedGenomicRegions(intervals={})
 
     def is_empty(self):
         return len(self) == 0
 
+    def sequence_intervals(self, sequence: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the masked intervals on the passed sequence.
+        :param sequence: The sequence name.
+        :return: A tuple of (starts, ends) arrays of the sorted, merged, 0-based half-open intervals on the sequence.
+        """
+        if sequence not in self._intervals:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        else:
+            return self._intervals[sequence]
+
     def sequence_names(self) -> Set[str]:
         """
         Gets a set of sequence names from this genomic regions mask.
         :return: A set of sequence names.
         """
-        return {x.chrom for x in self._mask}
+        return set(self._intervals.keys())
 
-    def contains(self, sequence: str, position: int, start_position_index: str = '0') -> bool:
-        if start_position_index != '0' and start_position_index != '1':
-            raise Exception((f'Unknown value start_position_index=[{start_position_index}].'
-                             'Should be "0" or "1" to indicate which is the starting base position'))
-        elif start_position_index == '1':
-            position = position - 1
+    def contains_many(self, sequence: str, positions: np.ndarray, start_position_index: str = '0') -> np.ndarray:
+        """
+        Checks which of the passed positions on a sequence are contained in the masked regions.
+        :param sequence: The sequence name.
+        :param positions: An array of positions on the sequence.
+        :param start_position_index: Whether positions start at "0" or "1".
+        :return: A boolean array (aligned with positions) which is True for positions in the masked regions.
+        """
+        self._check_start_position_index(start_position_index)
+        positions = np.asarray(positions, dtype=np.int64)
+        if start_position_index == '1':
+            positions = positions - 1
+
+        if sequence not in self._intervals:
+            return np.zeros(len(positions), dtype=bool)
 
-        for i in self._mask:
-            if i.chrom == sequence and i.start <= position < i.end:
-                return True
-        return False
+        starts, ends = self._intervals[sequence]
+        interval_indexes = np.searchsorted(starts, positions, side='right') - 1
+        return (interval_indexes >= 0) & (positions < ends[np.maximum(interval_indexes, 0)])
+
+    def contains(self, sequence: str, position: int, start_position_index: str = '0') -> bool:
+        return bool(self.contains_many(sequence, np.array([position]), start_position_index=start_position_index)[0])
 
     def overlaps_range(self, sequence: str, start: int, stop: int, start_position_index: str = '0') -> bool:
-        if start_position_index != '0' and start_position_index != '1':
-            raise Exception((f'Unknown value start_position_index=[{start_position_index}].'
-                             'Should be "0" or "1" to indicate which is the starting base position'))
-        elif start_position_index == '1':
+        self._check_start_position_index(start_position_index)
+        if start_position_index == '1':
             start = start - 1
             stop = stop - 1
 
         if stop <= start:
             raise Exception(f'start=[{start}] is less than stop=[{stop}]')
 
-        for i in self._mask:
-            if i.chrom == sequence:
-                if i.start <= start and i.end > start:
-                    return True
-                elif start < i.end and stop > i.end:
-                    return True
-        return False
+        if sequence not in self._intervals:
+            return False
+
+        # The first interval ending after start is the only one which could overlap [start, stop)
+        starts, ends = self._intervals[sequence]
+        interval_index = np.searchsorted(ends, start, side='right')
+        return bool(interval_index < len(starts) and starts[interval_index] < stop)
 
     def __len__(self) -> int:
         """
         Calculates length of underlying masked intervals. Assumes the intervals have been merged beforehand.
         :return: The length of the masked intervals.
         """
-        total = 0
-        for i in self._mask:
-            total += len(i)
-        return total
+        return int(sum((ends - starts).sum() for starts, ends in self._intervals.values()))
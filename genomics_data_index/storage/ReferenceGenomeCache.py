@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from genomics_data_index.storage.util import atomic_output_files
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceGenomeCache:
+    """
+    A cache of reference genome sequences on the filesystem. Each sequence is stored once as a file of raw bytes
+    which is opened as a memory-mapped uint8 numpy array. The most recently used arrays are kept open
+    (up to max_open arrays). Also writes FASTA files (with a faidx index) of reference genomes from
+    the cached sequences so that external tools can read the reference genome without it being re-written.
+    """
+    SEQUENCE_SUFFIX = '.seq'
+    FASTA_LINE_LENGTH = 60
+
+    def __init__(self, cache_dir: Path, max_open: int = 32):
+        if max_open < 1:
+            raise Exception(f'max_open=[{max_open}] must be a positive integer')
+
+        self._cache_dir = cache_dir
+        self._max_open = max_open
+        self._open_sequences = OrderedDict()
+
+        if not cache_dir.exists():
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def cache_dir(self) -> Path:
+        return self._cache_dir
+
+    def _file_prefix(self, name: str) -> str:
+        # Sequence/genome names may contain characters which are not valid in file names
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def _sequence_file(self, sequence_name: str) -> Path:
+        return self._cache_dir / f'{self._file_prefix(sequence_name)}{self.SEQUENCE_SUFFIX}'
+
+    def reference_file(self, reference_name: str) -> Path:
+        return self._cache_dir / f'{self._file_prefix(reference_name)}.fasta'
+
+    def has_sequence(self, sequence_name: str) -> bool:
+        return sequence_name in self._open_sequences or self._sequence_file(sequence_name).exists()
+
+    def store_sequence(self, sequence_name: str, sequence: str) -> None:
+        with atomic_output_files([self._sequence_file(sequence_name)]) as temp_files:
+            with open(temp_files[0], 'wb') as f:
+                f.write(sequence.encode('utf-8'))
+        self._open_sequences.pop(sequence_name, None)
+
+    def get_sequence_array(self, sequence_name: str) -> np.ndarray:
+        """
+        Gets a (read-only) array of the bytes of the passed sequence.
+        :param sequence_name: The sequence name.
+        :return: An array (of dtype uint8) of the bytes of the sequence.
+        """
+        if sequence_name in self._open_sequences:
+            self._open_sequences.move_to_end(sequence_name)
+            return self._open_sequences[sequence_name]
+
+        sequence_file = self._sequence_file(sequence_name)
+        if not sequence_file.exists():
+            raise Exception(f'Sequence [{sequence_name}] does not exist in cache [{self._cache_dir}]')
+        elif sequence_file.stat().st_size == 0:
+            sequence_array = np.array([], dtype=np.uint8)
+        else:
+            sequence_array = np.memmap(sequence_file, dtype=np.uint8, mode='r')
+
+        self._open_sequences[sequence_name] = sequence_array
+        if len(self._open_sequences) > self._max_open:
+            self._open_sequences.popitem(last=False)
+
+        return sequence_array
+
+    def get_sequence(self, sequence_name: str) -> str:
+        return self.get_sequence_array(sequence_name).tobytes().decode('utf-8')
+
+    def get_reference_file(self, reference_name: str, sequence_names: List[str]) -> Path:
+        """
+        Gets a FASTA file (along with a faidx index) of the reference genome made up of the passed sequences,
+        writing the file if it does not already exist. All sequences must already be stored in the cache.
+        :param reference_name: The reference genome name.
+        :param sequence_names: The names of the sequences in the reference genome (in order).
+        :return: The path to the FASTA file.
+        """
+        reference_file = self.reference_file(reference_name)
+        index_file = Path(f'{reference_file}.fai')
+        if reference_file.exists() and index_file.exists():
+            return reference_file
+
+        logger.debug(f'Writing reference genome [{reference_name}] to [{reference_file}]')
+        with atomic_output_files([reference_file, index_file]) as temp_files:
+            with open(temp_files[0], 'wb') as fasta, open(temp_files[1], 'w') as index:
+                for sequence_name in sequence_names:
+                    header = f'>{sequence_name}\n'.encode('utf-8')
+                    fasta.write(header)
+                    sequence_array = self.get_sequence_array(sequence_name)
+                    index.write(f'{sequence_name}\t{len(sequence_array)}\t{fasta.tell()}\t'
+                                f'{self.FASTA_LINE_LENGTH}\t{self.FASTA_LINE_LENGTH + 1}\n')
+                    fasta.write(self._wrap_sequence(sequence_array))
+
+        return reference_file
+
+    def _wrap_sequence(self, sequence_array: np.ndarray) -> bytes:
+        line_length = self.FASTA_LINE_LENGTH
+        number_full_lines = len(sequence_array) // line_length
+        full_lines_length = number_full_lines * line_length
+
+        # Add a column of newlines to the full lines of the sequence in a single step
+        full_lines = np.empty((number_full_lines, line_length + 1), dtype=np.uint8)
+        full_lines[:, :line_length] = np.reshape(sequence_array[:full_lines_length],
+                                                 (number_full_lines, line_length))
+        full_lines[:, line_length] = ord('\n')
+
+        last_line = sequence_array[full_lines_length:].tobytes()
+        if len(last_line) > 0:
+            last_line += b'\n'
+        return full_lines.tobytes() + last_line
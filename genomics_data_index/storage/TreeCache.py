@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Tuple, Union
+
+from ete3 import Tree
+
+from genomics_data_index.storage.CompactTree import CompactTree
+
+logger = logging.getLogger(__name__)
+
+
+class TreeCache:
+    """
+    A (process-wide) cache of parsed trees so that stored trees are parsed once instead of on every access.
+    Stored trees are either Newick text or the bytes of a CompactTree. Trees are keyed by an id (e.g., the reference
+    genome id) and a hash of the stored tree, so a changed tree is never served from the cache. The most recently
+    used trees are kept (up to max_trees trees).
+
+    Trees from the cache are shared between callers and must not be modified. Callers which modify trees should
+    use get_copy() to get their own copy.
+    """
+    _instance = None
+
+    def __init__(self, max_trees: int = 8):
+        if max_trees < 1:
+            raise Exception(f'max_trees=[{max_trees}] must be a positive integer')
+
+        self._max_trees = max_trees
+        self._trees = OrderedDict()
+
+    def _key(self, tree_id: int, tree_data: Union[bytes, str]) -> Tuple[int, str]:
+        if isinstance(tree_data, str):
+            tree_data = tree_data.encode('utf-8')
+        return tree_id, hashlib.sha1(tree_data).hexdigest()
+
+    def _parse(self, tree_data: Union[bytes, str]) -> Tree:
+        if isinstance(tree_data, bytes):
+            return CompactTree.from_bytes(tree_data).to_tree()
+        else:
+            return Tree(tree_data)
+
+    def get(self, tree_id: int, tree_data: Union[bytes, str]) -> Tree:
+        """
+        Gets the parsed tree (shared with other callers) for the passed stored tree.
+        :param tree_id: The id of the object the tree belongs to.
+        :param tree_data: The tree (either Newick text or the bytes of a CompactTree).
+        :return: The parsed tree, which must not be modified.
+        """
+        key = self._key(tree_id, tree_data)
+        if key in self._trees:
+            self._trees.move_to_end(key)
+            return self._trees[key]
+
+        logger.debug(f'Parsing tree with id [{tree_id}]')
+        tree = self._parse(tree_data)
+        self._trees[key] = tree
+        if len(self._trees) > self._max_trees:
+            self._trees.popitem(last=False)
+
+        return tree
+
+    def get_copy(self, tree_id: int, tree_data: Union[bytes, str]) -> Tree:
+        """
+        Gets a copy of the parsed tree for the passed stored tree, which can be modified by the caller.
+        :param tree_id: The id of the object the tree belongs to.
+        :param tree_data: The tree (either Newick text or the bytes of a CompactTree).
+        :return: A copy of the parsed tree.
+        """
+        return self.get(tree_id, tree_data).copy(method='cpickle')
+
+    def invalidate(self, tree_id: int) -> None:
+        """
+        Removes all trees with the passed id from the cache.
+        :param tree_id: The id of the object the trees belong to.
+        """
+        for key in [k for k in self._trees if k[0] == tree_id]:
+            del self._trees[key]
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+    @classmethod
+    def instance(cls) -> TreeCache:
+        if cls._instance is None:
+            cls._instance = TreeCache()
+        return cls._instance
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import logging
+import weakref
+from typing import List, Union, Tuple
+
+import numpy as np
+from ete3 import Tree
+
+logger = logging.getLogger(__name__)
+
+
+class TreeIndex:
+    """
+    An index of a tree (stored as numpy arrays) for finding lowest common ancestors and distances between leaves
+    without walking the tree. Nodes are numbered in preorder. Lowest common ancestors are found with a range minimum
+    query (using a sparse table) over the levels of the nodes in an Euler tour of the tree. The patristic distance
+    between two nodes is depth(a) + depth(b) - 2 * depth(lca(a, b)) where depth is the distance from the root.
+    Since nodes are numbered in preorder, the leaves of each clade are a contiguous range of leaf_names.
+
+    Indexes are cached per tree object (see TreeIndex.get()), so a tree must not be modified after it is indexed.
+    """
+
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, tree: Tree):
+        nodes = []
+        parents = []
+        depths = []
+        levels = []
+
+        # Preorder traversal (without recursion so that deep trees can be indexed)
+        stack = [(tree, -1)]
+        while len(stack) > 0:
+            node, parent = stack.pop()
+            index = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            if parent == -1:
+                depths.append(0.0)
+                levels.append(0)
+            else:
+                depths.append(depths[parent] + node.dist)
+                levels.append(levels[parent] + 1)
+            for child in reversed(node.children):
+                stack.append((child, index))
+
+        self._parents = np.array(parents, dtype=np.int64)
+        self._depths = np.array(depths, dtype=np.float64)
+        self._levels = np.array(levels, dtype=np.int64)
+
+        children = [[] for _ in nodes]
+        for index, parent in enumerate(parents):
+            if parent != -1:
+                children[parent].append(index)
+
+        self._leaf_nodes = np.array([index for index, node in enumerate(nodes) if node.is_leaf()], dtype=np.int64)
+        self._clade_leaf_starts, self._clade_leaf_ends = self._build_clade_leaf_ranges(parents, nodes)
+        self._leaf_names = [nodes[index].name for index in self._leaf_nodes]
+        self._leaf_name_nodes = {}
+        for name, index in zip(self._leaf_names, self._leaf_nodes):
+            self._leaf_name_nodes.setdefault(name, []).append(index)
+
+        self._euler_tour, self._first_visit = self._build_euler_tour(children)
+        self._tour_levels = self._levels[self._euler_tour]
+        self._sparse_table = self._build_sparse_table(self._tour_levels)
+
+    def _build_clade_leaf_ranges(self, parents: List[int], nodes: List[Tree]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Builds the range [start, end) of positions in leaf_names of the leaves descending from each node.
+        """
+        is_leaf = [1 if node.is_leaf() else 0 for node in nodes]
+        leaf_counts = list(is_leaf)
+        for index in range(len(parents) - 1, 0, -1):
+            leaf_counts[parents[index]] += leaf_counts[index]
+
+        # Number of leaves before each node in preorder
+        leaf_starts = np.cumsum(is_leaf, dtype=np.int64) - np.array(is_leaf, dtype=np.int64)
+        return leaf_starts, leaf_starts + np.array(leaf_counts, dtype=np.int64)
+
+    def _build_euler_tour(self, children: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Builds an Euler tour of the tree (each node is visited before its first child and after each child).
+        :return: A tuple of (nodes in the order visited, position in the tour where each node is first visited).
+        """
+        euler_tour = []
+        first_visit = np.full(len(children), -1, dtype=np.int64)
+        stack = [(0, 0)]
+        while len(stack) > 0:
+            node, child_index = stack.pop()
+            if child_index == 0:
+                first_visit[node] = len(euler_tour)
+            euler_tour.append(node)
+
+            if child_index < len(children[node]):
+                stack.append((node, child_index + 1))
+                stack.append((children[node][child_index], 0))
+
+        return np.array(euler_tour, dtype=np.int64), first_visit
+
+    def _build_sparse_table(self, tour_levels: np.ndarray) -> List[np.ndarray]:
+        """
+        Builds a sparse table where table[k][i] is the position in the Euler tour of the minimum level
+        in the range [i, i + 2^k).
+        """
+        table = [np.arange(len(tour_levels), dtype=np.int64)]
+        k = 1
+        while (1 << k) <= len(tour_levels):
+            previous = table[k - 1]
+            half = 1 << (k - 1)
+            left = previous[:len(previous) - half]
+            right = previous[half:]
+            table.append(np.where(tour_levels[left] <= tour_levels[right], left, right))
+            k += 1
+        return table
+
+    @property
+    def leaf_names(self) -> List[str]:
+        return list(self._leaf_names)
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    def leaf_node(self, name: str) -> int:
+        nodes = self._leaf_name_nodes.get(name, [])
+        if len(nodes) != 1:
+            raise Exception(f'Invalid number of matching leaves for sample [{name}], leaves {nodes}')
+        return nodes[0]
+
+    def clade_leaf_range(self, node: int) -> Tuple[int, int]:
+        """
+        Gets the range of positions in leaf_names of the leaves descending from the passed node.
+        :param node: The node (numbered in preorder).
+        :return: A tuple (start, end) of the range [start, end) of positions in leaf_names.
+        """
+        return int(self._clade_leaf_starts[node]), int(self._clade_leaf_ends[node])
+
+    def ancestor(self, node: int, levels: int) -> int:
+        """
+        Gets the ancestor of a node which is the passed number of levels above the node (stopping at the root).
+        :param node: The node (numbered in preorder).
+        :param levels: The number of levels to go up the tree.
+        :return: The ancestor node.
+        """
+        for i in range(levels):
+            if self._parents[node] == -1:
+                break
+            node = int(self._parents[node])
+        return node
+
+    def mrca(self, names: List[str]) -> int:
+        """
+        Finds the most recent common ancestor of the leaves with the passed names.
+        :param names: The names of the leaves.
+        :return: The most recent common ancestor node (the leaf itself if there is only one name).
+        """
+        if len(names) == 0:
+            raise Exception(f'Should at least have some leaves in the tree matching names={names}')
+
+        # The common ancestor of a set of nodes is the lowest common ancestor of the
+        # first and last of the nodes visited in the Euler tour
+        nodes = np.array([self.leaf_node(name) for name in names], dtype=np.int64)
+        first_visits = self._first_visit[nodes]
+        return int(self.lca(nodes[np.argmin(first_visits)], nodes[np.argmax(first_visits)])[0])
+
+    def lca(self, nodes_a: Union[int, np.ndarray], nodes_b: Union[int, np.ndarray]) -> np.ndarray:
+        """
+        Finds the lowest common ancestors of pairs of nodes (numbered in preorder).
+        :param nodes_a: The first node (or an array of nodes) of each pair.
+        :param nodes_b: The second node (or an array of nodes) of each pair.
+        :return: An array of the lowest common ancestors of each pair.
+        """
+        first_a = self._first_visit[nodes_a]
+        first_b = self._first_visit[nodes_b]
+        left = np.minimum(first_a, first_b)
+        right = np.maximum(first_a, first_b)
+
+        k = np.floor(np.log2(right - left + 1)).astype(np.int64)
+        k = np.atleast_1d(k)
+        left = np.atleast_1d(left)
+        right = np.atleast_1d(right)
+
+        lca_positions = np.empty(len(k), dtype=np.int64)
+        tour_levels = self._tour_levels
+        for level in np.unique(k):
+            selected = k == level
+            table = self._sparse_table[level]
+            candidate_left = table[left[selected]]
+            candidate_right = table[right[selected] - (1 << level) + 1]
+            lca_positions[selected] = np.where(tour_levels[candidate_left] <= tour_levels[candidate_right],
+                                               candidate_left, candidate_right)
+
+        return self._euler_tour[lca_positions]
+
+    def leaf_distances(self, name: str) -> np.ndarray:
+        """
+        Gets the patristic distances from the leaf with the passed name to every leaf (in the order of leaf_names).
+        :param name: The name of the leaf.
+        :return: An array of distances.
+        """
+        node = self.leaf_node(name)
+        lca_nodes = self.lca(np.full(len(self._leaf_nodes), node), self._leaf_nodes)
+        return self._depths[node] + self._depths[self._leaf_nodes] - 2 * self._depths[lca_nodes]
+
+    def leaves_within(self, name: str, distance: float) -> List[str]:
+        """
+        Gets the names of leaves with a patristic distance of at most distance from the leaf with the passed name.
+        :param name: The name of the leaf.
+        :param distance: The maximum distance.
+        :return: The names of the leaves within the distance (including the leaf itself).
+        """
+        distances = self.leaf_distances(name)
+        return [self._leaf_names[i] for i in np.flatnonzero(distances <= distance)]
+
+    @classmethod
+    def get(cls, tree: Tree) -> TreeIndex:
+        """
+        Gets the (cached) index of the passed tree, creating the index if it does not exist.
+        :param tree: The tree.
+        :return: The index of the tree.
+        """
+        tree_index = cls._cache.get(tree)
+        if tree_index is None:
+            tree_index = TreeIndex(tree)
+            cls._cache[tree] = tree_index
+        return tree_index
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import logging
+from typing import List, Callable, Tuple
+
+from ete3 import Tree
+
+from genomics_data_index.storage.CladeIndex import CladeIndex
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeIndex import TreeIndex
+from genomics_data_index.storage.service.SampleService import SampleService
+
+logger = logging.getLogger(__name__)
+
+
+class TreeView:
+    """
+    A view of a base tree (which is shared and never modified) pruned down to the leaves of a set of samples and then
+    modified by a list of operations (e.g., setting the outgroup). The pruned leaves act as a mask over the base tree:
+    pruning a view again only narrows down the mask over the same base tree, so the actual tree is created with a
+    single copy and prune of the base tree the first time it is used (such as when rendering or exporting the tree)
+    and is then kept with the view.
+    """
+
+    def __init__(self, base: Tree, samples: SampleSet = None, sample_service: SampleService = None,
+                 extra_leaves: List[str] = None, preserve_branch_length: bool = True,
+                 operations: Tuple[Callable[[Tree], None], ...] = (), leaf_names: List[str] = None):
+        """
+        Creates a new TreeView.
+        :param base: The base tree.
+        :param samples: The samples to prune the base tree down to (None to not prune the base tree).
+        :param sample_service: The SampleService used to find the leaves of the samples (needed if samples is set).
+        :param extra_leaves: The names of leaves which are not samples to keep when pruning (e.g., the reference).
+        :param preserve_branch_length: Whether or not to preserve branch lengths when pruning.
+        :param operations: Functions which modify the tree, applied (in order) after pruning.
+        :param leaf_names: The names of the leaves of the tree after operations are applied, if the operations rename
+                           leaves (None to find the names from the base tree).
+        """
+        if samples is not None and sample_service is None:
+            raise Exception('sample_service must be set when pruning to samples')
+
+        self._base = base
+        self._samples = samples
+        self._sample_service = sample_service
+        self._extra_leaves = extra_leaves if extra_leaves is not None else []
+        self._preserve_branch_length = preserve_branch_length
+        self._operations = operations
+        self._leaf_names = leaf_names
+        self._tree = None
+
+    def prune(self, samples: SampleSet, sample_service: SampleService, extra_leaves: List[str] = None,
+              preserve_branch_length: bool = True) -> TreeView:
+        """
+        Creates a view of this view pruned down to the leaves of the passed samples. If this view has no operations
+        the new view shares the base tree of this view (with the intersection of the samples of both views), otherwise
+        the tree of this view (which is created if needed) is used as the base tree.
+        :param samples: The samples to prune down to.
+        :param sample_service: The SampleService used to find the leaves of the samples.
+        :param extra_leaves: The names of leaves which are not samples to keep (e.g., the reference).
+        :param preserve_branch_length: Whether or not to preserve branch lengths when pruning.
+        :return: The pruned view.
+        """
+        extra_leaves = extra_leaves if extra_leaves is not None else []
+        if len(self._operations) > 0:
+            return TreeView(self.tree, samples=samples, sample_service=sample_service, extra_leaves=extra_leaves,
+                            preserve_branch_length=preserve_branch_length)
+        elif self._samples is None:
+            return TreeView(self._base, samples=samples, sample_service=sample_service, extra_leaves=extra_leaves,
+                            preserve_branch_length=preserve_branch_length)
+        else:
+            view_leaves = set(self.leaf_names)
+            return TreeView(self._base, samples=self._samples.intersection(samples), sample_service=sample_service,
+                            extra_leaves=[leaf for leaf in extra_leaves if leaf in view_leaves],
+                            preserve_branch_length=self._preserve_branch_length and preserve_branch_length)
+
+    def apply(self, operation: Callable[[Tree], None], leaf_names: List[str] = None) -> TreeView:
+        """
+        Creates a view with the passed operation applied to the tree (after any earlier operations).
+        :param operation: A function which modifies the tree.
+        :param leaf_names: The names of the leaves after the operation is applied if the operation renames leaves
+                           (None if leaves keep their names).
+        :return: The new view.
+        """
+        if leaf_names is None:
+            leaf_names = self._leaf_names
+        return TreeView(self._base, samples=self._samples, sample_service=self._sample_service,
+                        extra_leaves=self._extra_leaves, preserve_branch_length=self._preserve_branch_length,
+                        operations=self._operations + (operation,), leaf_names=leaf_names)
+
+    def is_materialized(self) -> bool:
+        return self._tree is not None
+
+    def _pruned_leaf_names(self) -> List[str]:
+        clade_index = CladeIndex.get(self._base, self._sample_service)
+        return clade_index.leaf_names_in(self._samples) + self._extra_leaves
+
+    @property
+    def leaf_names(self) -> List[str]:
+        """
+        The names of the leaves of the tree for this view (not in any particular order). These are found from the
+        base tree so that the tree for this view does not have to be created.
+        """
+        if self._leaf_names is None:
+            if self._tree is not None:
+                self._leaf_names = TreeIndex.get(self._tree).leaf_names
+            elif self._samples is None:
+                self._leaf_names = TreeIndex.get(self._base).leaf_names
+            else:
+                self._leaf_names = self._pruned_leaf_names()
+        return list(self._leaf_names)
+
+    @property
+    def tree(self) -> Tree:
+        """
+        The tree for this view, created if it does not exist yet. If the view neither prunes nor modifies the
+        base tree this is the base tree itself, so the tree must not be modified.
+        """
+        if self._tree is None:
+            if self._samples is None and len(self._operations) == 0:
+                self._tree = self._base
+            else:
+                logger.debug('Creating tree from tree view')
+                tree = self._base.copy(method='cpickle')
+                if self._samples is not None:
+                    tree.prune(self._pruned_leaf_names(), preserve_branch_length=self._preserve_branch_length)
+                for operation in self._operations:
+                    operation(tree)
+                self._tree = tree
+        return self._tree
@@ -1,5 +1,5 @@
 import abc
-from typing import List, Set, Optional
+from typing import List, Set, Optional, Generator
 
 import pandas as pd
 
@@ -27,6 +27,26 @@ class FeaturesReader(abc.ABC):
         self._check_features_table_columns(features_df)
         return features_df
 
+    def features_table_iter(self, samples_per_batch: int) -> Generator[pd.DataFrame, None, None]:
+        """
+        Iterates over the features table in batches so that the whole table never has to be held in memory at once.
+        Each batch contains all the features for a subset of the samples.
+        :param samples_per_batch: The (maximum) number of samples whose features are contained in each batch.
+        :return: A generator over features tables, one per batch of samples.
+        """
+        for features_df in self._read_features_table_batches(samples_per_batch):
+            self._check_features_table_columns(features_df)
+            yield features_df
+
+    def _read_features_table_batches(self, samples_per_batch: int) -> Generator[pd.DataFrame, None, None]:
+        """
+        Reads the features table in batches of samples. By default the entire table is returned as a single batch,
+        which is appropriate for readers that already store all features in memory.
+        :param samples_per_batch: The (maximum) number of samples whose features are contained in each batch.
+        :return: A generator over features tables, one per batch of samples.
+        """
+        yield self.get_features_table()
+
     @abc.abstractmethod
     def get_sample_files(self, sample_name: str) -> Optional[SampleData]:
         pass
@@ -1,11 +1,11 @@
 import logging
-import shutil
 from pathlib import Path
 from typing import Tuple, Optional
 
 from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
 from genomics_data_index.storage.io.SampleData import SampleData
 from genomics_data_index.storage.io.mutation.VariationFile import VariationFile
+from genomics_data_index.storage.util import atomic_output_files, link_or_copy_file
 
 logger = logging.getLogger(__name__)
 
@@ -21,19 +21,33 @@ class NucleotideSampleData(SampleData):
         self._preprocessed = preprocessed
         self._mask_bed_file = mask_bed_file
 
+    def _write_mask(self, mask: MaskedGenomicRegions, mask_file: Path) -> None:
+        """
+        Writes the mask as a BED file (used by external tools) along with a binary mask file (used for fast reading).
+        :param mask: The mask.
+        :param mask_file: The BED file to write.
+        :return: None.
+        """
+        # The binary mask file is written last so that it is not older than the BED file (see from_file())
+        with atomic_output_files([mask_file, MaskedGenomicRegions.binary_file(mask_file)]) as temp_files:
+            mask.write(temp_files[0])
+            mask.write_binary(temp_files[1])
+
     def _preprocess_mask(self, output_dir: Path) -> Path:
         if self._mask_bed_file is None:
             mask_file = output_dir / f'{self.sample_name_persistence}.bed.gz'
             self._assert_file_not_exists(mask_file, 'Cannot preprocess data')
-            mask = MaskedGenomicRegions.empty_mask()
-            mask.write(mask_file)
+            self._write_mask(MaskedGenomicRegions.empty_mask(), mask_file)
             self._mask_bed_file = mask_file
         return self._mask_bed_file
 
     def _preprocess_vcf(self, output_dir: Path) -> Tuple[Path, Path]:
         new_file = output_dir / f'{self.sample_name_persistence}.vcf.gz'
+        new_file_index = Path(str(new_file) + '.csi')
         self._assert_file_not_exists(new_file, 'Cannot preprocess data')
-        return VariationFile(self._vcf_file).write(new_file)
+        with atomic_output_files([new_file_index, new_file]) as temp_files:
+            VariationFile(self._vcf_file).write(temp_files[1])
+        return new_file, new_file_index
 
     def _do_preprocess_and_persist(self, output_dir: Path) -> SampleData:
         processed_vcf, processed_vcf_index = self._preprocess_vcf(output_dir)
@@ -49,6 +63,11 @@ class NucleotideSampleData(SampleData):
         if self._mask_bed_file is None:
             raise Exception('mask_bed_file is None')
 
+        source_files = [self._vcf_file, self._vcf_file_index, self._mask_bed_file]
+        if all(f.parent.resolve() == output_dir.resolve() for f in source_files):
+            logger.debug(f'VCF and BED files for sample [{self.sample_name}] already in [{output_dir}]')
+            return self
+
         new_vcf_file = output_dir / self._vcf_file.name
         new_vcf_index = output_dir / self._vcf_file_index.name
         new_mask_bed_file = output_dir / self._mask_bed_file.name
@@ -57,11 +76,14 @@ class NucleotideSampleData(SampleData):
         self._assert_file_not_exists(new_vcf_index, 'Cannot persist data')
         self._assert_file_not_exists(new_mask_bed_file, 'Cannot persist data')
 
-        logger.debug(f'Copying VCF and BED files to [{output_dir}] for sample [{self.sample_name}]')
+        logger.debug(f'Linking (or copying) VCF and BED files to [{output_dir}] for sample [{self.sample_name}]')
 
-        shutil.copy(self._vcf_file, new_vcf_file)
-        shutil.copy(self._vcf_file_index, new_vcf_index)
-        shutil.copy(self._mask_bed_file, new_mask_bed_file)
+        link_or_copy_file(self._vcf_file_index, new_vcf_index)
+        link_or_copy_file(self._mask_bed_file, new_mask_bed_file)
+        mask_binary_file = MaskedGenomicRegions.binary_file(self._mask_bed_file)
+        if mask_binary_file.exists():
+            link_or_copy_file(mask_binary_file, MaskedGenomicRegions.binary_file(new_mask_bed_file))
+        link_or_copy_file(self._vcf_file, new_vcf_file)
 
         return NucleotideSampleData(sample_name=self.sample_name,
                                     vcf_file=new_vcf_file,
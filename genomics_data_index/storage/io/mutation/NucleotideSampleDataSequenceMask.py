@@ -23,8 +23,7 @@ class NucleotideSampleDataSequenceMask(NucleotideSampleData):
     def _preprocess_mask(self, output_dir: Path) -> Path:
         if self._sample_mask_sequence is None:
             mask_file = output_dir / f'{self.sample_name_persistence}.bed.gz'
-            mask = MaskedGenomicRegions.empty_mask()
-            mask.write(mask_file)
+            self._write_mask(MaskedGenomicRegions.empty_mask(), mask_file)
             return mask_file
         else:
             new_file = output_dir / f'{self.sample_name_persistence}.bed.gz'
@@ -34,7 +33,7 @@ class NucleotideSampleDataSequenceMask(NucleotideSampleData):
             name, records = parse_sequence_file(self._sample_mask_sequence)
             logger.debug(f'Getting genomic masks from {self._sample_mask_sequence}')
             masked_regions = MaskedGenomicRegions.from_sequences(sequences=records)
-            masked_regions.write(new_file)
+            self._write_mask(masked_regions, new_file)
             return new_file
 
     @classmethod
@@ -1,7 +1,8 @@
 import logging
 import os
+import tempfile
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Generator
 
 import pandas as pd
 import vcf
@@ -10,15 +11,25 @@ from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegion
 from genomics_data_index.storage.io.SampleData import SampleData
 from genomics_data_index.storage.io.mutation.NucleotideFeaturesReader import NucleotideFeaturesReader
 from genomics_data_index.storage.io.mutation.NucleotideSampleData import NucleotideSampleData
+from genomics_data_index.storage.util import execute_commands
 
 logger = logging.getLogger(__name__)
 
 
 class VcfVariantsReader(NucleotideFeaturesReader):
+    VCF_READER_TYPES = ['bcftools', 'pyvcf']
 
-    def __init__(self, sample_files_map: Dict[str, NucleotideSampleData]):
+    # Value used for missing values (e.g., a missing ALT or TYPE), the same as in the VCF file and 'bcftools query'
+    MISSING = '.'
+
+    def __init__(self, sample_files_map: Dict[str, NucleotideSampleData], vcf_reader_type: str = 'bcftools'):
         super().__init__()
+        if vcf_reader_type not in self.VCF_READER_TYPES:
+            raise Exception(f'Unknown value for vcf_reader_type=[{vcf_reader_type}]. '
+                            f'Must be one of {self.VCF_READER_TYPES}')
+
         self._sample_files_map = sample_files_map
+        self._vcf_reader_type = vcf_reader_type
 
     def _fix_df_columns(self, vcf_df: pd.DataFrame) -> pd.DataFrame:
         # If no data, I still want certain column names so that rest of code still works
@@ -35,41 +46,80 @@ class VcfVariantsReader(NucleotideFeaturesReader):
         return vcf_file
 
     def read_vcf(self, file: Path, sample_name: str) -> pd.DataFrame:
+        if self._vcf_reader_type == 'bcftools':
+            out = self._read_vcf_bcftools(file)
+        else:
+            out = self._read_vcf_pyvcf(file)
+
+        out['FILE'] = os.path.basename(file)
+        cols = out.columns.tolist()
+        out['SAMPLE'] = sample_name
+        out = out.reindex(columns=['SAMPLE'] + cols)
+        return out
+
+    def _read_vcf_bcftools(self, file: Path) -> pd.DataFrame:
+        """
+        Reads the VCF file by parsing the tab-delimited output of 'bcftools query' with pandas. This avoids
+        constructing a Python object per record (as is done by pyVCF).
+        :param file: The VCF file.
+        :return: A DataFrame with the columns CHROM, POS, REF, ALT, TYPE.
+        """
+        with tempfile.NamedTemporaryFile() as out_f:
+            execute_commands([
+                ['bcftools', 'query', '-f', '%CHROM\t%POS\t%REF\t%ALT\t%INFO/TYPE\n', '-o', out_f.name, str(file)]
+            ])
+            out = pd.read_csv(out_f.name, sep='\t', names=['CHROM', 'POS', 'REF', 'ALT', 'TYPE'],
+                              dtype={'CHROM': str, 'POS': int, 'REF': str, 'ALT': str, 'TYPE': str},
+                              keep_default_na=False)
+
+        # Like the pyVCF reader, only keep the first alternative allele/type for multi-allelic records
+        out['ALT'] = out['ALT'].str.split(',', n=1).str[0]
+        out['TYPE'] = out['TYPE'].str.split(',', n=1).str[0]
+        return out
+
+    def _read_vcf_pyvcf(self, file: Path) -> pd.DataFrame:
         reader = vcf.Reader(filename=str(file))
         df = pd.DataFrame([vars(r) for r in reader])
         out = self._fix_df_columns(df)
 
+        out['POS'] = out['POS'].astype(int)
         out['ALT'] = out['ALT'].map(self._fix_alt)
         out['REF'] = out['REF'].map(self._fix_ref)
         out['TYPE'] = self._get_type(out)
 
-        out = self._drop_extra_columns(out)
-
-        out['FILE'] = os.path.basename(file)
-        cols = out.columns.tolist()
-        out['SAMPLE'] = sample_name
-        out = out.reindex(columns=['SAMPLE'] + cols)
-        return out
+        return self._drop_extra_columns(out)
 
     def _get_type(self, vcf_df: pd.DataFrame) -> pd.Series:
-        return vcf_df['INFO'].map(lambda x: x['TYPE'][0])
+        return vcf_df['INFO'].map(lambda x: self._fix_missing(x['TYPE'][0]) if 'TYPE' in x else self.MISSING)
 
     def _read_features_table(self) -> pd.DataFrame:
+        return self._read_samples_features_table(self.samples_list())
+
+    def _read_features_table_batches(self, samples_per_batch: int) -> Generator[pd.DataFrame, None, None]:
+        sample_names = self.samples_list()
+        for batch_start in range(0, len(sample_names), samples_per_batch):
+            yield self._read_samples_features_table(sample_names[batch_start:batch_start + samples_per_batch])
+
+    def _read_samples_features_table(self, sample_names: List[str]) -> pd.DataFrame:
         frames = []
-        for sample in self._sample_files_map:
+        for sample in sample_names:
             vcf_file, index_file = self._sample_files_map[sample].get_vcf_file()
             frame = self.read_vcf(vcf_file, sample)
             frames.append(frame)
 
         return pd.concat(frames)
 
+    def _fix_missing(self, element: Optional[str]) -> str:
+        return self.MISSING if element is None else str(element)
+
     def _fix_alt(self, element: List[str]) -> str:
         """
         Fix up the alternative string as the pyVCF package does not return them as a string.
+        A missing alternative (returned as None by pyVCF) is converted to MISSING.
         :param element: The element to fix.
         :return: The fixed element.
         """
-        return str(element[0])
+        return self._fix_missing(element[0])
 
     def _fix_ref(self, element: List[str]) -> str:
         """
@@ -89,5 +139,5 @@ class VcfVariantsReader(NucleotideFeaturesReader):
         return list(self._sample_files_map.keys())
 
     @classmethod
-    def create(cls, sample_files_map: Dict[str, NucleotideSampleData]):
-        return cls(sample_files_map=sample_files_map)
+    def create(cls, sample_files_map: Dict[str, NucleotideSampleData], vcf_reader_type: str = 'bcftools'):
+        return cls(sample_files_map=sample_files_map, vcf_reader_type=vcf_reader_type)
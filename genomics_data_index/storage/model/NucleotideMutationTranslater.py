@@ -1,5 +1,7 @@
 from typing import Union, Tuple
 
+import pandas as pd
+
 from genomics_data_index.storage.model.QueryFeatureMutation import QueryFeatureMutation
 
 
@@ -59,6 +61,32 @@ class NucleotideMutationTranslater:
 
         return f'{sequence_name}:{position}:{ref}:{alt}'
 
+    @classmethod
+    def to_spdi_series(cls, sequence_names: pd.Series, positions: pd.Series, refs: pd.Series,
+                       alts: pd.Series) -> pd.Series:
+        """
+        Vectorized version of to_spdi(..., convert_deletion=True) which operates on whole columns at once
+        instead of one row at a time.
+        :param sequence_names: The sequence names.
+        :param positions: The positions.
+        :param refs: The reference/deletion values (either sequences with alphabet {A,T,C,G} or integers).
+        :param alts: The alternative/insertion values.
+        :return: A Series of SPDI identifiers with the same index as the passed Series.
+        """
+        if (positions < 0).any():
+            raise Exception(f'Position must be non-negative: {positions[positions < 0].iloc[0]}')
+
+        refs = refs.astype(str)
+        is_length = refs.str.isdigit()
+        invalid_refs = ~is_length & ~refs.str.fullmatch(r'[ATCG]*')
+        if invalid_refs.any():
+            raise Exception('Deletion must either be an integer or a string with alphabet {A,T,C,G}'
+                            f': {refs[invalid_refs].iloc[0]}')
+        deletions = refs.str.len().where(~is_length, pd.to_numeric(refs.where(is_length, '0')))
+
+        return (sequence_names.astype(str) + ':' + positions.astype(str) + ':'
+                + deletions.astype(int).astype(str) + ':' + alts.astype(str))
+
     @classmethod
     def to_db_feature(cls, feature: QueryFeatureMutation) -> QueryFeatureMutation:
         new_id = cls.to_spdi(feature.scope, feature.position, feature.ref, feature.alt)
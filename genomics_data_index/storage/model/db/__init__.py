@@ -1,14 +1,17 @@
 from pathlib import Path
 from typing import Union, Tuple, Optional
 
+import pandas as pd
 from ete3 import Tree
-from sqlalchemy import Column, String, Integer, LargeBinary, UnicodeText, ForeignKey
+from sqlalchemy import Column, String, Integer, LargeBinary, UnicodeText, ForeignKey, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
+from genomics_data_index.storage.CompactTree import CompactTree
 from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
 from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeCache import TreeCache
 from genomics_data_index.storage.model.NucleotideMutationTranslater import NucleotideMutationTranslater
 from genomics_data_index.storage.model.db.DatabasePathTranslator import DatabasePathTranslator
 
@@ -16,6 +19,7 @@ Base = declarative_base()
 
 # Max of 500 million bytes
 MAX_SAMPLE_SET_BYTES = 500 * 10 ** 6
+MAX_TREE_BYTES = 500 * 10 ** 6
 
 # Used to translate between relative and absolute Paths when persisting to the database.
 # TODO: I don't like the idea of using a global variable here and would rather use something more in tune with
@@ -81,28 +85,64 @@ class Reference(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(255))
     length = Column(Integer)
+    # Newick trees (only for trees stored before trees were stored as a CompactTree)
     _tree = Column('tree', UnicodeText(10 ** 6))
+    _tree_compact = Column('tree_compact', LargeBinary(length=MAX_TREE_BYTES))
     tree_alignment_length = Column(Integer)
+    tree_align_type = Column(String(255))
+    tree_model = Column(String(255))
+    tree_placed_samples = Column(Integer)
+    # Whether the index of samples with unknown data (NucleotideUnknownSamples) covers all samples on this reference
+    unknown_samples_indexed = Column(Boolean)
 
     sequences = relationship('ReferenceSequence')
     sample_nucleotide_variation = relationship('SampleNucleotideVariation', back_populates='reference')
 
     def has_tree(self) -> bool:
-        return self._tree is not None
+        return self._tree_compact is not None or self._tree is not None
 
-    @hybrid_property
-    def tree(self) -> Tree:
-        if self._tree is None:
+    def _tree_data(self) -> Union[bytes, str]:
+        if self._tree_compact is not None:
+            return self._tree_compact
+        elif self._tree is not None:
+            return self._tree
+        else:
             raise Exception('Cannot convert an empty tree')
+
+    @property
+    def compact_tree(self) -> CompactTree:
+        """
+        The tree for this reference genome as a CompactTree, which is loaded without creating an ete3 tree.
+        """
+        tree_data = self._tree_data()
+        if isinstance(tree_data, bytes):
+            return CompactTree.from_bytes(tree_data)
         else:
-            return Tree(self._tree)
+            return CompactTree.from_tree(Tree(tree_data))
+
+    @hybrid_property
+    def tree(self) -> Tree:
+        """
+        The tree for this reference genome. This is a copy of the parsed tree, which can be modified by the caller.
+        """
+        return TreeCache.instance().get_copy(self.id, self._tree_data())
 
     @tree.setter
     def tree(self, in_tree: Tree):
+        self._tree = None
         if in_tree is None:
-            self._tree = None
+            self._tree_compact = None
         else:
-            self._tree = in_tree.write()
+            self._tree_compact = CompactTree.from_tree(in_tree).to_bytes()
+
+    def shared_tree(self) -> Tree:
+        """
+        Gets the parsed tree for this reference genome which is shared (through TreeCache) with other users of this
+        reference genome's tree, avoiding a copy of the tree. The tree (and indexes of it such as TreeIndex) is reused
+        between callers so it must not be modified.
+        :return: The shared tree.
+        """
+        return TreeCache.instance().get(self.id, self._tree_data())
 
     def __repr__(self):
         return f'<Reference(id={self.id}, name={self.name}, length={self.length})>'
@@ -163,6 +203,42 @@ class SampleNucleotideVariation(Base):
     reference = relationship('Reference', back_populates='sample_nucleotide_variation')
 
 
+class NucleotideUnknownSamples(Base):
+    """
+    An index of those samples with unknown (masked) data on a segment [start, stop) of a sequence. Segments on a
+    sequence do not overlap and are split wherever the set of samples with unknown data changes.
+    """
+    __tablename__ = 'nucleotide_unknown_samples'
+    sequence = Column(String(255), primary_key=True)
+    start = Column(Integer, primary_key=True)
+    stop = Column(Integer)
+    _sample_ids = Column(LargeBinary(length=MAX_SAMPLE_SET_BYTES))
+
+    def __init__(self, sequence: str = None, start: int = None, stop: int = None, sample_ids: SampleSet = None):
+        self.sequence = sequence
+        self.start = start
+        self.stop = stop
+        self.sample_ids = sample_ids
+
+    @hybrid_property
+    def sample_ids(self) -> SampleSet:
+        if self._sample_ids is None:
+            raise Exception('_sample_ids is not set')
+        else:
+            return SampleSet.from_bytes(self._sample_ids)
+
+    @sample_ids.setter
+    def sample_ids(self, sample_ids: SampleSet) -> None:
+        if sample_ids is None:
+            raise Exception('Cannot set sample_ids to None')
+        else:
+            self._sample_ids = sample_ids.get_bytes()
+
+    def __repr__(self):
+        return (f'<NucleotideUnknownSamples(sequence={self.sequence}, start={self.start}, stop={self.stop}, '
+                f'num_samples={len(self.sample_ids)})>')
+
+
 class ReferenceSequence(Base):
     __tablename__ = 'reference_sequence'
     id = Column(Integer, primary_key=True)
@@ -260,6 +336,10 @@ class MLSTAllelesSamples(Base):
     def to_sla(cls, scheme_name: str, locus: str, allele: str) -> str:
         return f'{scheme_name}:{locus}:{allele}'
 
+    @classmethod
+    def to_sla_series(cls, scheme_names: pd.Series, loci: pd.Series, alleles: pd.Series) -> pd.Series:
+        return scheme_names.astype(str) + ':' + loci.astype(str) + ':' + alleles.astype(str)
+
     @classmethod
     def from_sla(cls, sla: str) -> Tuple[str, str, str]:
         if sla is None:
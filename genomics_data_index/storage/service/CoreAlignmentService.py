@@ -1,16 +1,21 @@
-import copy
+import itertools
 import logging
+import multiprocessing as mp
 import tempfile
 import time
+from collections import deque
+from contextlib import ExitStack
 from pathlib import Path
-from typing import List, Dict, Generator
+from typing import List, Dict, Generator, Tuple, Optional, Iterator, Iterable, TextIO
 
-from Bio import SeqIO
+import numpy as np
 from Bio.Align import MultipleSeqAlignment
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from genomics_data_index.storage.CachedAlignment import CachedAlignment
 from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
+from genomics_data_index.storage.SampleSet import SampleSet
 from genomics_data_index.storage.io.mutation.VariationFile import VariationFile
 from genomics_data_index.storage.model.db import SampleNucleotideVariation
 from genomics_data_index.storage.service import DatabaseConnection
@@ -21,19 +26,42 @@ from genomics_data_index.storage.service.VariationService import VariationServic
 logger = logging.getLogger(__name__)
 
 
+def consensus_sequence_records(variants_file: Path, reference_file: Path, mask_file: Optional[Path],
+                               include_expression: str) -> List[SeqRecord]:
+    """
+    Generates consensus sequences for a variants file. Defined at the module level so it can be passed
+    to worker processes.
+    """
+    return VariationFile(variants_file).consensus(reference_file=reference_file,
+                                                  mask_file=mask_file,
+                                                  include_expression=include_expression)
+
+
 class CoreAlignmentService:
     ALIGN_TYPES = ['core', 'full']
+    CORE_ENGINES = ['bitmap', 'consensus']
+
+    # Maximum number of consensus results per core waiting to be consumed when generating consensus
+    # sequences in parallel (bounds memory usage for alignments of many samples)
+    CONSENSUS_IN_FLIGHT_PER_CORE = 2
+
+    EMPTY_POSITIONS = np.array([], dtype=np.int64)
+
+    # Line length for sequences when writing alignments (same as Bio.SeqIO)
+    FASTA_LINE_LENGTH = 60
 
     # Mask generated sequence with this character (which should not appear anywhere else) so I can remove
     # all positions with this character later (when generating core alignment)
     CORE_MASK_CHAR = '?'
 
     def __init__(self, database: DatabaseConnection, reference_service: ReferenceService,
-                 sample_service: SampleService, variation_service: VariationService):
+                 sample_service: SampleService, variation_service: VariationService,
+                 alignment_dir: Path = None):
         self._database = database
         self._reference_service = reference_service
         self._variation_service = variation_service
         self._sample_service = sample_service
+        self._alignment_dir = alignment_dir
 
     def _all_sample_names(self, reference_name: str) -> List[str]:
         samples = self._sample_service.get_samples_with_variants(reference_name)
@@ -44,147 +72,636 @@ class CoreAlignmentService:
         return MaskedGenomicRegions.union_all(masked_regions)
 
     def _get_core_positions(self, sample_variations: List[SampleNucleotideVariation],
-                            core_mask: MaskedGenomicRegions) -> Dict[str, List[int]]:
+                            core_mask: MaskedGenomicRegions) -> Dict[str, np.ndarray]:
         variation_files = [v.nucleotide_variants_file for v in sample_variations]
         union_df = VariationFile.union_all_files(variation_files, include_expression='TYPE="SNP"')
         union_df = union_df.sort_values(['CHROM', 'POS'])
         core_positions = {}
-        for index, row in union_df.iterrows():
-            seq_name = row['CHROM']
-            position = row['POS']
-            if not core_mask.contains(seq_name, position, start_position_index='1'):
-                if seq_name not in core_positions:
-                    core_positions[seq_name] = [position]
-                else:
-                    core_positions[seq_name].append(position)
+        for seq_name, sequence_df in union_df.groupby('CHROM', sort=False):
+            positions = sequence_df['POS'].to_numpy()
+            in_mask = core_mask.contains_many(seq_name, positions, start_position_index='1')
+            if not in_mask.all():
+                core_positions[seq_name] = positions[~in_mask].astype(np.int64)
 
         return core_positions
 
-    def _extract_sequence_from_positions(self, input_seq: Seq, positions: List[int]) -> Seq:
-        sequence_string = ''
-
-        for position in positions:
-            sequence_string += str(input_seq[position - 1:position])
-
-        return Seq(sequence_string)
-
-    def _core_alignment_sequence_generator(self, reference_file: Path, core_positions: Dict[str, List[int]],
-                                           sample_variations: List[SampleNucleotideVariation]) -> Generator[
-        Dict[str, SeqRecord], None, None]:
-        for sample_variation in sample_variations:
+    def _get_variants_bitmap(self, sequence_name: str, sample_set: SampleSet) -> List[Tuple[int, str, SampleSet]]:
+        variants = []
+        for variant in self._variation_service.get_variants_ordered(sequence_name, type='SNP'):
+            variant_samples = variant.sample_ids.intersection(sample_set)
+            if not variant_samples.is_empty():
+                variants.append((variant.position, variant.insertion, variant_samples))
+        return variants
+
+    def _get_core_variants_bitmap(self, sequence_name: str, sample_set: SampleSet,
+                                  core_mask: MaskedGenomicRegions) -> Tuple[np.ndarray, List[Tuple[int, str, SampleSet]]]:
+        """
+        Gets the core SNV positions and the SNVs (with the subset of samples carrying each SNV) on a sequence
+        from the index of variants (NucleotideVariantsSamples) instead of reading the variants files.
+        :param sequence_name: The sequence name.
+        :param sample_set: The set of samples to use for finding core positions.
+        :param core_mask: The core mask (union of all masks of samples in sample_set).
+        :return: A tuple of (sorted array of core positions, list of (position, alt, samples) for core SNVs).
+        """
+        variants = self._get_variants_bitmap(sequence_name, sample_set=sample_set)
+        positions = np.array([v[0] for v in variants], dtype=np.int64)
+        in_mask = core_mask.contains_many(sequence_name, positions, start_position_index='1')
+        core_variants = [v for v, masked in zip(variants, in_mask) if not masked]
+        core_positions = np.unique(positions[~in_mask])
+
+        return core_positions, core_variants
+
+    def _core_alignment_bitmap_rows(self, reference_name: str, sequence_names: List[str],
+                                    sample_variations: List[SampleNucleotideVariation],
+                                    include_reference: bool) -> Generator[Dict[str, SeqRecord], None, None]:
+        """
+        Builds a core alignment directly from the sample sets stored for each SNV (NucleotideVariantsSamples),
+        the reference genome and the sample masks. This avoids generating consensus sequences for every sample.
+        :param reference_name: The reference genome name.
+        :param sequence_names: The names of the sequences of the reference genome.
+        :param sample_variations: The samples to include in the alignment.
+        :param include_reference: Whether or not to include the reference genome in the alignment.
+        :return: A generator of alignment rows (mapping sequence name to aligned record), starting with the
+                 reference genome (if included) followed by the samples in the order of sample_variations.
+        """
+        sample_ids = [v.sample_id for v in sample_variations]
+        sample_set = SampleSet(sample_ids)
+        sample_rows = {sample_id: row for row, sample_id in enumerate(sample_ids)}
+
+        core_mask = self._create_core_mask(sample_variations)
+
+        reference_row = {}
+        alignment_matrices = {}
+        for sequence_name in sequence_names:
+            core_positions, core_variants = self._get_core_variants_bitmap(sequence_name, sample_set=sample_set,
+                                                                           core_mask=core_mask)
+
+            reference_sequence = self._reference_service.get_sequence_array(sequence_name)
+            reference_core = reference_sequence[core_positions - 1]
+
+            # Matrix of samples x core positions, starting from the reference bases
+            alignment_matrix = np.tile(reference_core, (len(sample_ids), 1))
+            for position, alt, variant_samples in core_variants:
+                column = np.searchsorted(core_positions, position)
+                rows = [sample_rows[sample_id] for sample_id in variant_samples]
+                alignment_matrix[rows, column] = ord(alt)
+
+            reference_row[sequence_name] = SeqRecord(id=reference_name,
+                                                     seq=Seq(reference_core.tobytes().decode()),
+                                                     description='[reference genome]')
+            alignment_matrices[sequence_name] = alignment_matrix
+
+        if include_reference:
+            yield reference_row
+
+        for row, sample_variation in enumerate(sample_variations):
+            yield {sequence_name: SeqRecord(id=sample_variation.sample.name,
+                                            seq=Seq(alignment_matrices[sequence_name][row].tobytes().decode()),
+                                            description='generated automatically')
+                   for sequence_name in alignment_matrices}
+
+    def _sequence_array(self, input_seq: Seq) -> np.ndarray:
+        return np.frombuffer(str(input_seq).encode(), dtype=np.uint8)
+
+    def _core_position_indexes(self, core_positions: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Converts (1-based) core positions to (0-based) indexes into sequences, once per sequence so they can be
+        reused when extracting core positions from every sample.
+        """
+        return {sequence_name: core_positions[sequence_name] - 1 for sequence_name in core_positions}
+
+    def _extract_sequence_from_positions(self, input_seq: Seq, position_indexes: np.ndarray) -> Seq:
+        """
+        Extracts the characters at the passed (0-based) indexes of a sequence.
+        :param input_seq: The sequence.
+        :param position_indexes: The (0-based) indexes to extract.
+        :return: A sequence of the characters at the passed indexes.
+        """
+        return Seq(self._sequence_array(input_seq)[position_indexes].tobytes().decode())
+
+    def _consensus_records_iter(self, reference_file: Path, sample_variations: List[SampleNucleotideVariation],
+                                use_masks: bool, ncores: int = 1) -> Generator[
+        Tuple[SampleNucleotideVariation, List[SeqRecord]], None, None]:
+        """
+        Generates consensus sequences for each sample, in the same order as sample_variations.
+        If ncores > 1 then consensus sequences are generated in a pool of processes, with at most
+        CONSENSUS_IN_FLIGHT_PER_CORE * ncores results waiting to be consumed at any one time.
+        :param reference_file: The reference genome file.
+        :param sample_variations: The samples to generate consensus sequences for.
+        :param use_masks: Whether or not to mask the consensus sequences using the masked regions of each sample.
+        :param ncores: The number of processes to use.
+        :return: A generator of (sample variation, consensus sequence records).
+        """
+        if ncores < 1:
+            raise Exception(f'ncores=[{ncores}] must be a positive integer')
+
+        def task_args(sample_variation: SampleNucleotideVariation) -> Tuple[Path, Path, Optional[Path], str]:
+            # Only paths (resolved in this process) are passed to workers, database objects stay in this process
+            mask_file = sample_variation.masked_regions_file if use_masks else None
+            return sample_variation.nucleotide_variants_file, reference_file, mask_file, 'TYPE="SNP"'
+
+        if ncores == 1:
+            for sample_variation in sample_variations:
+                yield sample_variation, consensus_sequence_records(*task_args(sample_variation))
+        else:
+            max_in_flight = ncores * self.CONSENSUS_IN_FLIGHT_PER_CORE
+            # Use 'spawn' so the worker processes do not inherit the open database session/connections
+            with mp.get_context('spawn').Pool(ncores) as pool:
+                in_flight = deque()
+                for sample_variation in sample_variations:
+                    in_flight.append((sample_variation,
+                                      pool.apply_async(consensus_sequence_records, task_args(sample_variation))))
+                    if len(in_flight) >= max_in_flight:
+                        next_sample_variation, result = in_flight.popleft()
+                        yield next_sample_variation, result.get()
+
+                while len(in_flight) > 0:
+                    next_sample_variation, result = in_flight.popleft()
+                    yield next_sample_variation, result.get()
+
+    def _core_alignment_sequence_generator(self, reference_file: Path, core_position_indexes: Dict[str, np.ndarray],
+                                           sample_variations: List[SampleNucleotideVariation],
+                                           ncores: int = 1) -> Generator[Dict[str, SeqRecord], None, None]:
+        for sample_variation, consensus_records in self._consensus_records_iter(reference_file=reference_file,
+                                                                                sample_variations=sample_variations,
+                                                                                use_masks=False,
+                                                                                ncores=ncores):
             seq_records = {}
-
-            consensus_records = VariationFile(sample_variation.nucleotide_variants_file).consensus(
-                reference_file, include_expression='TYPE="SNP"')
             for record in consensus_records:
                 sequence_name = record.id
                 record.id = sample_variation.sample.name
                 record.description = 'generated automatically'
-                record.seq = self._extract_sequence_from_positions(input_seq=record.seq,
-                                                                   positions=core_positions[sequence_name])
+                record.seq = self._extract_sequence_from_positions(
+                    input_seq=record.seq,
+                    position_indexes=core_position_indexes.get(sequence_name, self.EMPTY_POSITIONS))
 
                 seq_records[sequence_name] = record
             yield seq_records
 
     def _full_alignment_sequence_generator(self, reference_file: Path,
-                                           sample_variations: List[SampleNucleotideVariation]) -> Generator[
-        Dict[str, SeqRecord], None, None]:
-        for sample_variation in sample_variations:
+                                           sample_variations: List[SampleNucleotideVariation],
+                                           ncores: int = 1) -> Generator[Dict[str, SeqRecord], None, None]:
+        for sample_variation, consensus_records in self._consensus_records_iter(reference_file=reference_file,
+                                                                                sample_variations=sample_variations,
+                                                                                use_masks=True,
+                                                                                ncores=ncores):
             seq_records = {}
-
-            consensus_records = VariationFile(sample_variation.nucleotide_variants_file).consensus(
-                reference_file=reference_file,
-                include_expression='TYPE="SNP"',
-                mask_file=sample_variation.masked_regions_file
-            )
             for record in consensus_records:
                 seq_records[record.id] = record
                 record.id = sample_variation.sample.name
                 record.description = 'generated automatically'
             yield seq_records
 
-    def construct_alignment(self, reference_name: str, samples: List[str] = None,
-                            include_reference: bool = True, align_type: str = 'core') -> MultipleSeqAlignment:
+    def _cached_alignment(self, reference_name: str, align_type: str, ncores: int = 1) -> CachedAlignment:
+        """
+        Gets the cached alignment of all samples with variants on the passed reference genome, first appending
+        any samples which are not yet in the cached alignment. The cached alignment is re-created if it contains
+        samples which no longer have variants on the reference genome.
+        :param reference_name: The reference genome name.
+        :param align_type: The type of alignment (one of ALIGN_TYPES).
+        :param ncores: The number of processes to use for generating consensus sequences (full alignments).
+        :return: The cached alignment.
+        """
+        if self._alignment_dir is None:
+            raise Exception('Cannot use cached alignments since no alignment directory is set')
+
+        reference = self._reference_service.find_reference_genome(reference_name)
+        sequence_names = self._reference_service.get_reference_sequence_names(reference_name)
+        directory = self._alignment_dir / f'reference-{reference.id}-{align_type}'
+
+        sample_variations = self._variation_service.get_sample_nucleotide_variation(
+            self._all_sample_names(reference_name))
+        sample_variations = [v for v in sample_variations if v.reference_id == reference.id]
+        sample_ids = {v.sample_id for v in sample_variations}
+
+        cached_alignment = CachedAlignment.load(directory)
+        if (cached_alignment is None
+                or cached_alignment.sequence_names != sequence_names
+                or not set(cached_alignment.sample_ids).issubset(sample_ids)):
+            logger.debug(f'Creating cached {align_type} alignment for reference [{reference_name}] in [{directory}]')
+            sequence_columns = {sequence_name: self.EMPTY_POSITIONS if align_type == 'core' else None
+                                for sequence_name in sequence_names}
+            sequence_lengths = {sequence_name: len(self._reference_service.get_sequence_array(sequence_name))
+                                for sequence_name in sequence_names}
+            cached_alignment = CachedAlignment.create(directory, reference_name=reference_name,
+                                                      align_type=align_type,
+                                                      sequence_columns=sequence_columns,
+                                                      sequence_lengths=sequence_lengths)
+
+        cached_sample_ids = set(cached_alignment.sample_ids)
+        new_sample_variations = [v for v in sample_variations if v.sample_id not in cached_sample_ids]
+        if len(new_sample_variations) > 0:
+            start_time = time.time()
+            logger.debug(f'Adding {len(new_sample_variations)} samples to cached {align_type} alignment '
+                         f'for reference [{reference_name}]')
+            if align_type == 'core':
+                self._append_cached_core_alignment(cached_alignment,
+                                                   new_sample_variations=new_sample_variations,
+                                                   sample_variations=sample_variations)
+            else:
+                self._append_cached_full_alignment(cached_alignment,
+                                                   new_sample_variations=new_sample_variations,
+                                                   ncores=ncores)
+            end_time = time.time()
+            logger.debug(f'Finished adding {len(new_sample_variations)} samples to cached {align_type} alignment. '
+                         f'Took {end_time - start_time:0.2f} seconds')
+
+        return cached_alignment
+
+    def _append_cached_core_alignment(self, cached_alignment: CachedAlignment,
+                                      new_sample_variations: List[SampleNucleotideVariation],
+                                      sample_variations: List[SampleNucleotideVariation]) -> None:
+        """
+        Appends samples to a cached core alignment. The cached core alignment has a column for every SNV position
+        of any cached sample and stores CachedAlignment.MASKED where a sample is masked, so that core positions for
+        any subset of samples can be found later. SNV positions of the new samples which are not yet columns
+        are added as columns (with the reference base or MASKED for existing samples).
+        """
+        sample_variations_by_id = {v.sample_id: v for v in sample_variations}
+        existing_masks = None
+        new_masks = [v.masked_regions for v in new_sample_variations]
+        new_sample_set = SampleSet([v.sample_id for v in new_sample_variations])
+        new_sample_rows = {v.sample_id: row for row, v in enumerate(new_sample_variations)}
+
+        new_matrices = {}
+        for sequence_name in cached_alignment.sequence_names:
+            variants = self._get_variants_bitmap(sequence_name, sample_set=new_sample_set)
+            reference_sequence = self._reference_service.get_sequence_array(sequence_name)
+
+            variant_positions = np.unique(np.array([v[0] for v in variants], dtype=np.int64))
+            added_positions = np.setdiff1d(variant_positions, cached_alignment.positions(sequence_name))
+            if len(added_positions) > 0:
+                # Existing samples have no SNVs at added positions, so they have the reference base (or are masked)
+                if existing_masks is None:
+                    existing_masks = [sample_variations_by_id[sample_id].masked_regions
+                                      for sample_id in cached_alignment.sample_ids]
+                added_columns = np.tile(reference_sequence[added_positions - 1], (len(existing_masks), 1))
+                for row, mask in enumerate(existing_masks):
+                    in_mask = mask.contains_many(sequence_name, added_positions, start_position_index='1')
+                    added_columns[row, in_mask] = CachedAlignment.MASKED
+                cached_alignment.add_columns(sequence_name, positions=added_positions, columns=added_columns)
+
+            positions = cached_alignment.positions(sequence_name)
+            matrix = np.tile(reference_sequence[positions - 1], (len(new_sample_variations), 1))
+            for position, alt, variant_samples in variants:
+                column = np.searchsorted(positions, position)
+                rows = [new_sample_rows[sample_id] for sample_id in variant_samples]
+                matrix[rows, column] = ord(alt)
+            for row, mask in enumerate(new_masks):
+                matrix[row, mask.contains_many(sequence_name, positions, start_position_index='1')] = \
+                    CachedAlignment.MASKED
+            new_matrices[sequence_name] = matrix
+
+        cached_alignment.append_rows(
+            (v.sample_id, v.sample.name, {sequence_name: new_matrices[sequence_name][row]
+                                          for sequence_name in new_matrices})
+            for row, v in enumerate(new_sample_variations))
+
+    def _append_cached_full_alignment(self, cached_alignment: CachedAlignment,
+                                      new_sample_variations: List[SampleNucleotideVariation],
+                                      ncores: int = 1) -> None:
+        reference_file = self._reference_service.get_reference_genome_file(cached_alignment.reference_name)
+        rows = self._full_alignment_sequence_generator(reference_file=reference_file,
+                                                       sample_variations=new_sample_variations,
+                                                       ncores=ncores)
+        cached_alignment.append_rows(
+            (v.sample_id, v.sample.name, {sequence_name: self._sequence_array(row[sequence_name].seq)
+                                          for sequence_name in row})
+            for v, row in zip(new_sample_variations, rows))
+
+    def _cached_alignment_rows(self, reference_name: str, sample_variations: List[SampleNucleotideVariation],
+                               include_reference: bool, align_type: str,
+                               ncores: int = 1) -> Generator[Dict[str, SeqRecord], None, None]:
+        """
+        Generates alignment rows by selecting the rows of the passed samples from the cached alignment (of all
+        samples on the reference genome). For core alignments, the columns used are those where none of the passed
+        samples are masked and at least one of the passed samples differs from the reference genome.
+        """
+        cached_alignment = self._cached_alignment(reference_name, align_type=align_type, ncores=ncores)
+        reference = self._reference_service.find_reference_genome(reference_name)
+        cached_rows = {sample_id: row for row, sample_id in enumerate(cached_alignment.sample_ids)}
+        sample_variations = [v for v in sample_variations if v.reference_id == reference.id]
+        rows = [cached_rows[v.sample_id] for v in sample_variations]
+
+        reference_row = {}
+        matrices = {}
+        selected_columns = {}
+        for sequence_name in cached_alignment.sequence_names:
+            matrix = cached_alignment.matrix(sequence_name)
+            reference_sequence = self._reference_service.get_sequence_array(sequence_name)
+            positions = cached_alignment.positions(sequence_name)
+
+            if positions is None:
+                columns = slice(None)
+                reference_columns = reference_sequence
+            else:
+                reference_columns = reference_sequence[positions - 1]
+                masked = np.zeros(len(positions), dtype=bool)
+                variant = np.zeros(len(positions), dtype=bool)
+                for row in rows:
+                    masked |= matrix[row] == CachedAlignment.MASKED
+                    variant |= matrix[row] != reference_columns
+                columns = np.flatnonzero(variant & ~masked)
+                reference_columns = reference_columns[columns]
+
+            reference_row[sequence_name] = SeqRecord(id=reference_name,
+                                                     seq=Seq(reference_columns.tobytes().decode()),
+                                                     description='[reference genome]')
+            matrices[sequence_name] = matrix
+            selected_columns[sequence_name] = columns
+
+        if include_reference:
+            yield reference_row
+
+        for row, sample_variation in zip(rows, sample_variations):
+            yield {sequence_name: SeqRecord(id=sample_variation.sample.name,
+                                            seq=Seq(matrices[sequence_name][row][
+                                                        selected_columns[sequence_name]].tobytes().decode()),
+                                            description='generated automatically')
+                   for sequence_name in matrices}
+
+    def _get_sample_variations(self, reference_name: str, samples: List[str], align_type: str,
+                               core_engine: str) -> List[SampleNucleotideVariation]:
+        if align_type not in self.ALIGN_TYPES:
+            raise Exception(f'Unknown value for align_type=[{align_type}]. Must be one of {self.ALIGN_TYPES}')
+        elif core_engine not in self.CORE_ENGINES:
+            raise Exception(f'Unknown value for core_engine=[{core_engine}]. Must be one of {self.CORE_ENGINES}')
+
         if samples is None or len(samples) == 0:
             samples = self._all_sample_names(reference_name)
 
-        sample_nucleotide_variants = self._variation_service.get_sample_nucleotide_variation(samples)
+        return self._variation_service.get_sample_nucleotide_variation(samples)
+
+    def _alignment_rows(self, reference_name: str, sample_variations: List[SampleNucleotideVariation],
+                        include_reference: bool, align_type: str, core_engine: str,
+                        ncores: int, use_cache: bool = False) -> Generator[Dict[str, SeqRecord], None, None]:
+        """
+        Generates the rows of an alignment one at a time. Each row maps a sequence name (of the reference genome)
+        to the aligned record for that sequence. The reference genome (if included) is generated first, followed
+        by the samples in the order of sample_variations.
+        """
+        if use_cache:
+            rows = self._cached_alignment_rows(reference_name=reference_name,
+                                               sample_variations=sample_variations,
+                                               include_reference=include_reference,
+                                               align_type=align_type,
+                                               ncores=ncores)
+        elif align_type == 'core' and core_engine == 'bitmap':
+            sequence_names = self._reference_service.get_reference_sequence_names(reference_name)
+            rows = self._core_alignment_bitmap_rows(reference_name=reference_name,
+                                                    sequence_names=sequence_names,
+                                                    sample_variations=sample_variations,
+                                                    include_reference=include_reference)
+        else:
+            rows = self._consensus_alignment_rows(reference_name=reference_name,
+                                                  sample_variations=sample_variations,
+                                                  include_reference=include_reference,
+                                                  align_type=align_type,
+                                                  ncores=ncores)
+
+        for row in rows:
+            if reference_name in row:
+                raise Exception(
+                    f'Data contains a sequence with name [{reference_name}], which is the same as the reference genome name')
+            yield row
+
+    def construct_alignment(self, reference_name: str, samples: List[str] = None,
+                            include_reference: bool = True, align_type: str = 'core',
+                            core_engine: str = 'consensus', ncores: int = 1,
+                            use_cache: bool = False) -> MultipleSeqAlignment:
+        """
+        Constructs an alignment of the passed samples against the reference genome.
+        :param reference_name: The reference genome name.
+        :param samples: The samples to include (defaults to all samples with variants on this reference).
+        :param include_reference: Whether or not to include the reference genome in the alignment.
+        :param align_type: The type of alignment (one of ALIGN_TYPES).
+        :param core_engine: How to build core alignments (one of CORE_ENGINES). 'bitmap' builds the alignment from
+                            the index of SNVs and sample masks, 'consensus' generates a consensus sequence per sample.
+                            Full alignments are always built from consensus sequences.
+        :param ncores: The number of processes to use for generating consensus sequences.
+        :param use_cache: Whether to select rows from an alignment of all samples on the reference genome which is
+                          stored in the alignment directory (and updated with any new samples) instead of generating
+                          the alignment from scratch. Cached core alignments are always built as with
+                          core_engine='bitmap' (core_engine is ignored).
+        :return: The alignment.
+        """
+        sample_nucleotide_variants = self._get_sample_variations(reference_name=reference_name, samples=samples,
+                                                                 align_type=align_type, core_engine=core_engine)
+
+        start_time = time.time()
+        logger.debug(f'Started building alignment for {len(sample_nucleotide_variants)} samples')
 
         alignment_seqs = {}
-        alignments = {}
+        for row in self._alignment_rows(reference_name=reference_name,
+                                        sample_variations=sample_nucleotide_variants,
+                                        include_reference=include_reference,
+                                        align_type=align_type,
+                                        core_engine=core_engine,
+                                        ncores=ncores,
+                                        use_cache=use_cache):
+            for sequence in row:
+                if sequence not in alignment_seqs:
+                    alignment_seqs[sequence] = [row[sequence]]
+                else:
+                    alignment_seqs[sequence].append(row[sequence])
+
+        snv_align = self._concatenate_alignments(alignment_seqs)
+
+        end_time = time.time()
+        logger.debug(f'Finished building alignment for {len(sample_nucleotide_variants)} samples. '
+                     f'Took {end_time - start_time:0.2f} seconds')
+
+        return snv_align
+
+    def write_alignment(self, output_file: Path, reference_name: str, samples: List[str] = None,
+                        include_reference: bool = True, align_type: str = 'core',
+                        core_engine: str = 'consensus', ncores: int = 1, use_cache: bool = False) -> int:
+        """
+        Constructs an alignment (see construct_alignment()) and writes it to a FASTA file. Rows are written as soon as
+        they are generated instead of holding the whole alignment in memory. For reference genomes with more than
+        one sequence, rows are written to a temporary file per sequence which are concatenated at the end.
+        The written alignment is the same as writing the alignment from construct_alignment() with AlignIO.
+        :param output_file: The file to write the alignment to.
+        :param reference_name: The reference genome name.
+        :param samples: The samples to include (defaults to all samples with variants on this reference).
+        :param include_reference: Whether or not to include the reference genome in the alignment.
+        :param align_type: The type of alignment (one of ALIGN_TYPES).
+        :param core_engine: How to build core alignments (one of CORE_ENGINES).
+        :param ncores: The number of processes to use for generating consensus sequences.
+        :param use_cache: Whether to use the cached alignment (see construct_alignment()).
+        :return: The length of the written alignment.
+        """
+        sample_nucleotide_variants = self._get_sample_variations(reference_name=reference_name, samples=samples,
+                                                                 align_type=align_type, core_engine=core_engine)
+
+        # Generate samples in the same (sorted) order as rows in alignments from construct_alignment()
+        sample_nucleotide_variants = sorted(sample_nucleotide_variants, key=lambda v: v.sample.name)
 
         start_time = time.time()
-        logger.debug(f'Started building alignment for {len(samples)} samples')
+        logger.debug(f'Started writing alignment for {len(sample_nucleotide_variants)} samples to [{output_file}]')
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            # Write reference genome to file for creating consensus sequences
-            reference_file = Path(tmp_dir) / 'reference.fasta'
-            reference_records = self._reference_service.get_reference_genome_records(reference_name)
-            with open(reference_file, 'w') as h:
-                SeqIO.write(reference_records, h, 'fasta')
+        rows = self._alignment_rows(reference_name=reference_name,
+                                    sample_variations=sample_nucleotide_variants,
+                                    include_reference=include_reference,
+                                    align_type=align_type,
+                                    core_engine=core_engine,
+                                    ncores=ncores,
+                                    use_cache=use_cache)
+        if include_reference:
+            rows = self._insert_sorted_row(rows, first_row=next(rows), first_row_name=reference_name)
 
-            if align_type == 'core':
-                core_mask = self._create_core_mask(sample_nucleotide_variants)
-                core_positions = self._get_core_positions(sample_variations=sample_nucleotide_variants,
-                                                          core_mask=core_mask)
-
-                alignment_generator = self._core_alignment_sequence_generator(
-                    reference_file=reference_file,
-                    sample_variations=sample_nucleotide_variants,
-                    core_positions=core_positions
-                )
-
-                if include_reference:
-                    for record in reference_records:
-                        sequence_name = record.id
-                        core_seq = self._extract_sequence_from_positions(input_seq=record.seq,
-                                                                         positions=core_positions[sequence_name])
-                        new_record = SeqRecord(id=reference_name,
-                                               seq=core_seq,
-                                               description='[reference genome]')
-                        alignment_seqs[sequence_name] = [new_record]
-
-            elif align_type == 'full':
-                alignment_generator = self._full_alignment_sequence_generator(
-                    reference_file=reference_file,
-                    sample_variations=sample_nucleotide_variants
-                )
-
-                if include_reference:
-                    # Add the reference sequence in
-                    reference_records_align = copy.deepcopy(reference_records)
-                    for record in reference_records_align:
-                        alignment_seqs[record.id] = [record]
-                        record.id = reference_name
-                        record.description = '[reference genome]'
-            else:
-                raise Exception(f'Unknown value for align_type=[{align_type}]. Must be one of {self.ALIGN_TYPES}')
-
-            # Actually generate the data
-            for sequence_record in alignment_generator:
-                for sequence in sequence_record:
-                    if sequence == reference_name:
-                        raise Exception(
-                            f'Data contains a sequence with name [{sequence}], which is the same as the reference genome name')
-                    elif sequence not in alignment_seqs:
-                        alignment_seqs[sequence] = [sequence_record[sequence]]
-                    else:
-                        alignment_seqs[sequence].append(sequence_record[sequence])
+        alignment_length = self._write_alignment_rows(rows, output_file=output_file)
+
+        end_time = time.time()
+        logger.debug(f'Finished writing alignment for {len(sample_nucleotide_variants)} samples. '
+                     f'Took {end_time - start_time:0.2f} seconds')
 
+        return alignment_length
+
+    def _insert_sorted_row(self, rows: Iterator[Dict[str, SeqRecord]], first_row: Dict[str, SeqRecord],
+                           first_row_name: str) -> Generator[Dict[str, SeqRecord], None, None]:
+        """
+        Inserts first_row into the (sorted) rows at the position given by first_row_name.
+        """
+        inserted = False
+        for row in rows:
+            row_name = next(iter(row.values())).id
+            if not inserted and first_row_name < row_name:
+                inserted = True
+                yield first_row
+            yield row
+
+        if not inserted:
+            yield first_row
+
+    def _sequence_names_concatenation_order(self, sequence_names: List[str]) -> List[str]:
+        # Same order that alignments of each sequence are concatenated in _concatenate_alignments()
+        sequence_names = sorted(sequence_names)
+        last_sequence_name = sequence_names.pop()
+        return [last_sequence_name] + sequence_names
+
+    def _fasta_title(self, record: SeqRecord) -> str:
+        # Same title as written by Bio.SeqIO
+        if record.description and record.description.split(None, 1)[0] == record.id:
+            return record.description
+        elif record.description:
+            return f'{record.id} {record.description}'
+        else:
+            return record.id
+
+    def _write_wrapped(self, handle: TextIO, sequence_chunks: Iterable[str]) -> None:
+        buffer = ''
+        for chunk in sequence_chunks:
+            buffer += chunk
+            end = len(buffer) - (len(buffer) % self.FASTA_LINE_LENGTH)
+            for start in range(0, end, self.FASTA_LINE_LENGTH):
+                handle.write(buffer[start:start + self.FASTA_LINE_LENGTH])
+                handle.write('\n')
+            buffer = buffer[end:]
+
+        if len(buffer) > 0:
+            handle.write(buffer)
+            handle.write('\n')
+
+    def _write_alignment_rows(self, rows: Iterator[Dict[str, SeqRecord]], output_file: Path) -> int:
+        first_row = next(rows, None)
+        if first_row is None:
+            raise Exception('Cannot write an alignment with no sequences')
+
+        sequence_names = self._sequence_names_concatenation_order(list(first_row.keys()))
+        alignment_length = sum(len(first_row[sequence_name].seq) for sequence_name in sequence_names)
+        rows = itertools.chain([first_row], rows)
+
+        with open(output_file, 'w') as out:
+            if len(sequence_names) == 1:
+                sequence_name = sequence_names[0]
+                for row in rows:
+                    record = row[sequence_name]
+                    out.write(f'>{self._fasta_title(record)}\n')
+                    self._write_wrapped(out, [str(record.seq)])
+            else:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    sequence_files = [Path(tmp_dir) / f'sequence-{i}.rows' for i in range(len(sequence_names))]
+                    titles = []
+                    with ExitStack() as stack:
+                        handles = [stack.enter_context(open(f, 'w')) for f in sequence_files]
+                        for row in rows:
+                            titles.append(self._fasta_title(row[sequence_names[0]]))
+                            for sequence_name, handle in zip(sequence_names, handles):
+                                handle.write(str(row[sequence_name].seq))
+                                handle.write('\n')
+
+                    with ExitStack() as stack:
+                        handles = [stack.enter_context(open(f, 'r')) for f in sequence_files]
+                        for title in titles:
+                            out.write(f'>{title}\n')
+                            self._write_wrapped(out, (handle.readline().rstrip('\n') for handle in handles))
+
+        return alignment_length
+
+    def _concatenate_alignments(self, alignment_seqs: Dict[str, List[SeqRecord]]) -> MultipleSeqAlignment:
+        alignments = {}
         for sequence_name in alignment_seqs:
             alignments[sequence_name] = MultipleSeqAlignment(
                 alignment_seqs[sequence_name])
             alignments[sequence_name].sort()
 
-        sequence_names = sorted(alignments.keys())
-        seq1 = sequence_names.pop()
-        snv_align = alignments[seq1]
+        sequence_names = self._sequence_names_concatenation_order(list(alignments.keys()))
+        snv_align = alignments[sequence_names[0]]
 
-        for sequence_name in sequence_names:
+        for sequence_name in sequence_names[1:]:
             snv_align += alignments[sequence_name]
 
-        end_time = time.time()
-        logger.debug(f'Finished building alignment for {len(samples)} samples. '
-                     f'Took {end_time - start_time:0.2f} seconds')
-
         return snv_align
+
+    def _consensus_alignment_rows(self, reference_name: str, sample_variations: List[SampleNucleotideVariation],
+                                  include_reference: bool, align_type: str,
+                                  ncores: int = 1) -> Generator[Dict[str, SeqRecord], None, None]:
+        # Reference genome file (from the reference genome cache) for creating consensus sequences
+        reference_file = self._reference_service.get_reference_genome_file(reference_name)
+        sequence_names = self._reference_service.get_reference_sequence_names(reference_name)
+
+        if align_type == 'core':
+            core_mask = self._create_core_mask(sample_variations)
+            core_positions = self._get_core_positions(sample_variations=sample_variations,
+                                                      core_mask=core_mask)
+            core_position_indexes = self._core_position_indexes(core_positions)
+
+            alignment_generator = self._core_alignment_sequence_generator(
+                reference_file=reference_file,
+                sample_variations=sample_variations,
+                core_position_indexes=core_position_indexes,
+                ncores=ncores
+            )
+
+            if include_reference:
+                reference_row = {}
+                for sequence_name in sequence_names:
+                    position_indexes = core_position_indexes.get(sequence_name, self.EMPTY_POSITIONS)
+                    reference_core = self._reference_service.get_sequence_array(sequence_name)[position_indexes]
+                    reference_row[sequence_name] = SeqRecord(id=reference_name,
+                                                             seq=Seq(reference_core.tobytes().decode()),
+                                                             description='[reference genome]')
+                yield reference_row
+
+        elif align_type == 'full':
+            alignment_generator = self._full_alignment_sequence_generator(
+                reference_file=reference_file,
+                sample_variations=sample_variations,
+                ncores=ncores
+            )
+
+            if include_reference:
+                # Add the reference sequence in
+                reference_row = {}
+                for sequence_name in sequence_names:
+                    record = self._reference_service.get_sequence(sequence_name)
+                    record.id = reference_name
+                    record.description = '[reference genome]'
+                    reference_row[sequence_name] = record
+                yield reference_row
+        else:
+            raise Exception(f'Unknown value for align_type=[{align_type}]. Must be one of {self.ALIGN_TYPES}')
+
+        # Actually generate the data
+        yield from alignment_generator
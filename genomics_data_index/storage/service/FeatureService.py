@@ -1,10 +1,17 @@
 import abc
 import logging
+import multiprocessing as mp
+import time
+from array import array
+from functools import partial
 from pathlib import Path
-from typing import List, Set, Any, Dict, Optional, Generator
+from typing import List, Set, Any, Dict, Generator, Optional
 
+import numpy as np
 import pandas as pd
+from pyroaring import BitMap
 
+from genomics_data_index.storage.SampleSet import SampleSet
 from genomics_data_index.storage.io.FeaturesReader import FeaturesReader
 from genomics_data_index.storage.io.SampleData import SampleData
 from genomics_data_index.storage.io.SampleDataPackage import SampleDataPackage
@@ -18,15 +25,31 @@ logger = logging.getLogger(__name__)
 AUTO_SCOPE = '__AUTO_SCOPE__'
 
 
+def persist_sample_data(output_dir: Path, sample_data: SampleData) -> Optional[SampleData]:
+    """
+    Persists (preprocessing if necessary) the passed sample data to the output directory. This is a module-level
+    function so that it can be pickled and run in a separate process.
+    :param output_dir: The directory to persist sample data files into.
+    :param sample_data: The sample data to persist.
+    :return: The persisted sample data (or None if sample_data is None).
+    """
+    if sample_data is not None:
+        return sample_data.persist(output_dir)
+    else:
+        return None
+
+
 class FeatureService(abc.ABC):
+    FEATURE_OBJECTS_SAVE_BATCH_SIZE = 500
 
     def __init__(self, database_connection: DatabaseConnection, features_dir: Path, sample_service: SampleService,
-                 max_insert_batch_size: int = 500):
+                 max_insert_batch_size: int = 500, index_batch_size: int = 100):
         self._connection = database_connection
         self._sample_service = sample_service
         self._features_dir = features_dir
         self._max_insert_batch_size = max_insert_batch_size
         self._min_insert_batch_size = 5
+        self._index_batch_size = index_batch_size
 
     @abc.abstractmethod
     def get_correct_data_package(self) -> Any:
@@ -37,7 +60,13 @@ class FeatureService(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def _create_feature_identifier(self, features_df: pd.DataFrame) -> str:
+    def _create_feature_identifiers(self, features_df: pd.DataFrame) -> pd.Series:
+        """
+        Creates the feature identifiers for every row of the passed features table. This should operate on
+        entire columns at once rather than row-by-row.
+        :param features_df: The features table.
+        :return: A Series of feature identifiers with the same index as features_df.
+        """
         pass
 
     @abc.abstractmethod
@@ -50,17 +79,113 @@ class FeatureService(abc.ABC):
 
     @abc.abstractmethod
     def aggregate_feature_column(self) -> Dict[str, Any]:
+        """
+        Defines how to aggregate any extra columns (other than the sample IDs) when grouping by feature.
+        Features are indexed in batches of samples, so the aggregation is applied within a batch and the value
+        from the first batch a feature appears in is kept (i.e., this should be an aggregation like 'first').
+        :return: A dictionary mapping a column name to an aggregation function (as used by pandas agg()).
+        """
         pass
 
-    def _create_feature_objects(self, features_df: pd.DataFrame, sample_names: Set[str]) -> List[Any]:
-        sample_name_ids = self._sample_service.find_sample_name_ids(sample_names)
+    @classmethod
+    def build_sample_sets(cls, feature_ids: pd.Series, sample_ids: pd.Series) -> pd.Series:
+        """
+        Groups sample IDs by feature identifier and builds a SampleSet for each feature. This sorts all
+        sample IDs by feature once (instead of aggregating each group through pandas) and builds
+        each bitmap directly from the sorted array of IDs.
+        :param feature_ids: The feature identifiers (one per row).
+        :param sample_ids: The sample IDs (one per row, aligned with feature_ids).
+        :return: A Series of SampleSet objects indexed by the unique feature identifiers.
+        """
+        codes, unique_feature_ids = pd.factorize(feature_ids)
+        if len(unique_feature_ids) == 0:
+            return pd.Series([], index=unique_feature_ids, dtype=object)
+
+        order = np.argsort(codes, kind='stable')
+        sorted_sample_ids = sample_ids.to_numpy(dtype=np.uint32)[order]
+        group_boundaries = np.flatnonzero(np.diff(codes[order])) + 1
 
-        features_df['_FEATURE_ID'] = features_df.apply(self._create_feature_identifier, axis='columns')
+        sample_sets = [SampleSet(existing_bitmap=BitMap(array('I', group.tobytes())))
+                       for group in np.split(sorted_sample_ids, group_boundaries)]
+        return pd.Series(sample_sets, index=unique_feature_ids, dtype=object)
+
+    def _index_features_batch(self, features_df: pd.DataFrame, sample_name_ids: Dict[str, int],
+                              feature_index: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Adds the features from one batch of samples to the passed feature_index, which maps a feature identifier
+        to the aggregated column values for that feature (including the '_SAMPLE_ID' SampleSet). Features already
+        in the index (from previous batches) have their sample sets unioned with the sample sets from this batch
+        while other aggregated values are kept from the first batch they were seen in.
+        :param features_df: The features table for a batch of samples.
+        :param sample_name_ids: A dictionary mapping sample names to sample IDs.
+        :param feature_index: The index of features to update.
+        :return: None.
+        """
+        if len(features_df) == 0:
+            return
+
+        features_df['_FEATURE_ID'] = self._create_feature_identifiers(features_df)
         features_df['_SAMPLE_ID'] = self._get_sample_id_series(features_df, sample_name_ids)
 
-        index_df = features_df.groupby('_FEATURE_ID').agg(self.aggregate_feature_column()).reset_index()
+        sample_sets = self.build_sample_sets(features_df['_FEATURE_ID'], features_df['_SAMPLE_ID'])
+
+        aggregate_columns = self.aggregate_feature_column()
+        if len(aggregate_columns) > 0:
+            index_df = features_df.groupby('_FEATURE_ID', sort=False).agg(aggregate_columns)
+        else:
+            index_df = pd.DataFrame(index=sample_sets.index)
+        index_df['_SAMPLE_ID'] = sample_sets
+        index_df = index_df.rename_axis('_FEATURE_ID').reset_index()
+
+        for row in index_df.to_dict('records'):
+            feature_id = row['_FEATURE_ID']
+            if feature_id in feature_index:
+                existing_row = feature_index[feature_id]
+                existing_row['_SAMPLE_ID'] = existing_row['_SAMPLE_ID'].union(row['_SAMPLE_ID'])
+            else:
+                feature_index[feature_id] = row
+
+    @abc.abstractmethod
+    def _get_existing_feature_objects(self, feature_ids: List[str]) -> Dict[str, Any]:
+        """
+        Gets the feature objects which already exist in the database for the passed feature identifiers.
+        :param feature_ids: The feature identifiers.
+        :return: A dictionary mapping a feature identifier to an existing feature object. Feature identifiers
+                 which do not exist in the database are not included.
+        """
+        pass
 
-        return index_df.apply(self._create_feature_object, axis='columns').tolist()
+    def _save_feature_index(self, feature_index: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Saves the features in the feature index to the database, removing each feature from the index as it is
+        saved. Features which already exist in the database (e.g., from samples loaded previously) have the
+        new sample IDs added to their existing sample sets. All other features are inserted as new objects.
+        Existing features are looked up in batches so that only those features touched by the new samples are loaded.
+        :param feature_index: The index of features.
+        :return: None.
+        """
+        session = self._connection.get_session()
+        feature_ids = list(feature_index.keys())
+        number_updated = 0
+        for batch_start in range(0, len(feature_ids), self.FEATURE_OBJECTS_SAVE_BATCH_SIZE):
+            batch_feature_ids = feature_ids[batch_start:batch_start + self.FEATURE_OBJECTS_SAVE_BATCH_SIZE]
+            existing_feature_objects = self._get_existing_feature_objects(batch_feature_ids)
+
+            new_feature_objects = []
+            for feature_id in batch_feature_ids:
+                row = feature_index.pop(feature_id)
+                if feature_id in existing_feature_objects:
+                    existing_feature = existing_feature_objects[feature_id]
+                    existing_feature.sample_ids = existing_feature.sample_ids.union(row['_SAMPLE_ID'])
+                else:
+                    new_feature_objects.append(self._create_feature_object(row))
+
+            number_updated += len(existing_feature_objects)
+            session.bulk_save_objects(new_feature_objects)
+            session.flush()
+
+        logger.debug(f'Inserted {len(feature_ids) - number_updated} new features and '
+                     f'updated {number_updated} existing features')
 
     @abc.abstractmethod
     def check_samples_have_features(self, sample_names: Set[str], feature_scope_name: str) -> bool:
@@ -102,18 +227,43 @@ class FeatureService(abc.ABC):
         if feature_scope_name is None:
             raise Exception('feature_scope_name cannot be None')
 
-    def log_progress(self, number: int, total: int) -> None:
-        logger.info(f'Proccessed {number / total * 100:0.0f}% ({number}/{total}) samples')
+    def log_progress(self, number: int, total: int, elapsed_seconds: float = None) -> None:
+        if elapsed_seconds is not None and elapsed_seconds > 0:
+            logger.info(f'Proccessed {number / total * 100:0.0f}% ({number}/{total}) samples '
+                        f'({number / elapsed_seconds:0.1f} samples/sec)')
+        else:
+            logger.info(f'Proccessed {number / total * 100:0.0f}% ({number}/{total}) samples')
 
     def _set_batch_size(self, num_samples: int) -> int:
         batch_size = max(self._min_insert_batch_size, int(num_samples / 50))
         batch_size = min(self._max_insert_batch_size, batch_size)
         return batch_size
 
-    def _sample_data_iter_batch(self, data_package: SampleDataPackage,
-                                batch_size: int) -> Generator[Dict[str, SampleData], None, None]:
+    def _persisted_sample_data_iter(self, data_package: SampleDataPackage,
+                                    ncores: int) -> Generator[SampleData, None, None]:
+        """
+        Iterates over the persisted sample data from the passed data package. If ncores > 1 then sample data is
+        persisted (including any preprocessing of files) in a pool of processes while persisted sample data is
+        consumed in this (the main) process. Sample data may be yielded in a different order than in the package.
+        :param data_package: The data package.
+        :param ncores: The number of processes to use for persisting sample data.
+        :return: A generator over the persisted sample data.
+        """
+        persist_func = partial(persist_sample_data, self._features_dir)
+        if ncores > 1:
+            # Use 'spawn' so the worker processes do not inherit the open database session/connections
+            with mp.get_context('spawn').Pool(ncores) as pool:
+                yield from pool.imap_unordered(persist_func, data_package.iter_sample_data())
+        else:
+            for sample_data in data_package.iter_sample_data():
+                yield persist_func(sample_data)
+
+    def _sample_data_iter_batch(self, data_package: SampleDataPackage, batch_size: int,
+                                ncores: int = 1) -> Generator[Dict[str, SampleData], None, None]:
         sample_data_batch = {}
-        for sample_data in data_package.iter_sample_data():
+        for sample_data in self._persisted_sample_data_iter(data_package, ncores=ncores):
+            if sample_data is None:
+                continue
             sample_data_batch[sample_data.sample_name] = sample_data
 
             if len(sample_data_batch) >= batch_size:
@@ -123,9 +273,19 @@ class FeatureService(abc.ABC):
         if len(sample_data_batch) > 0:
             yield sample_data_batch
 
-    def insert(self, data_package: SampleDataPackage, feature_scope_name: str = AUTO_SCOPE) -> None:
+    def insert(self, data_package: SampleDataPackage, feature_scope_name: str = AUTO_SCOPE, ncores: int = 1) -> None:
+        """
+        Inserts the samples and features from the passed data package.
+        :param data_package: The data package.
+        :param feature_scope_name: A name defining the feature scope (i.e., reference genome name).
+        :param ncores: The number of processes used to persist (and preprocess) sample data files. The database
+                       objects are always created in the main process.
+        :return: None.
+        """
         self._verify_correct_data_package(data_package=data_package)
         self._verify_correct_feature_scope(feature_scope_name)
+        if ncores < 1:
+            raise Exception(f'ncores=[{ncores}] must be >= 1')
 
         sample_names = data_package.sample_names()
         num_samples = len(sample_names)
@@ -135,15 +295,16 @@ class FeatureService(abc.ABC):
                                     f'will not insert any new features')
 
         batch_size = self._set_batch_size(num_samples)
-        logger.debug(f'Batch size {batch_size}')
+        logger.debug(f'Batch size {batch_size}, persisting sample data using {ncores} processes')
         processed_samples = 0
         persisted_sample_data_dict = {}
         self.log_progress(processed_samples, total=num_samples)
-        for sample_data_batch in self._sample_data_iter_batch(data_package, batch_size=batch_size):
-            persisted_sample_data = self._handle_batch(sample_data_batch, feature_scope_name)
-            persisted_sample_data_dict.update(persisted_sample_data)
+        start_time = time.time()
+        for sample_data_batch in self._sample_data_iter_batch(data_package, batch_size=batch_size, ncores=ncores):
+            self._handle_batch(sample_data_batch, feature_scope_name)
+            persisted_sample_data_dict.update(sample_data_batch)
             processed_samples += len(sample_data_batch)
-            self.log_progress(processed_samples, total=num_samples)
+            self.log_progress(processed_samples, total=num_samples, elapsed_seconds=time.time() - start_time)
 
         self._connection.get_session().commit()
         logger.info(f'Finished processing {num_samples} samples')
@@ -152,31 +313,37 @@ class FeatureService(abc.ABC):
                                                                            data_package=data_package)
         self.index_features(features_reader=persisted_features_reader, feature_scope_name=feature_scope_name)
 
-    def _handle_batch(self, sample_data_batch: Dict[str, SampleData], feature_scope_name: str) -> Dict[str, SampleData]:
-        samples_dict = self._get_or_create_samples(list(sample_data_batch.keys()))
-        persisted_sample_data_dict = {}
+    def _handle_batch(self, persisted_sample_data_batch: Dict[str, SampleData], feature_scope_name: str) -> None:
+        samples_dict = self._get_or_create_samples(list(persisted_sample_data_batch.keys()))
         for sample_name in samples_dict:
-            logger.debug(f'Persisting sample {sample_name}')
+            logger.debug(f'Creating features object for sample {sample_name}')
 
             sample = samples_dict[sample_name]
-            persisted_sample_data = self._persist_sample_data(sample_data_batch[sample.name])
-            sample_feature_object = self.build_sample_feature_object(sample=sample, sample_data=persisted_sample_data,
+            sample_feature_object = self.build_sample_feature_object(sample=sample,
+                                                                     sample_data=persisted_sample_data_batch[
+                                                                         sample.name],
                                                                      feature_scope_name=feature_scope_name)
-
-            persisted_sample_data_dict[persisted_sample_data.sample_name] = persisted_sample_data
             self._connection.get_session().add(sample_feature_object)
 
-        return persisted_sample_data_dict
-
     def _update_scope(self, features_df: pd.DataFrame, feature_scope_name: str) -> pd.DataFrame:
         return features_df
 
     def index_features(self, features_reader: FeaturesReader, feature_scope_name: str) -> None:
         logger.info('Indexing features from all samples')
-        features_df = features_reader.get_features_table()
-        features_df = self._update_scope(features_df, feature_scope_name)
         sample_names = features_reader.samples_set()
-        self._connection.get_session().bulk_save_objects(self._create_feature_objects(features_df, sample_names))
+        sample_name_ids = self._sample_service.find_sample_name_ids(sample_names)
+
+        feature_index = {}
+        indexed_samples = 0
+        for features_df in features_reader.features_table_iter(samples_per_batch=self._index_batch_size):
+            features_df = self._update_scope(features_df, feature_scope_name)
+            self._index_features_batch(features_df, sample_name_ids=sample_name_ids, feature_index=feature_index)
+            indexed_samples = min(indexed_samples + self._index_batch_size, len(sample_names))
+            logger.debug(f'Indexed features from {indexed_samples}/{len(sample_names)} samples, '
+                         f'{len(feature_index)} distinct features so far')
+
+        logger.debug(f'Saving {len(feature_index)} features')
+        self._save_feature_index(feature_index)
         self._connection.get_session().commit()
         logger.info('Finished indexing features from all samples')
 
@@ -184,12 +351,6 @@ class FeatureService(abc.ABC):
     def build_sample_feature_object(self, sample: Sample, sample_data: SampleData, feature_scope_name: str) -> Any:
         pass
 
-    def _persist_sample_data(self, sample_data: SampleData) -> Optional[SampleData]:
-        if sample_data is not None:
-            return sample_data.persist(self._features_dir)
-        else:
-            return None
-
     @abc.abstractmethod
     def _create_persisted_features_reader(self, sample_data_dict: Dict[str, SampleData],
                                           data_package: SampleDataPackage) -> FeaturesReader:
@@ -1,10 +1,9 @@
 import logging
 from pathlib import Path
-from typing import Dict, Set, Any, Tuple, cast
+from typing import Dict, Set, Any, Tuple, List, cast
 
 import pandas as pd
 
-from genomics_data_index.storage.SampleSet import SampleSet
 from genomics_data_index.storage.io.FeaturesReader import FeaturesReader
 from genomics_data_index.storage.io.SampleData import SampleData
 from genomics_data_index.storage.io.SampleDataPackage import SampleDataPackage
@@ -64,18 +63,31 @@ class MLSTService(FeatureService):
             .filter(MLSTAllelesSamples.scheme == scheme) \
             .all()}
 
-    def _create_feature_identifier(self, features_df: pd.DataFrame) -> str:
-        return MLSTAllelesSamples.to_sla(
-            scheme_name=features_df['Scheme'],
-            locus=features_df['Locus'],
-            allele=features_df['Allele']
+    def _create_feature_identifiers(self, features_df: pd.DataFrame) -> pd.Series:
+        return MLSTAllelesSamples.to_sla_series(
+            scheme_names=features_df['Scheme'],
+            loci=features_df['Locus'],
+            alleles=features_df['Allele']
         )
 
+    def _get_existing_feature_objects(self, feature_ids: List[str]) -> Dict[str, Any]:
+        # Look up by the (indexed) primary key columns instead of the sla column, which is not indexed.
+        # This can find extra alleles (from other combinations of the values), so only those matching
+        # the feature_ids are kept.
+        feature_keys = [MLSTAllelesSamples.from_sla(feature_id) for feature_id in feature_ids]
+        mlst_alleles = self._connection.get_session().query(MLSTAllelesSamples) \
+            .filter(MLSTAllelesSamples.scheme.in_({k[0] for k in feature_keys})) \
+            .filter(MLSTAllelesSamples.locus.in_({k[1] for k in feature_keys})) \
+            .filter(MLSTAllelesSamples.allele.in_({k[2] for k in feature_keys})) \
+            .all()
+        feature_ids_set = set(feature_ids)
+        return {a.sla: a for a in mlst_alleles if a.sla in feature_ids_set}
+
     def aggregate_feature_column(self) -> Dict[str, Any]:
-        return {'_SAMPLE_ID': SampleSet}
+        return {}
 
     def _get_sample_id_series(self, features_df: pd.DataFrame, sample_name_ids: Dict[str, int]) -> pd.Series:
-        return features_df.apply(lambda x: sample_name_ids[x['Sample']], axis='columns')
+        return features_df['Sample'].map(sample_name_ids)
 
     def _create_feature_object(self, features_df: pd.DataFrame):
         return MLSTAllelesSamples(sla=features_df['_FEATURE_ID'], sample_ids=features_df['_SAMPLE_ID'])
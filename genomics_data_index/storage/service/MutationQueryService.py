@@ -1,8 +1,10 @@
 from pathlib import Path
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Set, cast
 
 import pandas as pd
 
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeIndex import TreeIndex
 from genomics_data_index.storage.model.QueryFeature import QueryFeature
 from genomics_data_index.storage.model.QueryFeatureMutation import QueryFeatureMutation
 from genomics_data_index.storage.service.FullFeatureQueryService import FullFeatureQueryService
@@ -22,26 +24,24 @@ class MutationQueryService(FullFeatureQueryService):
 
     def _find_matches_internal(self, sample_names: List[str], distance_threshold: float = None) -> pd.DataFrame:
         sample_distances = []
+        reference_tree_indexes = {}
         for sample_name in sample_names:
             reference_genomes = self._reference_service.find_references_for_sample(sample_name)
 
             for reference_genome in reference_genomes:
-                tree = reference_genome.tree
-
-                sample_leaves = tree.get_leaves_by_name(sample_name)
-                if len(sample_leaves) != 1:
-                    raise Exception(
-                        f'Invalid number of matching leaves for sample [{sample_name}], leaves {sample_leaves}')
-
-                sample_node = sample_leaves[0]
-
-                leaves = tree.get_leaves()
-                for leaf in leaves:
-                    if leaf.name == sample_node.name:
+                # Parse and index each tree once for all query samples
+                if reference_genome.id not in reference_tree_indexes:
+                    reference_tree_indexes[reference_genome.id] = TreeIndex.get(reference_genome.shared_tree())
+                tree_index = reference_tree_indexes[reference_genome.id]
+
+                distances = tree_index.leaf_distances(sample_name)
+                align_length = reference_genome.tree_alignment_length
+                for leaf_name, distance in zip(tree_index.leaf_names, distances):
+                    if leaf_name == sample_name:
+                        continue
+                    elif distance_threshold is not None and distance > distance_threshold:
                         continue
-                    distance = sample_node.get_distance(leaf)
-                    align_length = reference_genome.tree_alignment_length
-                    sample_distances.append([reference_genome.name, sample_name, leaf.name,
+                    sample_distances.append([reference_genome.name, sample_name, leaf_name,
                                              f'{distance * align_length:0.2f}', distance, align_length])
 
         matches_df = pd.DataFrame(data=sample_distances, columns=[
@@ -57,9 +57,6 @@ class MutationQueryService(FullFeatureQueryService):
         matches_df['SNV Alignment Length'] = pd.to_numeric(matches_df['SNV Alignment Length'])
         matches_df = matches_df.sort_values(['Query', 'Distance (subs/site)'], ascending=True)
 
-        if distance_threshold is not None:
-            matches_df = matches_df.loc[:, matches_df['Distance (subs/site)'] <= distance_threshold]
-
         return matches_df
 
     def get_correct_query_feature(self) -> Any:
@@ -79,15 +76,20 @@ class MutationQueryService(FullFeatureQueryService):
         return sequence_sample_counts
 
     def _get_unknown_features(self, features: List[QueryFeature]) -> pd.DataFrame:
-        data = []
+        feature_unknown_sample_sets = {}
+        all_unknown_sample_set = SampleSet.create_empty()
         for feature in features:
-            reference = self._reference_service.find_reference_for_sequence(feature.scope)
+            unknown_sample_set = self._sample_service.find_unknown_sample_set_by_feature(
+                cast(QueryFeatureMutation, feature))
+            feature_unknown_sample_sets[feature.id] = unknown_sample_set
+            all_unknown_sample_set = all_unknown_sample_set.union(unknown_sample_set)
 
-            # TODO: I'm doing linear search over all samples, this could be improved
-            for sample_variation in reference.sample_nucleotide_variation:
-                masked_regions = sample_variation.masked_regions
-                if masked_regions.overlaps_range(feature.scope, feature.start, feature.stop):
-                    data.append([feature.id, sample_variation.sample.name, sample_variation.sample.id, 'Unknown'])
+        sample_names = {s.id: s.name for s in self._sample_service.find_samples_by_ids(all_unknown_sample_set)}
+
+        data = []
+        for feature_id, unknown_sample_set in feature_unknown_sample_sets.items():
+            for sample_id in unknown_sample_set:
+                data.append([feature_id, sample_names[sample_id], sample_id, 'Unknown'])
 
         return pd.DataFrame(data, columns=['Feature', 'Sample Name', 'Sample ID', 'Status'])
 
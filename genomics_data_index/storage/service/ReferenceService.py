@@ -2,11 +2,14 @@ from pathlib import Path
 from typing import List, Dict, Iterable
 
 import ga4gh.vrs.dataproxy as dataproxy
+import numpy as np
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from biocommons.seqrepo import SeqRepo
 from ete3 import Tree
 
+from genomics_data_index.storage.ReferenceGenomeCache import ReferenceGenomeCache
+from genomics_data_index.storage.TreeCache import TreeCache
 from genomics_data_index.storage.model.QueryFeatureMutation import QueryFeatureMutation
 from genomics_data_index.storage.model.db import Reference, SampleNucleotideVariation, ReferenceSequence, Sample
 from genomics_data_index.storage.service import DatabaseConnection, EntityExistsError
@@ -17,7 +20,16 @@ class ReferenceService:
     MUTATION_ID_TYPES = ['spdi_ref']
 
     def __init__(self, database_connection: DatabaseConnection, seq_repo_dir: Path,
-                 seq_repo_namespace: str = 'genomics_data_index'):
+                 seq_repo_namespace: str = 'genomics_data_index', cache_dir: Path = None):
+        """
+        Builds a new ReferenceService.
+        :param database_connection: The database connection.
+        :param seq_repo_dir: The SeqRepo directory storing reference genome sequences.
+        :param seq_repo_namespace: The SeqRepo namespace for reference genome sequences.
+        :param cache_dir: The directory of the cache of reference genome sequences (see ReferenceGenomeCache).
+                          If None then sequences are always read from SeqRepo and reference genome files
+                          (get_reference_genome_file()) cannot be created.
+        """
         self._connection = database_connection
         self._seq_repo_namespace = seq_repo_namespace
 
@@ -25,6 +37,11 @@ class ReferenceService:
             self._seq_repo_updatable = SeqRepo(seq_repo_dir, writeable=True)
             self._seq_repo_proxy = dataproxy.SeqRepoDataProxy(SeqRepo(seq_repo_dir))
 
+        if cache_dir is not None:
+            self._sequence_cache = ReferenceGenomeCache(cache_dir)
+        else:
+            self._sequence_cache = None
+
     def add_reference_genome(self, genome_file: Path):
         (genome_name, sequences) = parse_sequence_file(genome_file)
 
@@ -42,15 +59,53 @@ class ReferenceService:
         reference = self.find_reference_genome(reference_name)
         return {s.sequence_name: s for s in reference.sequences}
 
-    def get_sequence(self, sequence_name: str) -> SeqRecord:
+    def _get_seq_repo_sequence(self, sequence_name: str) -> str:
         namespace = self._seq_repo_namespace
-        seq_string = self._seq_repo_proxy.get_sequence(f'{namespace}:{sequence_name}')
+        return self._seq_repo_proxy.get_sequence(f'{namespace}:{sequence_name}')
+
+    def get_sequence_array(self, sequence_name: str) -> np.ndarray:
+        """
+        Gets the bytes of a sequence as a (read-only) uint8 array. Sequences are read from SeqRepo only the first
+        time and are afterwards read from a cache of memory-mapped sequence files (if there is a cache).
+        :param sequence_name: The sequence name.
+        :return: An array of the bytes of the sequence.
+        """
+        if self._sequence_cache is None:
+            sequence_array = np.frombuffer(self._get_seq_repo_sequence(sequence_name).encode('utf-8'), dtype=np.uint8)
+            sequence_array.flags.writeable = False
+            return sequence_array
+        elif not self._sequence_cache.has_sequence(sequence_name):
+            self._sequence_cache.store_sequence(sequence_name, self._get_seq_repo_sequence(sequence_name))
+        return self._sequence_cache.get_sequence_array(sequence_name)
+
+    def get_sequence(self, sequence_name: str) -> SeqRecord:
+        seq_string = self.get_sequence_array(sequence_name).tobytes().decode('utf-8')
         return SeqRecord(Seq(seq_string), id=sequence_name)
 
     def get_reference_genome_records(self, reference_name: str) -> List[SeqRecord]:
         reference = self.find_reference_genome(reference_name)
         return [self.get_sequence(sequence.sequence_name) for sequence in reference.sequences]
 
+    def get_reference_sequence_names(self, reference_name: str) -> List[str]:
+        reference = self.find_reference_genome(reference_name)
+        return [sequence.sequence_name for sequence in reference.sequences]
+
+    def get_reference_genome_file(self, reference_name: str) -> Path:
+        """
+        Gets a FASTA file (with a faidx index) of the reference genome, which is written once to the sequence cache
+        and re-used afterwards.
+        :param reference_name: The reference genome name.
+        :return: The path to the reference genome FASTA file.
+        """
+        if self._sequence_cache is None:
+            raise Exception(f'Cannot get a file for reference genome [{reference_name}] since there is no cache '
+                            f'of reference genome sequences (cache_dir was not set)')
+
+        sequence_names = self.get_reference_sequence_names(reference_name)
+        for sequence_name in sequence_names:
+            self.get_sequence_array(sequence_name)
+        return self._sequence_cache.get_reference_file(reference_name, sequence_names)
+
     def _create_reference_genome_db(self, reference_file: Path):
         ref_length = 0
         ref_contigs = {}
@@ -66,13 +121,27 @@ class ReferenceService:
         self._connection.get_session().add(reference)
         self._connection.get_session().commit()
 
-    def update_tree(self, reference_name: str, tree: Tree, alignment_length: int):
+    def update_tree(self, reference_name: str, tree: Tree, alignment_length: int, align_type: str = None,
+                    model: str = None, placed_samples: int = 0):
+        """
+        Updates the tree for a reference genome.
+        :param reference_name: The reference genome name.
+        :param tree: The tree.
+        :param alignment_length: The length of the alignment used to build the tree.
+        :param align_type: The type of alignment used to build the tree.
+        :param model: The substitution model used to build the tree (if known).
+        :param placed_samples: The number of samples placed into the tree since it was last fully built.
+        """
         if alignment_length is None or alignment_length <= 0:
             raise Exception(f'Invalid alignment_length=[{alignment_length}]')
 
         reference = self.find_reference_genome(reference_name)
+        TreeCache.instance().invalidate(reference.id)
         reference.tree = tree
         reference.tree_alignment_length = alignment_length
+        reference.tree_align_type = align_type
+        reference.tree_model = model
+        reference.tree_placed_samples = placed_samples
         self._connection.get_session().commit()
 
     def find_reference_genome(self, name: str):
@@ -98,13 +167,12 @@ class ReferenceService:
         sequence_names = {f.sequence for f in spdi_features}
 
         # Create map of seq name to sequences so I don't have to re-generate them for every spdi_id
-        namespace = self._seq_repo_namespace
-        name_sequence_map = {n: self._seq_repo_proxy.get_sequence(f'{namespace}:{n}') for n in sequence_names}
+        name_sequence_map = {n: self.get_sequence_array(n) for n in sequence_names}
 
         spdi_ids_map = {}
         for f in spdi_features:
-            reference_sequence_str = name_sequence_map[f.sequence]
-            spdi_del_str = reference_sequence_str[f.start0:f.stop0]
+            reference_sequence_array = name_sequence_map[f.sequence]
+            spdi_del_str = reference_sequence_array[f.start0:f.stop0].tobytes().decode('utf-8')
             spdi_ref = f'{f.sequence}:{f.position}:{spdi_del_str}:{f.insertion}'
             spdi_ids_map[f.id] = spdi_ref
 
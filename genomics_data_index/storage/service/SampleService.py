@@ -1,3 +1,4 @@
+import logging
 from typing import List, Dict, Set, Union, cast
 
 import pandas as pd
@@ -9,14 +10,17 @@ from genomics_data_index.storage.model.QueryFeatureMLST import QueryFeatureMLST
 from genomics_data_index.storage.model.QueryFeatureMutation import QueryFeatureMutation
 from genomics_data_index.storage.model.db import NucleotideVariantsSamples, Reference, ReferenceSequence, MLSTScheme, \
     SampleMLSTAlleles, MLSTAllelesSamples, Sample
-from genomics_data_index.storage.model.db import SampleNucleotideVariation
+from genomics_data_index.storage.model.db import SampleNucleotideVariation, NucleotideUnknownSamples
 from genomics_data_index.storage.service import DatabaseConnection
 
+logger = logging.getLogger(__name__)
+
 
 class SampleService:
 
     def __init__(self, database_connection: DatabaseConnection):
         self._connection = database_connection
+        self._warned_missing_unknown_index = set()
 
     def get_samples_with_variants(self, reference_name: str) -> List[Sample]:
         """
@@ -150,6 +154,95 @@ class SampleService:
             .filter(Sample.id.in_(sample_ids)) \
             .all()
 
+    def find_unknown_sample_set_by_feature(self, feature: QueryFeatureMutation) -> SampleSet:
+        """
+        Finds the set of samples with unknown (masked) data overlapping the reference positions of the passed feature.
+        Features which do not cover any reference positions (e.g., insertions with an empty ref) are treated as covering
+        their start position.
+        :param feature: The feature.
+        :return: The set of samples with unknown data overlapping the feature.
+        """
+        start = feature.start0
+        stop = max(feature.stop0, start + 1)
+        return self.find_unknown_sample_set(sequence_name=feature.sequence, start=start, stop=stop)
+
+    def find_unknown_sample_set(self, sequence_name: str, start: int, stop: int) -> SampleSet:
+        """
+        Finds the set of samples with unknown (masked) data overlapping the range [start, stop) on the passed
+        sequence, using the index of segments with unknown data (see NucleotideUnknownSamples). If there is no
+        index for the sequence (e.g., it was created before this index existed) then the masked regions of each sample
+        are read instead.
+        :param sequence_name: The sequence name.
+        :param start: The (0-based) start of the range.
+        :param stop: The stop of the range (not included in the range).
+        :return: The set of samples with unknown data overlapping the range.
+        """
+        if stop <= start:
+            raise Exception(f'stop=[{stop}] must be greater than start=[{start}]')
+
+        if not self._has_unknown_index(sequence_name):
+            return self._find_unknown_sample_set_from_masks(sequence_name, start=start, stop=stop)
+
+        session = self._connection.get_session()
+
+        # Segments do not overlap so only the last segment starting at or before start can contain start
+        containing_segment = session.query(NucleotideUnknownSamples) \
+            .filter(NucleotideUnknownSamples.sequence == sequence_name) \
+            .filter(NucleotideUnknownSamples.start <= start) \
+            .order_by(NucleotideUnknownSamples.start.desc()) \
+            .first()
+        overlapping_segments = session.query(NucleotideUnknownSamples) \
+            .filter(NucleotideUnknownSamples.sequence == sequence_name) \
+            .filter(NucleotideUnknownSamples.start > start) \
+            .filter(NucleotideUnknownSamples.start < stop) \
+            .all()
+
+        if containing_segment is not None and containing_segment.stop > start:
+            overlapping_segments.append(containing_segment)
+
+        unknown_sample_set = SampleSet.create_empty()
+        for segment in overlapping_segments:
+            unknown_sample_set = unknown_sample_set.union(segment.sample_ids)
+        return unknown_sample_set
+
+    def _has_unknown_index(self, sequence_name: str) -> bool:
+        """
+        Whether or not the index of samples with unknown data can be used for the passed sequence. The index can be
+        used if it was built for all samples on the reference genome containing the sequence (an empty index is
+        valid if no samples have unknown data), or if there are no samples on the reference genome.
+        :param sequence_name: The sequence name.
+        :return: True if the index can be used, False otherwise.
+        """
+        session = self._connection.get_session()
+        not_indexed_references = session.query(Reference.id) \
+            .join(Reference.sequences) \
+            .filter(ReferenceSequence.sequence_name == sequence_name) \
+            .filter(Reference.unknown_samples_indexed.isnot(True)) \
+            .all()
+        not_indexed_reference_ids = [r.id for r in not_indexed_references]
+        if len(not_indexed_reference_ids) == 0:
+            return True
+
+        missing_index = session.query(SampleNucleotideVariation.sample_id) \
+                            .filter(SampleNucleotideVariation.reference_id.in_(not_indexed_reference_ids)) \
+                            .first() is not None
+        if missing_index and sequence_name not in self._warned_missing_unknown_index:
+            logger.warning(f'No index of samples with unknown data found for sequence [{sequence_name}], '
+                           f'reading masked regions of all samples instead (this will be slow). '
+                           f'To build the index please run "gdi rebuild unknown-index"')
+            self._warned_missing_unknown_index.add(sequence_name)
+        return not missing_index
+
+    def _find_unknown_sample_set_from_masks(self, sequence_name: str, start: int, stop: int) -> SampleSet:
+        sample_variations = self._connection.get_session().query(SampleNucleotideVariation) \
+            .join(SampleNucleotideVariation.reference) \
+            .join(Reference.sequences) \
+            .filter(ReferenceSequence.sequence_name == sequence_name) \
+            .all()
+        unknown_sample_ids = [v.sample_id for v in sample_variations
+                              if v.masked_regions.overlaps_range(sequence_name, start=start, stop=stop)]
+        return SampleSet(unknown_sample_ids)
+
     def _get_variants_samples_by_variation_features(self, features: List[QueryFeatureMutation]) -> Dict[
         str, NucleotideVariantsSamples]:
         standardized_features_to_input_feature = {}
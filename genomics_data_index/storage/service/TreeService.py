@@ -1,8 +1,9 @@
 import logging
+import re
 import subprocess
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Tuple
+from typing import Tuple, Union, List, Optional
 
 from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
@@ -20,15 +21,39 @@ class TreeService:
     TREE_BUILD_TYPES = ['fasttree', 'iqtree']
     ALIGN_TYPES = ['core', 'full']
 
+    # Default fraction of samples which can be placed into an existing tree before the tree is fully rebuilt
+    DEFAULT_DRIFT_THRESHOLD = 0.1
+
+    # Results of place_samples()
+    SAMPLES_PLACED = 'placed'
+    TREE_REBUILT = 'rebuilt'
+    TREE_UNCHANGED = 'unchanged'
+
+    IQTREE_BEST_MODEL_PATTERN = re.compile(r'^Best-fit model: (\S+) chosen', re.MULTILINE)
+
     def __init__(self, database_connection: DatabaseConnection, reference_service: ReferenceService,
                  core_alignment_service: CoreAlignmentService):
         self._database = database_connection
         self._reference_service = reference_service
         self._core_alignment_service = core_alignment_service
 
-    def build_tree(self, alignment: MultipleSeqAlignment,
+    def build_tree(self, alignment: Union[MultipleSeqAlignment, Path],
                    tree_build_type: str = 'fasttree', num_cores: int = 1, align_type: str = 'core',
-                   extra_params: str = None) -> Tuple[Tree, str]:
+                   extra_params: str = None, constraint_tree: Tree = None,
+                   model: str = None) -> Tuple[Tree, str]:
+        """
+        Builds a tree from an alignment.
+        :param alignment: The alignment, either as a MultipleSeqAlignment or as the path to an alignment
+                          in FASTA format (e.g., written by CoreAlignmentService.write_alignment()).
+        :param tree_build_type: The tree building software (one of TREE_BUILD_TYPES).
+        :param num_cores: The number of cores to use.
+        :param align_type: The type of alignment (one of ALIGN_TYPES).
+        :param extra_params: Extra parameters to the tree building software.
+        :param constraint_tree: A tree (of a subset of the samples in the alignment) whose topology the built tree
+                                must be consistent with (only for iqtree).
+        :param model: The substitution model to use instead of selecting a model (only for iqtree).
+        :return: A tuple of (tree, output of tree building software).
+        """
         if not tree_build_type in self.TREE_BUILD_TYPES:
             raise Exception(
                 f'tree_type=[{tree_build_type}] is not one of the valid tree builder types {self.TREE_BUILD_TYPES}')
@@ -39,13 +64,20 @@ class TreeService:
         if extra_params is not None and tree_build_type == 'fasttree':
             raise Exception(f'extra_params is not supported for tree_build_type=[{tree_build_type}]')
 
+        if (constraint_tree is not None or model is not None) and tree_build_type == 'fasttree':
+            raise Exception(f'constraint_tree and model are not supported for tree_build_type=[{tree_build_type}]')
+
         if align_type not in self.ALIGN_TYPES:
             raise Exception(f'align_type=[{align_type}] is not supported, must be one of {self.ALIGN_TYPES}')
 
         with TemporaryDirectory() as tmp_dir:
-            input_file = Path(tmp_dir, 'input.fasta')
-            with open(input_file, 'w') as f:
-                AlignIO.write(alignment, f, 'fasta')
+            if isinstance(alignment, Path):
+                input_file = alignment
+            else:
+                input_file = Path(tmp_dir, 'input.fasta')
+                with open(input_file, 'w') as f:
+                    AlignIO.write(alignment, f, 'fasta')
+            output_prefix = Path(tmp_dir, 'input.fasta')
 
             if tree_build_type == 'fasttree':
                 output_file = Path(tmp_dir, 'fasttree.tre')
@@ -57,18 +89,28 @@ class TreeService:
                 tree = Tree(str(output_file))
                 return tree, out
             elif tree_build_type == 'iqtree':
-                output_file = f'{str(input_file)}.treefile'
+                # Write output to the temporary directory even if the input alignment file is elsewhere
+                output_file = f'{str(output_prefix)}.treefile'
                 command = ['iqtree', '--terrace', '--threads-max', str(num_cores), '-T', 'AUTO',
-                           '-s', str(input_file)]
+                           '-s', str(input_file), '--prefix', str(output_prefix)]
+
+                if constraint_tree is not None:
+                    constraint_file = Path(tmp_dir, 'constraint.tre')
+                    constraint_tree.write(outfile=str(constraint_file), format=9)
+                    command.extend(['-g', str(constraint_file)])
 
                 extra_params_list = None
                 if extra_params is not None:
                     extra_params_list = extra_params.split()
+                    if model is not None:
+                        extra_params_list = self._remove_model_param(extra_params_list)
                     command.extend(extra_params_list)
 
                 # Add ascertainment bias correction for core alignment
                 # But only add if '-m' is not included in extra_params
-                if extra_params_list is None or not ('-m' in extra_params_list):
+                if model is not None:
+                    command.extend(['-m', model])
+                elif extra_params_list is None or not ('-m' in extra_params_list):
                     if align_type == 'core':
                         command.extend(['-m', 'MFP+ASC'])
                     elif align_type == 'full':
@@ -87,21 +129,134 @@ class TreeService:
             else:
                 raise Exception(f'tree_type=[{tree_build_type}] is invalid')
 
+    def _remove_model_param(self, params: List[str]) -> List[str]:
+        params_without_model = []
+        skip_next = False
+        for param in params:
+            if skip_next:
+                skip_next = False
+            elif param == '-m':
+                skip_next = True
+            else:
+                params_without_model.append(param)
+        return params_without_model
+
+    def _selected_model(self, out: str, extra_params: str = None) -> Optional[str]:
+        """
+        Gets the substitution model used by iqtree, either the model selected by ModelFinder (from the iqtree output)
+        or a fixed model passed in extra_params.
+        """
+        match = self.IQTREE_BEST_MODEL_PATTERN.search(out)
+        if match:
+            return match.group(1)
+
+        if extra_params is not None:
+            extra_params_list = extra_params.split()
+            if '-m' in extra_params_list:
+                model_index = extra_params_list.index('-m') + 1
+                if model_index < len(extra_params_list) and 'MF' not in extra_params_list[model_index]:
+                    return extra_params_list[model_index]
+
+        return None
+
     def rebuild_tree(self, reference_name: str, num_cores: int = 1, tree_build_type='iqtree',
-                     align_type='core', extra_params=None):
-        logger.debug('Building alignment')
-        alignment = self._core_alignment_service.construct_alignment(reference_name=reference_name,
-                                                                     include_reference=True,
-                                                                     align_type=align_type)
-
-        logger.debug('Building tree')
-        tree, out = self.build_tree(alignment=alignment,
-                                    tree_build_type=tree_build_type,
-                                    num_cores=num_cores,
-                                    align_type=align_type,
-                                    extra_params=extra_params)
+                     align_type='core', extra_params=None, use_alignment_cache: bool = False):
+        with TemporaryDirectory() as tmp_dir:
+            logger.debug('Building alignment')
+            alignment_file = Path(tmp_dir, 'alignment.fasta')
+            alignment_length = self._core_alignment_service.write_alignment(output_file=alignment_file,
+                                                                            reference_name=reference_name,
+                                                                            include_reference=True,
+                                                                            align_type=align_type,
+                                                                            ncores=num_cores,
+                                                                            use_cache=use_alignment_cache)
+
+            logger.debug('Building tree')
+            tree, out = self.build_tree(alignment=alignment_file,
+                                        tree_build_type=tree_build_type,
+                                        num_cores=num_cores,
+                                        align_type=align_type,
+                                        extra_params=extra_params)
+
+        model = self._selected_model(out, extra_params) if tree_build_type == 'iqtree' else None
 
         logger.debug(f'Updating tree for reference genome [{reference_name}]')
         self._reference_service.update_tree(reference_name=reference_name,
                                             tree=tree,
-                                            alignment_length=alignment.get_alignment_length())
+                                            alignment_length=alignment_length,
+                                            align_type=align_type,
+                                            model=model)
+
+    def place_samples(self, reference_name: str, num_cores: int = 1, align_type: str = 'core',
+                      extra_params: str = None, drift_threshold: float = DEFAULT_DRIFT_THRESHOLD,
+                      use_alignment_cache: bool = False) -> str:
+        """
+        Adds samples which are not yet in the tree of a reference genome to the tree. Samples are placed by running
+        iqtree with the existing tree as a constraint tree and with the substitution model selected when the tree
+        was last fully built (which avoids model selection and an unconstrained tree search).
+        The tree is fully rebuilt (see rebuild_tree()) instead if there is no existing tree, the existing tree was built
+        with a different align_type or without a known model, or if the number of samples placed since the tree was
+        last fully built would be more than drift_threshold times the number of samples in the fully built tree.
+        :param reference_name: The reference genome name.
+        :param num_cores: The number of cores to use.
+        :param align_type: The type of alignment (one of ALIGN_TYPES).
+        :param extra_params: Extra parameters to iqtree.
+        :param drift_threshold: The fraction of samples which can be placed before the tree is fully rebuilt.
+        :param use_alignment_cache: Whether to use the cached alignment of all samples
+                                    (see CoreAlignmentService.construct_alignment()).
+        :return: SAMPLES_PLACED if samples were placed into the existing tree, TREE_REBUILT if the tree was fully
+                 rebuilt, or TREE_UNCHANGED if there were no new samples to add to the tree.
+        """
+        if drift_threshold < 0:
+            raise Exception(f'drift_threshold=[{drift_threshold}] must be non-negative')
+
+        reference = self._reference_service.find_reference_genome(reference_name)
+        if not reference.has_tree() or reference.tree_model is None or reference.tree_align_type != align_type:
+            logger.info(f'Reference genome [{reference_name}] has no tree which can be updated, rebuilding tree')
+            self.rebuild_tree(reference_name=reference_name, num_cores=num_cores, align_type=align_type,
+                              extra_params=extra_params, use_alignment_cache=use_alignment_cache)
+            return self.TREE_REBUILT
+
+        tree = reference.shared_tree()
+        tree_samples = set(tree.get_leaf_names()) - {reference_name}
+        new_samples = {v.sample.name for v in reference.sample_nucleotide_variation} - tree_samples
+        if len(new_samples) == 0:
+            logger.info(f'No new samples to add to tree for reference genome [{reference_name}]')
+            return self.TREE_UNCHANGED
+
+        placed_samples = (reference.tree_placed_samples or 0) + len(new_samples)
+        built_samples = max(len(tree_samples) - (reference.tree_placed_samples or 0), 1)
+        drift = placed_samples / built_samples
+        if drift > drift_threshold:
+            logger.info(f'Placing {len(new_samples)} samples would exceed drift threshold '
+                        f'({drift:0.3f} > {drift_threshold}), rebuilding tree for reference genome [{reference_name}]')
+            self.rebuild_tree(reference_name=reference_name, num_cores=num_cores, align_type=align_type,
+                              extra_params=extra_params, use_alignment_cache=use_alignment_cache)
+            return self.TREE_REBUILT
+
+        logger.info(f'Placing {len(new_samples)} samples into tree for reference genome [{reference_name}] '
+                    f'using model [{reference.tree_model}]')
+        with TemporaryDirectory() as tmp_dir:
+            alignment_file = Path(tmp_dir, 'alignment.fasta')
+            alignment_length = self._core_alignment_service.write_alignment(output_file=alignment_file,
+                                                                            reference_name=reference_name,
+                                                                            include_reference=True,
+                                                                            align_type=align_type,
+                                                                            ncores=num_cores,
+                                                                            use_cache=use_alignment_cache)
+
+            tree, out = self.build_tree(alignment=alignment_file,
+                                        tree_build_type='iqtree',
+                                        num_cores=num_cores,
+                                        align_type=align_type,
+                                        extra_params=extra_params,
+                                        constraint_tree=tree,
+                                        model=reference.tree_model)
+
+        self._reference_service.update_tree(reference_name=reference_name,
+                                            tree=tree,
+                                            alignment_length=alignment_length,
+                                            align_type=align_type,
+                                            model=reference.tree_model,
+                                            placed_samples=placed_samples)
+        return self.SAMPLES_PLACED
@@ -1,9 +1,11 @@
 import logging
 from pathlib import Path
-from typing import List, Set, Any, Dict, cast, Union
+from typing import List, Set, Any, Dict, cast, Union, Tuple
 
+import numpy as np
 import pandas as pd
 
+from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
 from genomics_data_index.storage.SampleSet import SampleSet
 from genomics_data_index.storage.io.FeaturesReader import FeaturesReader
 from genomics_data_index.storage.io.SampleData import SampleData
@@ -12,17 +14,21 @@ from genomics_data_index.storage.io.mutation.NucleotideSampleData import Nucleot
 from genomics_data_index.storage.io.mutation.NucleotideSampleDataPackage import NucleotideSampleDataPackage
 from genomics_data_index.storage.io.mutation.VariationFile import VariationFile
 from genomics_data_index.storage.io.mutation.VcfVariantsReader import VcfVariantsReader
-from genomics_data_index.storage.model.db import NucleotideVariantsSamples, SampleNucleotideVariation, Sample
+from genomics_data_index.storage.model.NucleotideMutationTranslater import NucleotideMutationTranslater
+from genomics_data_index.storage.model.db import NucleotideVariantsSamples, SampleNucleotideVariation, Sample, \
+    NucleotideUnknownSamples
 from genomics_data_index.storage.service import DatabaseConnection
 from genomics_data_index.storage.service.FeatureService import FeatureService
 from genomics_data_index.storage.service.ReferenceService import ReferenceService
 from genomics_data_index.storage.service.SampleService import SampleService
+from genomics_data_index.storage.util import atomic_output_files
 
 logger = logging.getLogger(__name__)
 
 
 class VariationService(FeatureService):
     MUTATION_TYPES = ['snp', 'indel', 'all', 'other']
+    SQL_IN_BATCH_SIZE = 500
 
     def __init__(self, database_connection: DatabaseConnection, variation_dir: Path,
                  reference_service: ReferenceService, sample_service: SampleService):
@@ -104,16 +110,216 @@ class VariationService(FeatureService):
             .filter(Sample.name.in_(sample_names)) \
             .all()
 
-    def _create_feature_identifier(self, features_df: pd.DataFrame) -> str:
-        return NucleotideVariantsSamples.to_spdi(
-            sequence_name=features_df['CHROM'],
-            position=features_df['POS'],
-            ref=features_df['REF'],
-            alt=features_df['ALT']
+    def convert_masks_to_binary(self, overwrite: bool = False) -> int:
+        """
+        Writes binary mask files (see MaskedGenomicRegions.write_binary()) alongside the BED mask files of all
+        samples with nucleotide variation. This is used to convert masks from indexes created before binary masks
+        were written on load.
+        :param overwrite: Whether to overwrite binary mask files which already exist.
+        :return: The number of binary mask files written.
+        """
+        sample_variations = self._connection.get_session().query(SampleNucleotideVariation).all()
+        number_written = 0
+        for sample_variation in sample_variations:
+            mask_file = sample_variation.masked_regions_file
+            binary_file = MaskedGenomicRegions.binary_file(mask_file)
+            if binary_file.exists() and not overwrite:
+                continue
+
+            logger.debug(f'Converting mask [{mask_file}] to binary mask [{binary_file}]')
+            with atomic_output_files([binary_file]) as temp_files:
+                MaskedGenomicRegions.from_file(mask_file, use_binary=False).write_binary(temp_files[0])
+            number_written += 1
+
+        logger.info(f'Wrote {number_written} binary mask files')
+        return number_written
+
+    @classmethod
+    def build_unknown_segments(cls, starts: np.ndarray, stops: np.ndarray,
+                               sample_sets: List[SampleSet]) -> List[Tuple[int, int, SampleSet]]:
+        """
+        Splits intervals of unknown (masked) data into non-overlapping segments, where each segment has the set of
+        samples with unknown data over the entire segment. Segments are split wherever this set of samples changes
+        (segments with no samples are not included). Intervals which share any samples must not overlap
+        (e.g., intervals from a single sample's mask or previously built segments).
+        :param starts: The (0-based) interval starts.
+        :param stops: The interval stops (not included in the interval).
+        :param sample_sets: The set of samples for each interval.
+        :return: A list of (start, stop, sample set) segments ordered by position.
+        """
+        if len(starts) == 0:
+            return []
+
+        breakpoints = np.unique(np.concatenate([starts, stops]))
+        start_order = np.argsort(starts, kind='stable')
+        stop_order = np.argsort(stops, kind='stable')
+
+        # The number of intervals starting (or stopping) at or before each breakpoint
+        started_counts = np.searchsorted(starts[start_order], breakpoints, side='right')
+        stopped_counts = np.searchsorted(stops[stop_order], breakpoints, side='right')
+
+        segments = []
+        active = SampleSet.create_empty()
+        number_started = 0
+        number_stopped = 0
+        for i in range(len(breakpoints) - 1):
+            for index in stop_order[number_stopped:stopped_counts[i]]:
+                active = active.minus(sample_sets[index])
+            for index in start_order[number_started:started_counts[i]]:
+                active = active.union(sample_sets[index])
+            number_stopped = stopped_counts[i]
+            number_started = started_counts[i]
+
+            if active.is_empty():
+                continue
+
+            start = int(breakpoints[i])
+            stop = int(breakpoints[i + 1])
+            if len(segments) > 0 and segments[-1][1] == start and len(segments[-1][2]) == len(active) \
+                    and len(segments[-1][2].intersection(active)) == len(active):
+                segments[-1][1] = stop
+            else:
+                segments.append([start, stop, active])
+
+        return [(start, stop, sample_set) for start, stop, sample_set in segments]
+
+    @classmethod
+    def _overlapping_intervals(cls, starts: np.ndarray, stops: np.ndarray,
+                               other_starts: np.ndarray, other_stops: np.ndarray) -> np.ndarray:
+        """
+        Finds which of the intervals [starts, stops) overlap any of the other intervals.
+        :param starts: The (0-based) interval starts.
+        :param stops: The interval stops (not included in the interval).
+        :param other_starts: The (0-based) starts of the other intervals.
+        :param other_stops: The stops of the other intervals.
+        :return: A boolean array which is True for each interval overlapping any of the other intervals.
+        """
+        if len(other_starts) == 0:
+            return np.zeros(len(starts), dtype=bool)
+
+        other_starts, other_stops = MaskedGenomicRegions._merge_intervals(other_starts, other_stops)
+
+        # The first (merged) other interval ending after each start is the only one which could overlap the interval
+        other_index = np.searchsorted(other_stops, starts, side='right')
+        overlaps = other_index < len(other_starts)
+        overlaps[overlaps] = other_starts[other_index[overlaps]] < stops[overlaps]
+        return overlaps
+
+    def _update_unknown_samples_index(self, sample_masks: Dict[int, MaskedGenomicRegions]) -> None:
+        """
+        Adds the masked regions of the passed samples to the index of samples with unknown data on each segment of
+        the genome (see NucleotideUnknownSamples). Only existing segments overlapping the new masked regions are
+        re-split (and replaced) along with the new masked regions, all other segments are left as they are.
+        :param sample_masks: A dictionary mapping sample IDs to the masked regions for the sample.
+        :return: None.
+        """
+        session = self._connection.get_session()
+        sample_sets = {sample_id: SampleSet([sample_id]) for sample_id in sample_masks}
+        sequence_names = set()
+        for mask in sample_masks.values():
+            sequence_names.update(mask.sequence_names())
+
+        for sequence_name in sequence_names:
+            new_starts = []
+            new_stops = []
+            new_sample_sets = []
+            for sample_id, mask in sample_masks.items():
+                mask_starts, mask_stops = mask.sequence_intervals(sequence_name)
+                new_starts.append(mask_starts)
+                new_stops.append(mask_stops)
+                new_sample_sets.extend([sample_sets[sample_id]] * len(mask_starts))
+            new_starts = np.concatenate(new_starts)
+            new_stops = np.concatenate(new_stops)
+
+            # Only load the positions of existing segments to find those overlapping the new masked regions
+            existing_positions = session.query(NucleotideUnknownSamples.start, NucleotideUnknownSamples.stop) \
+                .filter(NucleotideUnknownSamples.sequence == sequence_name) \
+                .all()
+            existing_starts = np.array([p[0] for p in existing_positions], dtype=np.int64)
+            existing_stops = np.array([p[1] for p in existing_positions], dtype=np.int64)
+            touched_starts = existing_starts[self._overlapping_intervals(existing_starts, existing_stops,
+                                                                         new_starts, new_stops)].tolist()
+
+            touched_segments = []
+            for i in range(0, len(touched_starts), self.SQL_IN_BATCH_SIZE):
+                touched_starts_batch = touched_starts[i:i + self.SQL_IN_BATCH_SIZE]
+                touched_segments.extend(session.query(NucleotideUnknownSamples)
+                                        .filter(NucleotideUnknownSamples.sequence == sequence_name)
+                                        .filter(NucleotideUnknownSamples.start.in_(touched_starts_batch))
+                                        .all())
+                session.query(NucleotideUnknownSamples) \
+                    .filter(NucleotideUnknownSamples.sequence == sequence_name) \
+                    .filter(NucleotideUnknownSamples.start.in_(touched_starts_batch)) \
+                    .delete(synchronize_session=False)
+
+            starts = np.concatenate([np.array([s.start for s in touched_segments], dtype=np.int64), new_starts])
+            stops = np.concatenate([np.array([s.stop for s in touched_segments], dtype=np.int64), new_stops])
+            interval_sample_sets = [s.sample_ids for s in touched_segments] + new_sample_sets
+
+            segments = self.build_unknown_segments(starts, stops, interval_sample_sets)
+            logger.debug(f'Replaced {len(touched_segments)} with {len(segments)} segments with unknown data '
+                         f'on sequence [{sequence_name}]')
+
+            session.bulk_save_objects([NucleotideUnknownSamples(sequence=sequence_name, start=start, stop=stop,
+                                                                sample_ids=sample_set)
+                                       for start, stop, sample_set in segments])
+        session.commit()
+
+    def rebuild_unknown_samples_index(self, reference_name: str) -> None:
+        """
+        Rebuilds the index of samples with unknown data (see NucleotideUnknownSamples) on the passed reference genome
+        from the masked regions of all samples. This is used for indexes created before this index was built on load.
+        :param reference_name: The reference genome name.
+        :return: None.
+        """
+        reference = self._reference_service.find_reference_genome(reference_name)
+        sequence_names = [s.sequence_name for s in reference.sequences]
+        self._connection.get_session().query(NucleotideUnknownSamples) \
+            .filter(NucleotideUnknownSamples.sequence.in_(sequence_names)) \
+            .delete(synchronize_session=False)
+
+        sample_masks = {v.sample_id: v.masked_regions for v in reference.sample_nucleotide_variation}
+        reference.unknown_samples_indexed = True
+        self._update_unknown_samples_index(sample_masks)
+
+    def index_features(self, features_reader: FeaturesReader, feature_scope_name: str) -> None:
+        super().index_features(features_reader=features_reader, feature_scope_name=feature_scope_name)
+
+        logger.info('Indexing unknown (masked) regions from all samples')
+        features_reader = cast(VcfVariantsReader, features_reader)
+        sample_name_ids = self._sample_service.find_sample_name_ids(features_reader.samples_set())
+        sample_masks = {sample_name_ids[sample_name]: features_reader.get_genomic_masked_region(sample_name)
+                        for sample_name in features_reader.samples_list()}
+
+        # The index only covers all samples on the reference if it was built when the first samples were loaded
+        # (or rebuilt since). Otherwise it stays marked as not indexed until it is rebuilt.
+        reference = self._reference_service.find_reference_genome(feature_scope_name)
+        if len(reference.sample_nucleotide_variation) == len(sample_masks):
+            reference.unknown_samples_indexed = True
+        self._update_unknown_samples_index(sample_masks)
+        logger.info('Finished indexing unknown regions from all samples')
+
+    def _create_feature_identifiers(self, features_df: pd.DataFrame) -> pd.Series:
+        return NucleotideMutationTranslater.to_spdi_series(
+            sequence_names=features_df['CHROM'],
+            positions=features_df['POS'],
+            refs=features_df['REF'],
+            alts=features_df['ALT']
         )
 
+    def _get_existing_feature_objects(self, feature_ids: List[str]) -> Dict[str, Any]:
+        # Look up by the (indexed) primary key columns instead of the spdi column, which is not indexed.
+        # This finds all variants at the passed positions, so only those matching the feature_ids are kept.
+        feature_keys = [NucleotideVariantsSamples.from_spdi(feature_id) for feature_id in feature_ids]
+        variants = self._connection.get_session().query(NucleotideVariantsSamples) \
+            .filter(NucleotideVariantsSamples.sequence.in_({k[0] for k in feature_keys})) \
+            .filter(NucleotideVariantsSamples.position.in_({k[1] for k in feature_keys})) \
+            .all()
+        feature_ids_set = set(feature_ids)
+        return {v.spdi: v for v in variants if v.spdi in feature_ids_set}
+
     def _get_sample_id_series(self, features_df: pd.DataFrame, sample_name_ids: Dict[str, int]) -> pd.Series:
-        return features_df.apply(lambda x: sample_name_ids[x['SAMPLE']], axis='columns')
+        return features_df['SAMPLE'].map(sample_name_ids)
 
     def _create_feature_object(self, features_df: pd.DataFrame):
         return NucleotideVariantsSamples(spdi=features_df['_FEATURE_ID'], var_type=features_df['TYPE'],
@@ -126,7 +332,7 @@ class VariationService(FeatureService):
         return NucleotideSampleData
 
     def aggregate_feature_column(self) -> Dict[str, Any]:
-        return {'TYPE': 'first', '_SAMPLE_ID': SampleSet}
+        return {'TYPE': 'first'}
 
     def check_samples_have_features(self, sample_names: Set[str], feature_scope_name: str) -> bool:
         samples_with_variants = {sample.name for sample in
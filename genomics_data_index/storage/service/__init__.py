@@ -1,7 +1,7 @@
 import logging
 
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 
 import genomics_data_index.storage.model.db
@@ -12,6 +12,12 @@ logger = logging.getLogger(__name__)
 
 
 class DatabaseConnection:
+    # Columns added to existing tables since tables were first created, which are added to
+    # existing databases (create_all() only creates missing tables)
+    ADDED_COLUMNS = {
+        'reference': ['tree_compact', 'tree_align_type', 'tree_model', 'tree_placed_samples',
+                      'unknown_samples_indexed'],
+    }
 
     def __init__(self, connection_string: str, database_path_translator: DatabasePathTranslator):
         engine = create_engine(connection_string, echo=False)
@@ -28,6 +34,23 @@ class DatabaseConnection:
         genomics_data_index.storage.model.db.database_path_translator = database_path_translator
 
         Base.metadata.create_all(engine)
+        self._upgrade_schema(engine)
+
+    def _upgrade_schema(self, engine) -> None:
+        """
+        Adds any columns in ADDED_COLUMNS which are missing from tables in an existing database.
+        :param engine: The database engine.
+        :return: None.
+        """
+        inspector = inspect(engine)
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column_name in self.ADDED_COLUMNS.get(table.name, []):
+                if column_name not in existing_columns:
+                    column_type = table.columns[column_name].type.compile(dialect=engine.dialect)
+                    logger.info(f'Upgrading database: adding column [{column_name}] to table [{table.name}]')
+                    with engine.begin() as connection:
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_name} {column_type}'))
 
     def get_session(self):
         return self._session
@@ -1,11 +1,15 @@
 import gzip
 import logging
+import os
+import shutil
 import subprocess
+import uuid
+from contextlib import contextmanager
 from functools import partial
 from mimetypes import guess_type
 from os.path import basename, splitext
 from pathlib import Path
-from typing import Tuple, List
+from typing import Tuple, List, Generator
 
 from Bio import SeqIO
 from Bio.SeqRecord import SeqRecord
@@ -50,3 +54,43 @@ def execute_commands(commands: List[List[str]]):
     except subprocess.CalledProcessError as e:
         err_msg = str(e.stderr.strip())
         raise Exception(f'Could not run [{" ".join(e.cmd)}]: error {err_msg}')
+
+
+@contextmanager
+def atomic_output_files(files: List[Path]) -> Generator[List[Path], None, None]:
+    '''
+    Provides temporary paths (in the same directories as the passed files) to write output to. On successful exit
+    the temporary files are renamed (atomically) to the passed files, in the passed order. On failure any temporary
+    files are removed so that no partially-written files are left behind.
+
+    All temporary files share the same prefix, so an output file derived from another by adding a suffix
+    (e.g., an index "file.vcf.gz.csi" written alongside "file.vcf.gz") has the same relationship between
+    the temporary paths.
+    :param files: The final output files.
+    :return: A list of temporary files corresponding to the passed files.
+    '''
+    prefix = f'.tmp-{uuid.uuid4().hex}-'
+    temp_files = [f.parent / f'{prefix}{f.name}' for f in files]
+    try:
+        yield temp_files
+        for temp_file, file in zip(temp_files, files):
+            os.replace(temp_file, file)
+    finally:
+        for temp_file in temp_files:
+            if temp_file.exists():
+                temp_file.unlink()
+
+
+def link_or_copy_file(source: Path, destination: Path) -> None:
+    '''
+    Hard-links source to destination, or copies the file if a link cannot be made (e.g., the files are on different
+    filesystems). The destination file is only ever written completely (see atomic_output_files()).
+    :param source: The source file.
+    :param destination: The destination file.
+    :return: None.
+    '''
+    with atomic_output_files([destination]) as temp_files:
+        try:
+            os.link(source, temp_files[0])
+        except OSError:
+            shutil.copy(source, temp_files[0])
@@ -1,3 +1,4 @@
+import logging
 import math
 from typing import cast
 
@@ -44,6 +45,11 @@ def test_initialized_query_mutations(loaded_database_connection_with_built_tree:
     assert isinstance(initial_query, TreeSamplesQuery)
     assert initial_query.tree is not None
 
+    # The tree is a copy so modifying it should not modify the tree of the query
+    tree = initial_query.tree
+    tree.prune(['genome'])
+    assert {'SampleA', 'SampleB', 'SampleC', 'genome'} == set(initial_query.tree.get_leaf_names())
+
 
 def test_query_isin_sample_names(loaded_database_connection: DataIndexConnection):
     db = loaded_database_connection.database
@@ -274,12 +280,56 @@ def test_query_single_mutation_summary(loaded_database_connection: DataIndexConn
             '% Present', '% Absent', '% Unknown'] == df.columns.tolist()
     assert 'reference:5061:G:A' == df.iloc[0]['Query']
     assert 1 == df.iloc[0]['Present']
-    assert 8 == df.iloc[0]['Absent']
-    assert pd.isna(df.iloc[0]['Unknown'])
+    assert 7 == df.iloc[0]['Absent']
+    assert 1 == df.iloc[0]['Unknown']
     assert 9 == df.iloc[0]['Total']
     assert math.isclose((1 / 9) * 100, df.iloc[0]['% Present'])
-    assert math.isclose((8 / 9) * 100, df.iloc[0]['% Absent'])
-    assert pd.isna(df.iloc[0]['% Unknown'])
+    assert math.isclose((7 / 9) * 100, df.iloc[0]['% Absent'])
+    assert math.isclose((1 / 9) * 100, df.iloc[0]['% Unknown'])
+
+
+def test_query_single_mutation_unknown_three_valued_logic(loaded_database_connection: DataIndexConnection):
+    db = loaded_database_connection.database
+    sampleA = db.get_session().query(Sample).filter(Sample.name == 'SampleA').one()
+    sampleB = db.get_session().query(Sample).filter(Sample.name == 'SampleB').one()
+    sampleC = db.get_session().query(Sample).filter(Sample.name == 'SampleC').one()
+
+    # SampleB has the mutation and SampleA has this position masked
+    query_result = query(loaded_database_connection).hasa('reference:5061:G:A', kind='mutation')
+    assert {sampleB.id} == set(query_result.sample_set)
+    assert {sampleA.id} == set(query_result.unknown_set)
+
+    # Complement of unknown is unknown
+    query_result_complement = query_result.complement()
+    assert 7 == len(query_result_complement)
+    assert sampleA.id not in query_result_complement.sample_set
+    assert sampleB.id not in query_result_complement.sample_set
+    assert {sampleA.id} == set(query_result_complement.unknown_set)
+
+    # Position 1 is masked in all of SampleA, SampleB, SampleC
+    query_result_masked = query(loaded_database_connection).hasa('reference:1:1:A', kind='mutation')
+    assert 0 == len(query_result_masked)
+    assert {sampleA.id, sampleB.id, sampleC.id} == set(query_result_masked.unknown_set)
+
+    # Present or unknown is present; absent or unknown is unknown
+    query_result_or = query_result | query_result_masked
+    assert {sampleB.id} == set(query_result_or.sample_set)
+    assert {sampleA.id, sampleC.id} == set(query_result_or.unknown_set)
+
+    # Present and unknown is unknown; absent and unknown is absent
+    query_result_and = query_result & query_result_masked
+    assert 0 == len(query_result_and)
+    assert {sampleA.id, sampleB.id} == set(query_result_and.unknown_set)
+
+    # Chained queries restrict unknowns to the samples which are present or unknown in the prior query
+    query_result_chained = query_result.hasa('reference:1:1:A', kind='mutation')
+    assert 0 == len(query_result_chained)
+    assert {sampleA.id, sampleB.id} == set(query_result_chained.unknown_set)
+
+    df = query_result_chained.summary()
+    assert 0 == df.iloc[0]['Present']
+    assert 2 == df.iloc[0]['Unknown']
+    assert 7 == df.iloc[0]['Absent']
 
 
 def test_query_single_mutation_two_samples(loaded_database_connection: DataIndexConnection):
@@ -488,12 +538,12 @@ def test_query_single_mutation_no_results_summary(loaded_database_connection: Da
             '% Present', '% Absent', '% Unknown'] == df.columns.tolist()
     assert 'reference:1:1:A' == df.iloc[0]['Query']
     assert 0 == df.iloc[0]['Present']
-    assert 9 == df.iloc[0]['Absent']
-    assert pd.isna(df.iloc[0]['Unknown'])
+    assert 6 == df.iloc[0]['Absent']
+    assert 3 == df.iloc[0]['Unknown']
     assert 9 == df.iloc[0]['Total']
     assert math.isclose((0 / 9) * 100, df.iloc[0]['% Present'])
-    assert math.isclose((9 / 9) * 100, df.iloc[0]['% Absent'])
-    assert pd.isna(df.iloc[0]['% Unknown'])
+    assert math.isclose((6 / 9) * 100, df.iloc[0]['% Absent'])
+    assert math.isclose((3 / 9) * 100, df.iloc[0]['% Unknown'])
 
 
 def test_all_samples_summary(loaded_database_connection: DataIndexConnection):
@@ -504,11 +554,11 @@ def test_all_samples_summary(loaded_database_connection: DataIndexConnection):
     assert '' == df.iloc[0]['Query']
     assert 9 == df.iloc[0]['Present']
     assert 0 == df.iloc[0]['Absent']
-    assert pd.isna(df.iloc[0]['Unknown'])
+    assert 0 == df.iloc[0]['Unknown']
     assert 9 == df.iloc[0]['Total']
     assert math.isclose((9 / 9) * 100, df.iloc[0]['% Present'])
     assert math.isclose((0 / 9) * 100, df.iloc[0]['% Absent'])
-    assert pd.isna(df.iloc[0]['% Unknown'])
+    assert math.isclose((0 / 9) * 100, df.iloc[0]['% Unknown'])
 
 
 def test_join_custom_dataframe_no_query(loaded_database_connection: DataIndexConnection):
@@ -1279,6 +1329,22 @@ def test_within_constructed_tree_larger_tree(loaded_database_connection: DataInd
             } == set(df['Query'].tolist())
 
 
+def test_tree_styler_highlight_sample_not_in_tree(loaded_database_connection: DataIndexConnection, caplog):
+    query_result = query(loaded_database_connection).hasa('reference:839:C:G', kind='mutation') \
+        .build_tree(kind='mutation', scope='genome', include_reference=True)
+    assert 2 == len(query_result)
+
+    styler = query_result.tree_styler() \
+        .highlight(query(loaded_database_connection).isa('SampleA')) \
+        .highlight(query_result.isa('SampleB'))
+    with caplog.at_level(logging.WARNING):
+        leaves = {leaf.name: leaf for leaf in styler.tree.iter_leaves()}
+
+    assert {'SampleB', 'SampleC', 'genome'} == set(leaves.keys())
+    assert 'Could not find sample=[SampleA] in tree. Not highlighting.' in caplog.text
+    assert 'sample=[SampleB]' not in caplog.text
+
+
 def test_summary_features_all(loaded_database_connection: DataIndexConnection):
     dfA = pd.read_csv(snippy_all_dataframes['SampleA'], sep='\t')
     dfB = pd.read_csv(snippy_all_dataframes['SampleB'], sep='\t')
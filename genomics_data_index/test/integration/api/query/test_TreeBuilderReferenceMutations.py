@@ -53,6 +53,26 @@ def test_build_tree_core(loaded_database_connection):
     assert abs(expected_distance - actual_distance) < 5
 
 
+def test_build_tree_core_alignment_cache(loaded_database_connection):
+    tree_builder = TreeBuilderReferenceMutations(database_connection=loaded_database_connection,
+                                                 reference_name='genome')
+
+    actual_tree, alignment_length, tree_set = tree_builder.build(samples_set=['SampleA', 'SampleB', 'SampleC'],
+                                                                 method='iqtree',
+                                                                 align_type='core',
+                                                                 include_reference=True,
+                                                                 extra_params='--seed 42 -m GTR+ASC',
+                                                                 use_alignment_cache=True
+                                                                 )
+
+    assert 58 == alignment_length
+
+    assert {'SampleA', 'SampleB', 'SampleC', 'genome'} == set(actual_tree.get_leaf_names())
+
+    tree_comparison = expected_tree.compare(actual_tree, unrooted=True)
+    assert tree_comparison['rf'] == 0
+
+
 def test_build_tree_exclude_reference(loaded_database_connection):
     tree_builder = TreeBuilderReferenceMutations(database_connection=loaded_database_connection,
                                                  reference_name='genome')
@@ -1,5 +1,7 @@
 from typing import cast
 
+import pytest
+
 from genomics_data_index.api.query.GenomicsDataIndex import GenomicsDataIndex
 from genomics_data_index.api.query.SamplesQuery import SamplesQuery
 
@@ -54,3 +56,39 @@ def test_query_pruning_tree(loaded_database_connection: DataIndexConnection):
     # Test reset universe and complement
     assert {'genome'} == set(
         query_result.isin('SampleA').reset_universe().complement().tree.get_leaf_names())
+
+    # Trees are only created when used
+    query_result_a = query_result.isa('SampleA').reset_universe().isin(['SampleA'])
+    assert not query_result_a._tree_view.is_materialized()
+    assert {'SampleA', 'genome'} == set(query_result_a.tree.get_leaf_names())
+    assert query_result_a._tree_view.is_materialized()
+
+
+def test_query_set_outgroup_relabel_samples(loaded_database_connection: DataIndexConnection):
+    query_result = query(loaded_database_connection).build_tree(
+        kind='mutation_experimental', scope='genome',
+        include_reference=True, extra_params='--seed 42 -m GTR').reset_universe()
+    query_result = cast(ExperimentalTreeSamplesQuery, query_result)
+
+    outgroup_query = query_result.set_outgroup('SampleA')
+    assert 'SampleA' in {n.name for n in outgroup_query.tree.get_children()}
+
+    relabeled_query = query_result.relabel_samples(lambda name: name.lower())
+    assert {'samplea', 'sampleb', 'samplec', 'genome'} == set(relabeled_query.tree.get_leaf_names())
+    assert 'samplea' in {n.name for n in relabeled_query.set_outgroup('samplea').tree.get_children()}
+
+    # Invalid leaves are found when the tree is modified, not when the tree is used
+    with pytest.raises(ValueError) as execinfo:
+        relabeled_query.set_outgroup('SampleA')
+    assert "Node names not found: ['SampleA']" in str(execinfo.value)
+
+    with pytest.raises(ValueError) as execinfo:
+        query_result.isin('SampleB').set_outgroup('SampleA')
+    assert "Node names not found: ['SampleA']" in str(execinfo.value)
+
+    def invalid_rename(name: str) -> str:
+        raise ValueError(f'Cannot rename {name}')
+
+    with pytest.raises(ValueError) as execinfo:
+        query_result.relabel_samples(invalid_rename)
+    assert 'Cannot rename' in str(execinfo.value)
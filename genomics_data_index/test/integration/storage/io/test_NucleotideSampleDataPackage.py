@@ -6,6 +6,7 @@ from typing import List, Dict, cast
 
 import pytest
 
+from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
 from genomics_data_index.storage.io.mutation.NucleotideSampleData import NucleotideSampleData
 from genomics_data_index.storage.io.mutation.NucleotideSampleDataPackage import NucleotideSampleDataPackage
 from genomics_data_index.storage.io.processor.MultipleProcessSampleFilesProcessor import \
@@ -98,6 +99,46 @@ def test_persisted_sample_data_file_names(sample_dirs):
         assert bool(re.match(r'^[0-9a-f]*$', sample_data.sample_name_persistence))
 
 
+def test_persist_preprocessed_sample_data_no_copy(sample_dirs):
+    with TemporaryDirectory() as tmp_file_str:
+        tmp_file = Path(tmp_file_str)
+        preprocess_dir = tmp_file / 'preprocess'
+        preprocess_dir.mkdir()
+        other_dir = tmp_file / 'other'
+        other_dir.mkdir()
+        vcf_masks = vcf_and_mask_files(sample_dirs)
+        file_processor = SerialSampleFilesProcessor(preprocess_dir)
+        data_package = NucleotideSampleDataPackage.create_from_sequence_masks(sample_vcf_map=vcf_masks['vcfs'],
+                                                                              masked_genomic_files_map=vcf_masks[
+                                                                                  'masks'],
+                                                                              sample_files_processor=file_processor)
+
+        processed_files_dict = data_package.process_all_data()
+        sample_data = cast(NucleotideSampleData, processed_files_dict['SampleA'])
+        vcf_file, vcf_index = sample_data.get_vcf_file()
+        mask_file = sample_data.get_mask_file()
+
+        # No temporary files left behind
+        assert not any(f.name.startswith('.tmp-') for f in preprocess_dir.iterdir())
+
+        # Persisting to the directory the files were preprocessed into does not write new files
+        files_before = set(preprocess_dir.iterdir())
+        persisted_data = cast(NucleotideSampleData, sample_data.persist(preprocess_dir))
+        assert (vcf_file, vcf_index) == persisted_data.get_vcf_file()
+        assert mask_file == persisted_data.get_mask_file()
+        assert files_before == set(preprocess_dir.iterdir())
+
+        # Persisting to a different directory links (or copies) the files
+        persisted_data = cast(NucleotideSampleData, sample_data.persist(other_dir))
+        persisted_vcf, persisted_vcf_index = persisted_data.get_vcf_file()
+        assert other_dir / vcf_file.name == persisted_vcf
+        assert other_dir / vcf_index.name == persisted_vcf_index
+        assert other_dir / mask_file.name == persisted_data.get_mask_file()
+        assert vcf_file.read_bytes() == persisted_vcf.read_bytes()
+        assert {other_dir / vcf_file.name, other_dir / vcf_index.name, other_dir / mask_file.name,
+                MaskedGenomicRegions.binary_file(other_dir / mask_file.name)} == set(other_dir.iterdir())
+
+
 def test_with_serial_sample_files_processor(sample_dirs):
     with TemporaryDirectory() as tmp_file_str:
         tmp_file = Path(tmp_file_str)
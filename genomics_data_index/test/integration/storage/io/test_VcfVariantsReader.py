@@ -1,8 +1,11 @@
+import logging
 import tempfile
+import time
 from os import path, listdir
 from pathlib import Path
 from typing import List, Dict, cast
 
+import pandas as pd
 import pytest
 
 from genomics_data_index.storage.io.mutation.NucleotideSampleData import NucleotideSampleData
@@ -11,6 +14,9 @@ from genomics_data_index.storage.io.mutation.VcfVariantsReader import VcfVariant
 from genomics_data_index.storage.io.processor.SerialSampleFilesProcessor import SerialSampleFilesProcessor
 from genomics_data_index.test.integration import data_dir
 from genomics_data_index.test.integration import data_dir_empty
+from genomics_data_index.test.integration import regular_vcf_dir
+
+logger = logging.getLogger(__name__)
 
 
 @pytest.fixture
@@ -108,6 +114,17 @@ def test_get_variants_table(variants_reader):
     assert ['OTHER'] == df.loc[(df['SAMPLE'] == 'SampleC') & (df['POS'] == 1984), 'TYPE'].tolist()
 
 
+def test_get_variants_table_batches(variants_reader):
+    batches = list(variants_reader.features_table_iter(samples_per_batch=2))
+    assert 2 == len(batches)
+    assert 2 == len(set(batches[0]['SAMPLE'].tolist()))
+    assert 1 == len(set(batches[1]['SAMPLE'].tolist()))
+
+    df = pd.concat(batches)
+    assert 129 == len(df), 'Data has incorrect length'
+    assert {'SampleA', 'SampleB', 'SampleC'} == set(df['SAMPLE'].tolist()), 'Incorrect sample names'
+
+
 def test_get_genomic_masks(variants_reader):
     mask = variants_reader.get_genomic_masked_region('SampleA')
     assert 437 == len(mask)
@@ -175,6 +192,99 @@ def test_snippy_read_vcf(variants_reader_from_snippy):
     assert 'C' == v['ALT'].values[0], 'Incorrect alt'
 
 
+def assert_readers_same(sample_files_map: Dict[str, NucleotideSampleData], vcf_files: List[Path]):
+    reader_bcftools = VcfVariantsReader.create(sample_files_map, vcf_reader_type='bcftools')
+    reader_pyvcf = VcfVariantsReader.create(sample_files_map, vcf_reader_type='pyvcf')
+
+    for vcf_file in vcf_files:
+        df_bcftools = reader_bcftools.read_vcf(vcf_file, 'SampleA')
+        df_pyvcf = reader_pyvcf.read_vcf(vcf_file, 'SampleA')
+
+        assert ['SAMPLE', 'CHROM', 'POS', 'REF', 'ALT', 'TYPE', 'FILE'] == df_bcftools.columns.tolist()
+        pd.testing.assert_frame_equal(df_pyvcf.reset_index(drop=True), df_bcftools.reset_index(drop=True))
+
+
+def processed_vcf_files(reader: VcfVariantsReader) -> List[Path]:
+    return [reader.get_sample_files(name).get_vcf_file()[0] for name in reader.samples_list()]
+
+
+def test_read_vcf_bcftools_same_as_pyvcf(variants_reader_from_snippy):
+    sample_files_map = {name: variants_reader_from_snippy.get_sample_files(name)
+                        for name in variants_reader_from_snippy.samples_list()}
+    vcf_files = [data_dir / 'SampleA' / 'snps.vcf.gz', data_dir / 'SampleB' / 'snps.fill-tags.vcf.gz']
+    assert_readers_same(sample_files_map, vcf_files + processed_vcf_files(variants_reader_from_snippy))
+
+
+def test_read_vcf_bcftools_same_as_pyvcf_non_snippy():
+    sample_vcf_map = {name: regular_vcf_dir / f'{name}.vcf.gz' for name in ['SampleA', 'SampleB', 'SampleC']}
+    file_processor = SerialSampleFilesProcessor(Path(tempfile.mkdtemp()))
+    data_package = NucleotideSampleDataPackage.create_from_sequence_masks(sample_vcf_map=sample_vcf_map,
+                                                                          sample_files_processor=file_processor)
+    processed_files = cast(Dict[str, NucleotideSampleData], data_package.process_all_data())
+    reader = VcfVariantsReader.create(processed_files)
+
+    assert_readers_same(processed_files, processed_vcf_files(reader))
+
+
+def test_read_vcf_bcftools_same_as_pyvcf_empty(sample_dirs_empty):
+    reader = variants_reader_from_snippy_internal(sample_dirs_empty)
+    sample_files_map = {name: reader.get_sample_files(name) for name in reader.samples_list()}
+    assert_readers_same(sample_files_map, processed_vcf_files(reader))
+
+
+def test_read_vcf_bcftools_same_as_pyvcf_missing_values():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vcf_file = Path(tmp_dir) / 'missing.vcf'
+        with open(vcf_file, 'w') as f:
+            f.write('##fileformat=VCFv4.2\n'
+                    '##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele">\n'
+                    '##contig=<ID=reference,length=5180>\n'
+                    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+                    'reference\t10\t.\tA\t.\t.\t.\t.\n'
+                    'reference\t20\t.\tA\tT\t.\t.\tTYPE=snp\n'
+                    'reference\t30\t.\tA\tT,G\t.\t.\tTYPE=snp,snp\n')
+
+        assert_readers_same({}, [vcf_file])
+
+        df = VcfVariantsReader.create({}, vcf_reader_type='pyvcf').read_vcf(vcf_file, 'SampleA')
+        assert ['.', 'T', 'T'] == df['ALT'].tolist()
+        assert ['.', 'snp', 'snp'] == df['TYPE'].tolist()
+
+
+def test_read_vcf_invalid_reader_type():
+    with pytest.raises(Exception) as execinfo:
+        VcfVariantsReader.create({}, vcf_reader_type='invalid')
+    assert 'Unknown value for vcf_reader_type=[invalid]' in str(execinfo.value)
+
+
+def test_benchmark_read_features_table_scaled(variants_reader_from_snippy):
+    number_copies = 1000
+    sample_files_map = {}
+    for name in variants_reader_from_snippy.samples_list():
+        sample_files = variants_reader_from_snippy.get_sample_files(name)
+        vcf_file, vcf_index = sample_files.get_vcf_file()
+        for i in range(number_copies // 3):
+            sample_files_map[f'{name}-{i}'] = NucleotideSampleData(sample_name=f'{name}-{i}',
+                                                                   vcf_file=vcf_file,
+                                                                   vcf_file_index=vcf_index,
+                                                                   mask_bed_file=sample_files.get_mask_file(),
+                                                                   preprocessed=True)
+
+    read_times = {}
+    features_tables = {}
+    for vcf_reader_type in VcfVariantsReader.VCF_READER_TYPES:
+        start_time = time.time()
+        reader = VcfVariantsReader.create(sample_files_map, vcf_reader_type=vcf_reader_type)
+        features_tables[vcf_reader_type] = reader.get_features_table()
+        read_times[vcf_reader_type] = time.time() - start_time
+
+    logger.info(f'Read {len(sample_files_map)} VCF files: ' +
+                ', '.join(f'{t} took {read_times[t]:0.2f} seconds' for t in read_times))
+
+    assert 129 * (number_copies // 3) == len(features_tables['bcftools'])
+    assert features_tables['pyvcf'].values.tolist() == features_tables['bcftools'].values.tolist()
+
+
 def test_snippy_get_variants_table(variants_reader_from_snippy):
     df = variants_reader_from_snippy.get_features_table()
 
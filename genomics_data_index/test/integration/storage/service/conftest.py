@@ -40,7 +40,8 @@ def database(filesystem_storage) -> DatabaseConnection:
 
 @pytest.fixture
 def reference_service(database, filesystem_storage) -> ReferenceService:
-    reference_service = ReferenceService(database, filesystem_storage.reference_dir)
+    reference_service = ReferenceService(database, filesystem_storage.reference_dir,
+                                         cache_dir=filesystem_storage.genome_cache_dir)
     return reference_service
 
 
@@ -110,21 +111,23 @@ def variation_service_non_snippy_vcfs(database, reference_service_with_data,
 
 @pytest.fixture
 def core_alignment_service(database, reference_service_with_data, variation_service,
-                           sample_service) -> CoreAlignmentService:
+                           sample_service, filesystem_storage) -> CoreAlignmentService:
     return CoreAlignmentService(database=database,
                                 reference_service=reference_service_with_data,
                                 variation_service=variation_service,
                                 sample_service=sample_service,
+                                alignment_dir=filesystem_storage.alignment_dir,
                                 )
 
 
 @pytest.fixture
 def core_alignment_service_non_snippy_vcfs(database, reference_service_with_data, variation_service_non_snippy_vcfs,
-                                           sample_service) -> CoreAlignmentService:
+                                           sample_service, filesystem_storage) -> CoreAlignmentService:
     return CoreAlignmentService(database=database,
                                 reference_service=reference_service_with_data,
                                 variation_service=variation_service_non_snippy_vcfs,
                                 sample_service=sample_service,
+                                alignment_dir=filesystem_storage.alignment_dir,
                                 )
 
 
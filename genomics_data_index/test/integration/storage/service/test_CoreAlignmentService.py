@@ -1,4 +1,8 @@
+import logging
+import time
 import warnings
+from pathlib import Path
+from tempfile import TemporaryDirectory
 
 import pytest
 
@@ -10,6 +14,8 @@ from Bio.Align import MultipleSeqAlignment
 from genomics_data_index.test.integration import data_dir
 from genomics_data_index.storage.service.CoreAlignmentService import CoreAlignmentService
 
+logger = logging.getLogger(__name__)
+
 
 def remove_column(alignment: MultipleSeqAlignment, position: int) -> MultipleSeqAlignment:
     if position <= 0 or position > alignment.get_alignment_length():
@@ -135,6 +141,45 @@ def test_snippy_core_align(core_alignment_service: CoreAlignmentService, expecte
     compare_alignments(expected_alignment_core, actual_alignment)
 
 
+def test_snippy_core_align_consensus_engine(core_alignment_service: CoreAlignmentService, expected_alignment_core):
+    actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                  core_engine='consensus')
+    compare_alignments(expected_alignment_core, actual_alignment)
+
+
+def test_snippy_core_align_invalid_engine(core_alignment_service: CoreAlignmentService):
+    with pytest.raises(Exception) as execinfo:
+        core_alignment_service.construct_alignment(reference_name='genome',
+                                                   samples=['SampleA', 'SampleB', 'SampleC'],
+                                                   core_engine='invalid')
+    assert 'Unknown value for core_engine=[invalid]' in str(execinfo.value)
+
+
+def test_benchmark_core_align_bitmap_consensus(core_alignment_service: CoreAlignmentService):
+    samples = ['SampleA', 'SampleB', 'SampleC']
+    number_repeats = 5
+
+    start_time = time.time()
+    for i in range(number_repeats):
+        consensus_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                         samples=samples,
+                                                                         core_engine='consensus')
+    consensus_time = (time.time() - start_time) / number_repeats
+
+    start_time = time.time()
+    for i in range(number_repeats):
+        bitmap_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                      samples=samples,
+                                                                      core_engine='bitmap')
+    bitmap_time = (time.time() - start_time) / number_repeats
+
+    logger.info(f'Core alignment of {len(samples)} samples: consensus took {consensus_time:0.4f} seconds, '
+                f'bitmap took {bitmap_time:0.4f} seconds')
+
+    compare_alignments(consensus_alignment, bitmap_alignment)
+
+
 def test_snippy_full_align(core_alignment_service, expected_alignment_full):
     actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
                                                                   samples=['SampleA', 'SampleB', 'SampleC'],
@@ -142,6 +187,60 @@ def test_snippy_full_align(core_alignment_service, expected_alignment_full):
     compare_alignments(expected_alignment_full, actual_alignment)
 
 
+def test_snippy_full_align_multiple_cores(core_alignment_service, expected_alignment_full):
+    actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                  align_type='full', ncores=2)
+    compare_alignments(expected_alignment_full, actual_alignment)
+
+
+def test_snippy_core_align_consensus_engine_multiple_cores(core_alignment_service, expected_alignment_core):
+    actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                  core_engine='consensus', ncores=2)
+    compare_alignments(expected_alignment_core, actual_alignment)
+
+
+def test_snippy_write_alignment_core(core_alignment_service, expected_alignment_core):
+    with TemporaryDirectory() as tmp_dir:
+        alignment_file = Path(tmp_dir) / 'alignment.fasta'
+        alignment_length = core_alignment_service.write_alignment(output_file=alignment_file,
+                                                                  reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'])
+        assert expected_alignment_core.get_alignment_length() == alignment_length
+
+        actual_alignment = AlignIO.read(alignment_file, 'fasta')
+        compare_alignments(expected_alignment_core, actual_alignment)
+
+
+def test_snippy_write_alignment_full(core_alignment_service, expected_alignment_full):
+    with TemporaryDirectory() as tmp_dir:
+        alignment_file = Path(tmp_dir) / 'alignment.fasta'
+        alignment_length = core_alignment_service.write_alignment(output_file=alignment_file,
+                                                                  reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                  align_type='full', ncores=2)
+        assert expected_alignment_full.get_alignment_length() == alignment_length
+
+        actual_alignment = AlignIO.read(alignment_file, 'fasta')
+        compare_alignments(expected_alignment_full, actual_alignment)
+
+
+def test_snippy_write_alignment_same_as_construct(core_alignment_service):
+    samples = ['SampleC', 'SampleA']
+    alignment = core_alignment_service.construct_alignment(reference_name='genome', samples=samples)
+
+    with TemporaryDirectory() as tmp_dir:
+        expected_file = Path(tmp_dir) / 'expected.fasta'
+        with open(expected_file, 'w') as f:
+            AlignIO.write(alignment, f, 'fasta')
+
+        actual_file = Path(tmp_dir) / 'actual.fasta'
+        core_alignment_service.write_alignment(output_file=actual_file, reference_name='genome', samples=samples)
+
+        assert expected_file.read_text() == actual_file.read_text()
+
+
 def test_regular_vcf_full_align(core_alignment_service_non_snippy_vcfs, expected_alignment_full):
     actual_alignment = core_alignment_service_non_snippy_vcfs.construct_alignment(reference_name='genome',
                                                                                   samples=['SampleA', 'SampleB',
@@ -155,3 +254,76 @@ def test_regular_vcf_core_align(core_alignment_service_non_snippy_vcfs, expected
                                                                                   samples=['SampleA', 'SampleB',
                                                                                            'SampleC'])
     compare_alignments(expected_alignment_core, actual_alignment)
+
+
+def test_snippy_core_align_cached(core_alignment_service, expected_alignment_core):
+    actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                  use_cache=True)
+    compare_alignments(expected_alignment_core, actual_alignment)
+
+    # Second time is read from the cached alignment
+    actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                  samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                  use_cache=True)
+    compare_alignments(expected_alignment_core, actual_alignment)
+
+
+def test_snippy_full_align_cached(core_alignment_service, expected_alignment_full):
+    for i in range(2):
+        actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                      samples=['SampleA', 'SampleB', 'SampleC'],
+                                                                      align_type='full', use_cache=True)
+        compare_alignments(expected_alignment_full, actual_alignment)
+
+
+def test_snippy_align_cached_subsets(core_alignment_service):
+    for samples in [['SampleA'], ['SampleB', 'SampleC'], ['SampleC', 'SampleA'], None]:
+        for align_type in ['core', 'full']:
+            expected_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                            samples=samples,
+                                                                            align_type=align_type)
+            actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                          samples=samples,
+                                                                          align_type=align_type,
+                                                                          use_cache=True)
+            compare_alignments(expected_alignment, actual_alignment)
+
+
+def test_snippy_core_align_cached_consensus_engine(core_alignment_service):
+    samples = ['SampleA', 'SampleB', 'SampleC']
+    expected_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                    samples=samples,
+                                                                    core_engine='consensus')
+    actual_alignment = core_alignment_service.construct_alignment(reference_name='genome',
+                                                                  samples=samples,
+                                                                  core_engine='consensus', use_cache=True)
+    compare_alignments(expected_alignment, actual_alignment)
+
+
+def test_benchmark_core_align_cached(core_alignment_service: CoreAlignmentService):
+    samples = ['SampleA', 'SampleB', 'SampleC']
+    number_repeats = 5
+
+    # Fill the cache
+    core_alignment_service.construct_alignment(reference_name='genome', samples=samples, use_cache=True)
+
+    start_time = time.time()
+    for i in range(number_repeats):
+        for subset in [samples, samples[:2], samples[1:]]:
+            expected_alignment = core_alignment_service.construct_alignment(reference_name='genome', samples=subset,
+                                                                            align_type='full')
+    full_time = (time.time() - start_time) / number_repeats
+
+    start_time = time.time()
+    for i in range(number_repeats):
+        for subset in [samples, samples[:2], samples[1:]]:
+            actual_alignment = core_alignment_service.construct_alignment(reference_name='genome', samples=subset,
+                                                                          align_type='full', use_cache=True)
+    cached_time = (time.time() - start_time) / number_repeats
+
+    logger.info(f'Full alignments of subsets of {len(samples)} samples: generated took {full_time:0.4f} seconds, '
+                f'cached took {cached_time:0.4f} seconds')
+
+    compare_alignments(expected_alignment, actual_alignment)
+    assert cached_time < full_time
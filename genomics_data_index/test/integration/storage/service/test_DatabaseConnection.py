@@ -1,8 +1,11 @@
 import shutil
+import sqlite3
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Dict, Any
 
+from ete3 import Tree
+
 from genomics_data_index.configuration.connector.FilesystemStorage import FilesystemStorage
 from genomics_data_index.storage.io.mutation.NucleotideSampleDataPackage import NucleotideSampleDataPackage
 from genomics_data_index.storage.model.db import DatabasePathTranslator, SampleNucleotideVariation, Sample, \
@@ -20,7 +23,8 @@ def setup_services(root_dir: Path, database_file: Path) -> Dict[str, Any]:
     filesystem_storage = FilesystemStorage(root_dir)
     dpt = DatabasePathTranslator(filesystem_storage.root_dir)
     db_connection = DatabaseConnection(f'sqlite:///{database_file}', dpt)
-    reference_service = ReferenceService(db_connection, filesystem_storage.reference_dir)
+    reference_service = ReferenceService(db_connection, filesystem_storage.reference_dir,
+                                         cache_dir=filesystem_storage.genome_cache_dir)
     sample_service = SampleService(db_connection)
     variation_service = VariationService(database_connection=db_connection,
                                          reference_service=reference_service,
@@ -135,3 +139,38 @@ def test_path_translation_kmer_data(snippy_nucleotide_data_package: NucleotideSa
 
             assert kf_2.exists(), 'Path from database should now correspond to moved path'
             assert kf_2.parent.parent == data_dir_2
+
+
+def create_reference_table(database_file: Path, columns: str) -> None:
+    connection = sqlite3.connect(database_file)
+    connection.execute(f'CREATE TABLE reference ({columns})')
+    connection.execute("INSERT INTO reference (id, name, length, tree) VALUES (1, 'genome', 5180, '(A:1,B:2);')")
+    connection.commit()
+    connection.close()
+
+
+def test_upgrade_schema_add_columns():
+    with TemporaryDirectory() as root_dir_str:
+        root_dir = Path(root_dir_str)
+        database_file = root_dir / 'db.sqlite'
+        create_reference_table(database_file, 'id INTEGER PRIMARY KEY, name VARCHAR(255), length INTEGER, '
+                                              'tree TEXT, tree_alignment_length INTEGER')
+
+        services = setup_services(root_dir / 'data', database_file)
+        reference = services['reference_service'].find_reference_genome('genome')
+        assert 5180 == reference.length
+        assert reference.has_tree()
+        assert ['A', 'B'] == reference.tree.get_leaf_names()
+        assert reference.tree_align_type is None
+        assert reference.tree_model is None
+        assert reference.tree_placed_samples is None
+
+        reference.tree = Tree('(A:1,(B:2,C:3):1);')
+        reference.tree_model = 'GTR'
+        services['database_connection'].get_session().commit()
+
+        # Connecting to an upgraded database should leave it as it is
+        services = setup_services(root_dir / 'data', database_file)
+        reference = services['reference_service'].find_reference_genome('genome')
+        assert ['A', 'B', 'C'] == reference.tree.get_leaf_names()
+        assert 'GTR' == reference.tree_model
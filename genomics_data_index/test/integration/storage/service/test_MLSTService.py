@@ -1,8 +1,14 @@
+import tempfile
+from pathlib import Path
+
 import pytest
 
+from genomics_data_index.storage.io.mlst.MLSTSampleDataPackage import MLSTSampleDataPackage
+from genomics_data_index.storage.io.mlst.MLSTTSeemannFeaturesReader import MLSTTSeemannFeaturesReader
 from genomics_data_index.storage.model.db import SampleMLSTAlleles, MLSTAllelesSamples, Sample
 from genomics_data_index.storage.service import EntityExistsError
 from genomics_data_index.storage.service.MLSTService import MLSTService
+from genomics_data_index.test.integration import basic_mlst_file
 
 
 def test_insert_mlst_results(database, mlst_data_package_single_scheme, sample_service, filesystem_storage):
@@ -35,6 +41,23 @@ def test_insert_mlst_results(database, mlst_data_package_single_scheme, sample_s
     assert 2 == len(mlst_alleles_samples_id_allele['lmonocytogenes:abcZ:1'].sample_ids)
 
 
+def test_insert_mlst_results_multiple_cores(database, mlst_data_package_basic, sample_service, filesystem_storage):
+    mlst_service = MLSTService(database_connection=database,
+                               sample_service=sample_service,
+                               mlst_dir=filesystem_storage.mlst_dir)
+
+    session = database.get_session()
+
+    mlst_service.insert(data_package=mlst_data_package_basic, ncores=2)
+
+    samples = session.query(Sample).all()
+    assert {'CFSAN002349', 'CFSAN023463', '2014C-3598', '2014C-3599',
+            '2014D-0067', '2014D-0068'} == {s.name for s in samples}
+    assert 6 == session.query(SampleMLSTAlleles).count()
+    assert 2 == len(session.query(MLSTAllelesSamples).get({
+        'scheme': 'lmonocytogenes', 'locus': 'abcZ', 'allele': '1'}).sample_ids)
+
+
 def test_insert_mlst_results_multiple_schemes(database, mlst_data_package_basic, sample_service, filesystem_storage):
     num_loci = 7
     num_schemes = 3
@@ -123,6 +146,43 @@ def test_double_insert_mlst(database, mlst_data_package_single_scheme, sample_se
     assert 2 == len(sample_mlst_alleles)
 
 
+def test_insert_mlst_results_incremental(database, sample_service, filesystem_storage):
+    mlst_service = MLSTService(database_connection=database,
+                               sample_service=sample_service,
+                               mlst_dir=filesystem_storage.mlst_dir)
+    session = database.get_session()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_str:
+        mlst_file1 = Path(tmp_dir_str) / 'mlst1.tsv'
+        mlst_file2 = Path(tmp_dir_str) / 'mlst2.tsv'
+        with open(basic_mlst_file, 'r') as fh:
+            mlst_lines = fh.readlines()
+        with open(mlst_file1, 'w') as fh:
+            fh.writelines(mlst_lines[0:3])
+        with open(mlst_file2, 'w') as fh:
+            fh.writelines(mlst_lines[3:])
+
+        mlst_service.insert(data_package=MLSTSampleDataPackage(MLSTTSeemannFeaturesReader(mlst_file=mlst_file1)))
+        assert 3 == session.query(Sample).count()
+        sample_name_ids = sample_service.find_sample_name_ids({'CFSAN002349', 'CFSAN023463', '2014C-3598'})
+        assert {sample_name_ids['2014C-3598']} == set(session.query(MLSTAllelesSamples)
+                                                      .filter(MLSTAllelesSamples._sla == 'ecoli:adk:100')
+                                                      .one().sample_ids)
+
+        mlst_service.insert(data_package=MLSTSampleDataPackage(MLSTTSeemannFeaturesReader(mlst_file=mlst_file2)))
+
+    assert 6 == session.query(Sample).count()
+    sample_name_ids = sample_service.find_sample_name_ids({'2014C-3598', '2014C-3599', '2014D-0067', '2014D-0068'})
+
+    mlst_alleles_all = {a.sla: a for a in session.query(MLSTAllelesSamples).all()}
+    assert 7 * 3 + 1 == len(mlst_alleles_all)
+    assert {sample_name_ids['2014C-3598'], sample_name_ids['2014C-3599']} == set(
+        mlst_alleles_all['ecoli:adk:100'].sample_ids)
+    assert {sample_name_ids['2014D-0067'], sample_name_ids['2014D-0068']} == set(
+        mlst_alleles_all['campylobacter:aspA:2'].sample_ids)
+    assert 2 == len(mlst_alleles_all['lmonocytogenes:abcZ:1'].sample_ids)
+
+
 def test_get_all_alleles(mlst_service_loaded: MLSTService):
     assert {'1'} == mlst_service_loaded.get_all_alleles('lmonocytogenes', 'abcZ')
 
@@ -1,4 +1,5 @@
 import gzip
+from pathlib import Path
 
 import pytest
 from Bio import SeqIO
@@ -8,6 +9,7 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from genomics_data_index.storage.model.db import Reference
 from genomics_data_index.storage.service import EntityExistsError
+from genomics_data_index.storage.service.ReferenceService import ReferenceService
 from genomics_data_index.test.integration import reference_file
 from genomics_data_index.test.integration import tree_file
 
@@ -126,6 +128,14 @@ def test_update_tree(database, reference_service, example_tree):
     reference_genome = database.get_session().query(Reference).filter(Reference.name == 'genome').one()
     assert reference_genome.tree.write() == example_tree.write()
     assert 1000 == reference_genome.tree_alignment_length
+    assert set(example_tree.get_leaf_names()) == set(reference_genome.compact_tree.leaf_names)
+
+    # The tree is a copy so modifying it should not modify the (shared) tree of the reference genome
+    tree = reference_genome.tree
+    tree.prune(tree.get_leaf_names()[:2])
+    assert reference_genome.tree.write() == example_tree.write()
+    assert reference_genome.shared_tree().write() == example_tree.write()
+    assert reference_genome.shared_tree() is reference_genome.shared_tree()
 
 
 def test_find_references_for_sample(reference_service_with_data, variation_service):
@@ -177,3 +187,45 @@ def test_get_reference_genome_records(reference_service_with_data):
 
     assert 'reference' == records[0].id
     assert 5180 == len(records[0])
+
+
+def test_get_sequence_array(reference_service_with_data):
+    with gzip.open(reference_file, 'rt') as f:
+        expected_sequence = str(list(SeqIO.parse(f, 'fasta'))[0].seq)
+
+    sequence_array = reference_service_with_data.get_sequence_array('reference')
+    assert 5180 == len(sequence_array)
+    assert expected_sequence == sequence_array.tobytes().decode()
+
+    # Second time is read from the cache
+    assert sequence_array is reference_service_with_data.get_sequence_array('reference')
+
+
+def test_get_reference_genome_file(reference_service_with_data):
+    with gzip.open(reference_file, 'rt') as f:
+        expected_records = list(SeqIO.parse(f, 'fasta'))
+
+    genome_file = reference_service_with_data.get_reference_genome_file('genome')
+    assert genome_file.exists()
+    assert Path(f'{genome_file}.fai').exists()
+
+    actual_records = list(SeqIO.parse(genome_file, 'fasta'))
+    assert [r.id for r in expected_records] == [r.id for r in actual_records]
+    assert [str(r.seq) for r in expected_records] == [str(r.seq) for r in actual_records]
+
+    assert genome_file == reference_service_with_data.get_reference_genome_file('genome')
+
+
+def test_get_sequence_no_cache(database, filesystem_storage):
+    reference_service = ReferenceService(database, filesystem_storage.reference_dir)
+    reference_service.add_reference_genome(reference_file)
+
+    with gzip.open(reference_file, 'rt') as f:
+        expected_sequence = str(list(SeqIO.parse(f, 'fasta'))[0].seq)
+
+    assert expected_sequence == reference_service.get_sequence_array('reference').tobytes().decode()
+    assert expected_sequence == str(reference_service.get_sequence('reference').seq)
+
+    with pytest.raises(Exception) as execinfo:
+        reference_service.get_reference_genome_file('genome')
+    assert 'Cannot get a file for reference genome [genome]' in str(execinfo.value)
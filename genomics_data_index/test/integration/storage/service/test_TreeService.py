@@ -1,6 +1,10 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
 import pytest
 from ete3 import Tree
 
+from genomics_data_index.storage.service.TreeService import TreeService
 from genomics_data_index.test.integration import tree_file
 
 
@@ -38,6 +42,24 @@ def test_build_tree_core_iqtree(tree_service, core_alignment_service, expected_t
     assert abs(expected_distance - actual_distance) < 5
 
 
+def test_build_tree_core_iqtree_alignment_file(tree_service, core_alignment_service, expected_tree):
+    with TemporaryDirectory() as tmp_dir:
+        alignment_file = Path(tmp_dir) / 'alignment.fasta'
+        core_alignment_service.write_alignment(output_file=alignment_file,
+                                               reference_name='genome', samples=['SampleA', 'SampleB', 'SampleC'])
+
+        tree, out = tree_service.build_tree(alignment_file, tree_build_type='iqtree',
+                                            extra_params='--seed 42 -m GTR+ASC')
+
+        # Output of iqtree should not be written alongside the input alignment file
+        assert ['alignment.fasta'] == [f.name for f in Path(tmp_dir).iterdir()]
+
+    assert {'SampleA', 'SampleB', 'SampleC', 'genome'} == set(tree.get_leaf_names())
+
+    tree_comparison = expected_tree.compare(tree, unrooted=True)
+    assert tree_comparison['rf'] == 0
+
+
 def test_build_tree_core_iqtree_2cores(tree_service, core_alignment_service, expected_tree):
     alignment = core_alignment_service.construct_alignment(
         reference_name='genome', samples=['SampleA', 'SampleB', 'SampleC'])
@@ -86,3 +108,60 @@ def test_rebuild_tree(tree_service, reference_service_with_data, expected_tree):
 
     tree_comparison = expected_tree.compare(tree, unrooted=True)
     assert tree_comparison['rf'] == 0
+    assert 'core' == reference_genome.tree_align_type
+    assert reference_genome.tree_model is not None
+    assert 0 == reference_genome.tree_placed_samples
+
+
+def remove_sample_from_tree(reference_service, reference_name: str, sample_name: str) -> None:
+    reference_genome = reference_service.find_reference_genome(reference_name)
+    tree = reference_genome.tree
+    tree.prune([l for l in tree.get_leaf_names() if l != sample_name], preserve_branch_length=True)
+    reference_service.update_tree(reference_name, tree=tree,
+                                  alignment_length=reference_genome.tree_alignment_length,
+                                  align_type=reference_genome.tree_align_type,
+                                  model=reference_genome.tree_model)
+
+
+def test_place_samples(tree_service, reference_service_with_data, expected_tree):
+    tree_service.rebuild_tree(reference_name='genome', extra_params='--seed 42')
+    model = reference_service_with_data.find_reference_genome('genome').tree_model
+    remove_sample_from_tree(reference_service_with_data, 'genome', 'SampleC')
+
+    result = tree_service.place_samples(reference_name='genome', drift_threshold=1, extra_params='--seed 42')
+    assert TreeService.SAMPLES_PLACED == result
+
+    reference_genome = reference_service_with_data.find_reference_genome('genome')
+    tree = reference_genome.tree
+    assert {'SampleA', 'SampleB', 'SampleC', 'genome'} == set(tree.get_leaf_names())
+    assert expected_tree.compare(tree, unrooted=True)['rf'] == 0
+    assert 58 == reference_genome.tree_alignment_length
+    assert model == reference_genome.tree_model
+    assert 1 == reference_genome.tree_placed_samples
+
+    # No new samples
+    assert TreeService.TREE_UNCHANGED == tree_service.place_samples(reference_name='genome', drift_threshold=1)
+    assert 1 == reference_service_with_data.find_reference_genome('genome').tree_placed_samples
+
+
+def test_place_samples_drift_exceeded(tree_service, reference_service_with_data, expected_tree):
+    tree_service.rebuild_tree(reference_name='genome', extra_params='--seed 42')
+    remove_sample_from_tree(reference_service_with_data, 'genome', 'SampleC')
+
+    # 1 new sample compared to 2 samples in the tree is above the threshold
+    result = tree_service.place_samples(reference_name='genome', drift_threshold=0.1, extra_params='--seed 42')
+    assert TreeService.TREE_REBUILT == result
+
+    reference_genome = reference_service_with_data.find_reference_genome('genome')
+    assert {'SampleA', 'SampleB', 'SampleC', 'genome'} == set(reference_genome.tree.get_leaf_names())
+    assert expected_tree.compare(reference_genome.tree, unrooted=True)['rf'] == 0
+    assert 0 == reference_genome.tree_placed_samples
+
+
+def test_place_samples_no_tree(tree_service, reference_service_with_data, expected_tree):
+    result = tree_service.place_samples(reference_name='genome')
+    assert TreeService.TREE_REBUILT == result
+
+    reference_genome = reference_service_with_data.find_reference_genome('genome')
+    assert {'SampleA', 'SampleB', 'SampleC', 'genome'} == set(reference_genome.tree.get_leaf_names())
+    assert 0 == reference_genome.tree_placed_samples
@@ -0,0 +1,118 @@
+import pytest
+from ete3 import Tree
+
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeView import TreeView
+from genomics_data_index.storage.model.db import Sample
+
+
+@pytest.fixture
+def sample_name_ids(database, sample_service):
+    session = database.get_session()
+    for name in ['A', 'B', 'C', 'D', 'E', 'F', 'G']:
+        session.add(Sample(name=name))
+    session.commit()
+
+    return sample_service.find_sample_name_ids({'A', 'B', 'C', 'D', 'E', 'F', 'G'})
+
+
+@pytest.fixture
+def tree() -> Tree:
+    return Tree('((A:1,B:2,C:3):0.5,(D:1,(E:2,F:1):1,G:4):2,genome:0.1);')
+
+
+def test_tree_view_no_changes(tree: Tree):
+    tree_view = TreeView(tree)
+    assert tree is tree_view.tree
+
+
+def test_tree_view_prune(tree: Tree, sample_service, sample_name_ids):
+    tree_text = tree.write()
+    samples = SampleSet([sample_name_ids['A'], sample_name_ids['E'], sample_name_ids['F']])
+
+    tree_view = TreeView(tree).prune(samples, sample_service=sample_service, extra_leaves=['genome'])
+    assert not tree_view.is_materialized()
+
+    expected_tree = tree.copy()
+    expected_tree.prune(['A', 'E', 'F', 'genome'], preserve_branch_length=True)
+    assert expected_tree.write() == tree_view.tree.write()
+    assert tree_view.is_materialized()
+    assert tree_view.tree is tree_view.tree
+
+    # Pruning a pruned view
+    pruned_view = tree_view.prune(SampleSet([sample_name_ids['E'], sample_name_ids['F']]),
+                                  sample_service=sample_service)
+    assert ['E', 'F'] == pruned_view.tree.get_leaf_names()
+
+    # Base tree is unchanged
+    assert tree_text == tree.write()
+
+
+def test_tree_view_prune_chained(tree: Tree, sample_service, sample_name_ids):
+    samples = SampleSet([sample_name_ids['A'], sample_name_ids['D'], sample_name_ids['E'], sample_name_ids['F']])
+    tree_view = TreeView(tree).prune(samples, sample_service=sample_service, extra_leaves=['genome'])
+
+    # Only samples in both views are kept, along with extra leaves in the first view
+    pruned_view = tree_view.prune(SampleSet([sample_name_ids['B'], sample_name_ids['E'], sample_name_ids['F']]),
+                                  sample_service=sample_service, extra_leaves=['genome'])
+    assert {'E', 'F', 'genome'} == set(pruned_view.leaf_names)
+    assert pruned_view._base is tree
+
+    expected_tree = tree.copy()
+    expected_tree.prune(['E', 'F', 'genome'], preserve_branch_length=True)
+    assert expected_tree.write() == pruned_view.tree.write()
+    assert not tree_view.is_materialized()
+
+    # Extra leaves not in the first view are not added back
+    samples_only_view = TreeView(tree).prune(samples, sample_service=sample_service)
+    assert {'E', 'F'} == set(samples_only_view.prune(SampleSet([sample_name_ids['E'], sample_name_ids['F']]),
+                                                     sample_service=sample_service,
+                                                     extra_leaves=['genome']).tree.get_leaf_names())
+
+    # Views with operations are used as the base tree
+    outgroup_view = tree_view.apply(lambda t: t.set_outgroup('D'))
+    pruned_outgroup_view = outgroup_view.prune(SampleSet([sample_name_ids['D'], sample_name_ids['E']]),
+                                               sample_service=sample_service)
+    assert {'D', 'E'} == set(pruned_outgroup_view.tree.get_leaf_names())
+    assert outgroup_view.is_materialized()
+
+
+def test_tree_view_apply(tree: Tree, sample_service, sample_name_ids):
+    tree_text = tree.write()
+    samples = SampleSet([sample_name_ids['A'], sample_name_ids['E'], sample_name_ids['F']])
+    tree_view = TreeView(tree).prune(samples, sample_service=sample_service)
+
+    def rename(tree: Tree):
+        for leaf in tree.get_leaves():
+            leaf.name = leaf.name.lower()
+
+    renamed_view = tree_view.apply(rename)
+    outgroup_view = renamed_view.apply(lambda t: t.set_outgroup('e'))
+    assert not outgroup_view.is_materialized()
+
+    assert {'a', 'e', 'f'} == set(renamed_view.tree.get_leaf_names())
+    assert 'e' == outgroup_view.tree.get_children()[0].name
+    assert {'A', 'E', 'F'} == set(tree_view.tree.get_leaf_names())
+    assert tree_text == tree.write()
+
+
+def test_tree_view_leaf_names(tree: Tree, sample_service, sample_name_ids):
+    assert {'A', 'B', 'C', 'D', 'E', 'F', 'G', 'genome'} == set(TreeView(tree).leaf_names)
+
+    samples = SampleSet([sample_name_ids['A'], sample_name_ids['E'], sample_name_ids['F']])
+    tree_view = TreeView(tree).prune(samples, sample_service=sample_service, extra_leaves=['genome'])
+    assert {'A', 'E', 'F', 'genome'} == set(tree_view.leaf_names)
+    assert not tree_view.is_materialized()
+
+    # Operations which rename leaves pass the new names
+    renamed_view = tree_view.apply(lambda t: None, leaf_names=['a', 'e', 'f', 'genome'])
+    outgroup_view = renamed_view.apply(lambda t: None)
+    assert {'a', 'e', 'f', 'genome'} == set(outgroup_view.leaf_names)
+    assert {'A', 'E', 'F', 'genome'} == set(tree_view.leaf_names)
+    assert not outgroup_view.is_materialized()
+
+
+def test_tree_view_no_sample_service(tree: Tree):
+    with pytest.raises(Exception) as execinfo:
+        TreeView(tree, samples=SampleSet([1]))
+    assert 'sample_service must be set when pruning to samples' in str(execinfo.value)
@@ -1,14 +1,16 @@
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory, mkdtemp
 from typing import List
 
 import pandas as pd
 import pytest
 from sqlalchemy.orm.exc import NoResultFound
 
+from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
 from genomics_data_index.storage.io.mutation.NucleotideSampleDataPackage import NucleotideSampleDataPackage
 from genomics_data_index.storage.io.processor.SerialSampleFilesProcessor import SerialSampleFilesProcessor
-from genomics_data_index.storage.model.db import NucleotideVariantsSamples, SampleNucleotideVariation, Sample
+from genomics_data_index.storage.model.db import NucleotideVariantsSamples, SampleNucleotideVariation, Sample, \
+    NucleotideUnknownSamples, Reference
 from genomics_data_index.storage.service import EntityExistsError
 from genomics_data_index.storage.service.VariationService import VariationService
 from genomics_data_index.test.integration import data_dir, snippy_snps_dataframes, snippy_all_dataframes
@@ -55,6 +57,115 @@ def test_insert_variants_masked_regions(database, snippy_nucleotide_data_package
     assert 329 == len(genomic_masks['SampleC'])
 
 
+def test_insert_variants_multiple_cores(database, snippy_nucleotide_data_package, reference_service_with_data,
+                                        sample_service, filesystem_storage):
+    variation_service = VariationService(database_connection=database,
+                                         reference_service=reference_service_with_data,
+                                         sample_service=sample_service,
+                                         variation_dir=filesystem_storage.variation_dir)
+
+    session = database.get_session()
+
+    variation_service.insert(feature_scope_name='genome', data_package=snippy_nucleotide_data_package, ncores=2)
+
+    samples = session.query(Sample).all()
+    assert {'SampleA', 'SampleB', 'SampleC'} == {s.name for s in samples}
+
+    variation_files = {v.nucleotide_variants_file for s in samples for v in s.sample_nucleotide_variation}
+    assert 3 == len(variation_files)
+    assert all(f.parent == filesystem_storage.variation_dir for f in variation_files)
+
+    genomic_masks = {s.name: v.masked_regions for s in samples for v in s.sample_nucleotide_variation}
+    assert 437 == len(genomic_masks['SampleA'])
+    assert 276 == len(genomic_masks['SampleB'])
+    assert 329 == len(genomic_masks['SampleC'])
+
+    assert 112 == session.query(NucleotideVariantsSamples).count(), 'Incorrect number of storage entries'
+
+
+def test_convert_masks_to_binary(database, snippy_nucleotide_data_package, reference_service_with_data,
+                                 sample_service, filesystem_storage):
+    variation_service = VariationService(database_connection=database,
+                                         reference_service=reference_service_with_data,
+                                         sample_service=sample_service,
+                                         variation_dir=filesystem_storage.variation_dir)
+    variation_service.insert(feature_scope_name='genome', data_package=snippy_nucleotide_data_package)
+
+    session = database.get_session()
+    sample_variations = session.query(SampleNucleotideVariation).all()
+    binary_files = [MaskedGenomicRegions.binary_file(v.masked_regions_file) for v in sample_variations]
+    assert 3 == len(binary_files)
+    assert all(f.exists() for f in binary_files)
+
+    # Binary masks are written on load, so nothing to convert
+    assert 0 == variation_service.convert_masks_to_binary()
+
+    # Remove binary masks (as if loaded before binary masks were written)
+    for binary_file in binary_files:
+        binary_file.unlink()
+    assert 3 == variation_service.convert_masks_to_binary()
+    assert all(f.exists() for f in binary_files)
+
+    genomic_masks = {v.sample.name: v.masked_regions for v in sample_variations}
+    assert 437 == len(genomic_masks['SampleA'])
+    assert 276 == len(genomic_masks['SampleB'])
+    assert 329 == len(genomic_masks['SampleC'])
+
+    assert 3 == variation_service.convert_masks_to_binary(overwrite=True)
+
+
+def test_insert_variants_unknown_samples_index(database, snippy_nucleotide_data_package,
+                                               reference_service_with_data, sample_service, filesystem_storage):
+    variation_service = VariationService(database_connection=database,
+                                         reference_service=reference_service_with_data,
+                                         sample_service=sample_service,
+                                         variation_dir=filesystem_storage.variation_dir)
+    variation_service.insert(feature_scope_name='genome', data_package=snippy_nucleotide_data_package)
+
+    session = database.get_session()
+    sample_variations = session.query(SampleNucleotideVariation).all()
+    sample_masks = {v.sample_id: v.masked_regions for v in sample_variations}
+
+    def expected_unknown(start: int, stop: int):
+        return {sample_id for sample_id, mask in sample_masks.items() if mask.overlaps_range('reference', start, stop)}
+
+    assert session.query(NucleotideUnknownSamples).count() > 0
+    for start in range(0, 5180, 7):
+        assert expected_unknown(start, start + 1) == set(sample_service.find_unknown_sample_set('reference',
+                                                                                                 start, start + 1))
+        assert expected_unknown(start, start + 20) == set(sample_service.find_unknown_sample_set('reference',
+                                                                                                  start, start + 20))
+
+    # Rebuilding should give the same index
+    segments = {(s.start, s.stop, frozenset(s.sample_ids)) for s in session.query(NucleotideUnknownSamples).all()}
+    variation_service.rebuild_unknown_samples_index('genome')
+    assert segments == {(s.start, s.stop, frozenset(s.sample_ids)) for s in
+                        session.query(NucleotideUnknownSamples).all()}
+
+    assert session.query(Reference).filter(Reference.name == 'genome').one().unknown_samples_indexed
+
+    # An index which was built but is empty means no samples have unknown data
+    session.query(NucleotideUnknownSamples).delete()
+    session.commit()
+    assert 0 == len(sample_service.find_unknown_sample_set('reference', 0, 5180))
+
+    # Without an index (e.g., an index created before it was built on load) the masked regions should be used
+    session.query(Reference).filter(Reference.name == 'genome').one().unknown_samples_indexed = None
+    session.commit()
+    for start in range(0, 5180, 37):
+        assert expected_unknown(start, start + 20) == set(sample_service.find_unknown_sample_set('reference',
+                                                                                                  start, start + 20))
+
+    variation_service.rebuild_unknown_samples_index('genome')
+    assert session.query(Reference).filter(Reference.name == 'genome').one().unknown_samples_indexed
+    assert segments == {(s.start, s.stop, frozenset(s.sample_ids)) for s in
+                        session.query(NucleotideUnknownSamples).all()}
+
+    with pytest.raises(Exception) as execinfo:
+        sample_service.find_unknown_sample_set('reference', 10, 10)
+    assert 'stop=[10] must be greater than start=[10]' in str(execinfo.value)
+
+
 def test_summarize_variants(database, snippy_nucleotide_data_package, reference_service_with_data,
                             sample_service, filesystem_storage):
     variation_service = VariationService(database_connection=database,
@@ -133,6 +244,45 @@ def test_insert_variants_examine_variation(database, snippy_nucleotide_data_pack
     assert {sample_name_ids['SampleC']} == set(v.sample_ids)
 
 
+def test_insert_variants_incremental(database, reference_service_with_data, sample_service, filesystem_storage):
+    variation_service = VariationService(database_connection=database,
+                                         reference_service=reference_service_with_data,
+                                         sample_service=sample_service,
+                                         variation_dir=filesystem_storage.variation_dir)
+    session = database.get_session()
+
+    for sample_dirs in [[data_dir / 'SampleA'], [data_dir / 'SampleB', data_dir / 'SampleC']]:
+        data_package = NucleotideSampleDataPackage.create_from_snippy(
+            sample_dirs, sample_files_processor=SerialSampleFilesProcessor(Path(mkdtemp())))
+        variation_service.insert(feature_scope_name='genome', data_package=data_package)
+
+    sample_name_ids = sample_service.find_sample_name_ids({'SampleA', 'SampleB', 'SampleC'})
+
+    assert 3 == session.query(SampleNucleotideVariation).count(), 'Incorrect number of SampleSequences'
+    assert 112 == session.query(NucleotideVariantsSamples).count(), 'Incorrect number of storage entries'
+
+    mutation_counts = variation_service.mutation_counts_on_reference('genome', include_unknown=False)
+    assert 2 == mutation_counts['reference:839:1:G']
+    assert 2 == mutation_counts['reference:3897:5:G']
+
+    v = session.query(NucleotideVariantsSamples).get({
+        'sequence': 'reference',
+        'position': 1048,
+        'deletion': len('C'),
+        'insertion': 'G'
+    })
+    assert {sample_name_ids['SampleA']} == set(v.sample_ids)
+
+    v = session.query(NucleotideVariantsSamples).get({
+        'sequence': 'reference',
+        'position': 1135,
+        'deletion': len('CCT'),
+        'insertion': 'C'
+    })
+    assert 'INDEL' == v.var_type, 'Type is incorrect'
+    assert {sample_name_ids['SampleB'], sample_name_ids['SampleC']} == set(v.sample_ids)
+
+
 def test_insert_variants_regular_vcf_reader_examine_variation(database, regular_nucleotide_data_package,
                                                               reference_service_with_data,
                                                               sample_service, filesystem_storage):
@@ -0,0 +1,61 @@
+import logging
+import time
+from typing import List, Tuple
+
+from Bio import SeqIO
+
+from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
+from genomics_data_index.test.integration import sample_dirs
+
+logger = logging.getLogger(__name__)
+
+
+def missing_intervals_per_base(record) -> List[Tuple[str, int, int]]:
+    """
+    The previous implementation of finding masked intervals, examining each base in Python.
+    """
+
+    def is_missing(char):
+        return char.upper() == 'N' or char == '-'
+
+    mask_intervals = []
+    start = 0
+    in_mask = False
+    for idx, char in enumerate(record.seq):
+        if in_mask:
+            if not is_missing(char):
+                in_mask = False
+                mask_intervals.append((record.id, start, idx))
+        else:
+            if is_missing(char):
+                in_mask = True
+                start = idx
+
+    if in_mask:
+        mask_intervals.append((record.id, start, len(record)))
+
+    return mask_intervals
+
+
+def missing_intervals_vectorized(record) -> List[Tuple[str, int, int]]:
+    starts, stops = MaskedGenomicRegions._missing_intervals(str(record.seq))
+    return [(record.id, start, stop) for start, stop in zip(starts.tolist(), stops.tolist())]
+
+
+def test_benchmark_missing_intervals_snippy_aligned_sequences():
+    records = [record for d in sample_dirs for record in SeqIO.parse(d / 'snps.aligned.fa', 'fasta')]
+    number_bases = sum(len(r) for r in records)
+
+    start_time = time.time()
+    expected_intervals = [i for r in records for i in missing_intervals_per_base(r)]
+    per_base_time = time.time() - start_time
+
+    start_time = time.time()
+    actual_intervals = [i for r in records for i in missing_intervals_vectorized(r)]
+    vectorized_time = time.time() - start_time
+
+    logger.info(f'Found masked intervals in {number_bases} bases: per-base took {per_base_time:0.4f} seconds, '
+                f'vectorized took {vectorized_time:0.4f} seconds')
+
+    assert len(expected_intervals) > 0
+    assert expected_intervals == actual_intervals
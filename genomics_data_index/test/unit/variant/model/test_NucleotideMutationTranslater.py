@@ -1,3 +1,4 @@
+import pandas as pd
 import pytest
 
 from genomics_data_index.storage.model.NucleotideMutationTranslater import NucleotideMutationTranslater
@@ -81,3 +82,37 @@ def test_to_db_feature():
     assert 'seq:1:2:T' == NucleotideMutationTranslater.to_db_feature(QueryFeatureMutation('seq:1:AT:T')).id
     assert 'seq:1:2:T' == NucleotideMutationTranslater.to_db_feature(QueryFeatureMutation('seq:1:2:T')).id
     assert 'seq:10:2:TA' == NucleotideMutationTranslater.to_db_feature(QueryFeatureMutation('seq:10:AT:TA')).id
+
+
+def test_to_spdi_series():
+    spdi = NucleotideMutationTranslater.to_spdi_series(
+        sequence_names=pd.Series(['seq', 'seq', 'seq', 'seq2', 'seq']),
+        positions=pd.Series([1, 2, 10, 1, 1]),
+        refs=pd.Series(['A', 'AT', '', 'T', '3']),
+        alts=pd.Series(['T', 'T', 'AT', '', 'G'])
+    )
+    assert ['seq:1:1:T', 'seq:2:2:T', 'seq:10:0:AT', 'seq2:1:1:', 'seq:1:3:G'] == spdi.tolist()
+
+
+def test_to_spdi_series_same_as_to_spdi():
+    refs = pd.Series(['A', 'ATCG', 'G', '5', 'CC'])
+    positions = pd.Series([5, 100, 0, 20, 3])
+    alts = pd.Series(['T', 'A', 'C', 'T', 'GGG'])
+    sequence_names = pd.Series(['seq'] * 5)
+
+    spdi = NucleotideMutationTranslater.to_spdi_series(sequence_names, positions, refs, alts)
+    expected = [NucleotideMutationTranslater.to_spdi(s, p, r, a) for s, p, r, a in
+                zip(sequence_names, positions, refs, alts)]
+    assert expected == spdi.tolist()
+
+
+def test_to_spdi_series_invalid():
+    with pytest.raises(Exception) as execinfo:
+        NucleotideMutationTranslater.to_spdi_series(pd.Series(['seq']), pd.Series([-1]), pd.Series(['A']),
+                                                    pd.Series(['T']))
+    assert 'Position must be non-negative' in str(execinfo.value)
+
+    with pytest.raises(Exception) as execinfo:
+        NucleotideMutationTranslater.to_spdi_series(pd.Series(['seq', 'seq']), pd.Series([1, 2]),
+                                                    pd.Series(['A', 'N']), pd.Series(['T', 'T']))
+    assert 'Deletion must either be an integer or a string with alphabet {A,T,C,G}: N' in str(execinfo.value)
@@ -0,0 +1,61 @@
+import logging
+import random
+import time
+
+import numpy as np
+from Bio.Seq import Seq
+
+from genomics_data_index.storage.service.CoreAlignmentService import CoreAlignmentService
+
+logger = logging.getLogger(__name__)
+
+
+def extract_sequence_per_position(input_seq: Seq, positions) -> Seq:
+    """
+    The previous implementation of extracting core positions, concatenating one position at a time.
+    """
+    sequence_string = ''
+    for position in positions:
+        sequence_string += str(input_seq[position - 1:position])
+    return Seq(sequence_string)
+
+
+def alignment_service() -> CoreAlignmentService:
+    return CoreAlignmentService(database=None, reference_service=None, sample_service=None,
+                                variation_service=None)
+
+
+def test_extract_sequence_from_positions():
+    service = alignment_service()
+    core_position_indexes = service._core_position_indexes({'seq': np.array([1, 3, 4, 8])})
+
+    assert {'seq'} == set(core_position_indexes.keys())
+    assert [0, 2, 3, 7] == core_position_indexes['seq'].tolist()
+    assert 'ACGT' == str(service._extract_sequence_from_positions(Seq('AGCGNNNT'),
+                                                                  core_position_indexes['seq']))
+    assert '' == str(service._extract_sequence_from_positions(Seq('AGCGNNNT'),
+                                                              CoreAlignmentService.EMPTY_POSITIONS))
+
+
+def test_benchmark_extract_sequence_from_positions():
+    service = alignment_service()
+    random.seed(42)
+    sequence = Seq(''.join(random.choices('ACGT', k=1000000)))
+    positions = np.array(sorted(random.sample(range(1, len(sequence) + 1), 20000)))
+    number_samples = 5
+
+    start_time = time.time()
+    for i in range(number_samples):
+        expected_sequence = extract_sequence_per_position(sequence, positions.tolist())
+    per_position_time = time.time() - start_time
+
+    start_time = time.time()
+    core_position_indexes = service._core_position_indexes({'seq': positions})
+    for i in range(number_samples):
+        actual_sequence = service._extract_sequence_from_positions(sequence, core_position_indexes['seq'])
+    vectorized_time = time.time() - start_time
+
+    logger.info(f'Extracted {len(positions)} positions from {number_samples} sequences: per-position took '
+                f'{per_position_time:0.4f} seconds, vectorized took {vectorized_time:0.4f} seconds')
+
+    assert str(expected_sequence) == str(actual_sequence)
@@ -0,0 +1,110 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.model.NucleotideMutationTranslater import NucleotideMutationTranslater
+from genomics_data_index.storage.model.db import NucleotideVariantsSamples
+from genomics_data_index.storage.service.FeatureService import FeatureService
+from genomics_data_index.storage.service.MLSTService import MLSTService
+
+logger = logging.getLogger(__name__)
+
+
+def create_synthetic_features_table(number_samples: int, number_positions: int,
+                                    features_per_sample: int, seed: int = 42) -> pd.DataFrame:
+    random = np.random.default_rng(seed)
+    bases = np.array(['A', 'C', 'G', 'T'])
+    frames = []
+    for sample_number in range(number_samples):
+        positions = random.choice(number_positions, size=features_per_sample, replace=False) + 1
+        frames.append(pd.DataFrame({
+            'SAMPLE': f'sample{sample_number}',
+            'CHROM': 'reference',
+            'POS': positions,
+            'REF': bases[positions % 4],
+            'ALT': bases[(positions + 1) % 4],
+            'TYPE': 'SNP',
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def index_features_rowwise(features_df: pd.DataFrame, sample_name_ids: dict) -> pd.Series:
+    features_df = features_df.copy()
+    features_df['_FEATURE_ID'] = features_df.apply(lambda x: NucleotideVariantsSamples.to_spdi(
+        sequence_name=x['CHROM'], position=x['POS'], ref=x['REF'], alt=x['ALT']), axis='columns')
+    features_df['_SAMPLE_ID'] = features_df.apply(lambda x: sample_name_ids[x['SAMPLE']], axis='columns')
+    return features_df.groupby('_FEATURE_ID').agg({'_SAMPLE_ID': SampleSet})['_SAMPLE_ID']
+
+
+def index_features_vectorized(features_df: pd.DataFrame, sample_name_ids: dict) -> pd.Series:
+    feature_ids = NucleotideMutationTranslater.to_spdi_series(sequence_names=features_df['CHROM'],
+                                                              positions=features_df['POS'],
+                                                              refs=features_df['REF'],
+                                                              alts=features_df['ALT'])
+    sample_ids = features_df['SAMPLE'].map(sample_name_ids)
+    return FeatureService.build_sample_sets(feature_ids, sample_ids)
+
+
+def test_build_sample_sets():
+    sample_sets = FeatureService.build_sample_sets(pd.Series(['f1', 'f2', 'f1', 'f3', 'f1']),
+                                                   pd.Series([1, 1, 2, 10, 3]))
+    assert {'f1', 'f2', 'f3'} == set(sample_sets.index)
+    assert {1, 2, 3} == set(sample_sets['f1'])
+    assert {1} == set(sample_sets['f2'])
+    assert {10} == set(sample_sets['f3'])
+    assert isinstance(sample_sets['f1'], SampleSet)
+
+
+def test_build_sample_sets_empty():
+    sample_sets = FeatureService.build_sample_sets(pd.Series([], dtype=str), pd.Series([], dtype=int))
+    assert 0 == len(sample_sets)
+
+
+def test_benchmark_vectorized_indexing_same_as_rowwise():
+    features_df = create_synthetic_features_table(number_samples=200, number_positions=5000,
+                                                  features_per_sample=200)
+    sample_name_ids = {name: i + 1 for i, name in enumerate(features_df['SAMPLE'].unique())}
+
+    start_time = time.time()
+    expected_sample_sets = index_features_rowwise(features_df, sample_name_ids)
+    rowwise_time = time.time() - start_time
+
+    start_time = time.time()
+    actual_sample_sets = index_features_vectorized(features_df, sample_name_ids)
+    vectorized_time = time.time() - start_time
+
+    logger.info(f'Indexed {len(features_df)} features: row-wise took {rowwise_time:0.2f} seconds, '
+                f'vectorized took {vectorized_time:0.2f} seconds')
+
+    assert set(expected_sample_sets.index) == set(actual_sample_sets.index)
+    for feature_id in expected_sample_sets.index:
+        assert set(expected_sample_sets[feature_id]) == set(actual_sample_sets[feature_id])
+
+
+def test_index_features_batches():
+    mlst_service = MLSTService(database_connection=None, sample_service=None, mlst_dir=None)
+    sample_name_ids = {'sample1': 1, 'sample2': 2, 'sample3': 3}
+    batch1 = pd.DataFrame([
+        ['sample1', 'ecoli', 'adk', '1'],
+        ['sample1', 'ecoli', 'fumC', '2'],
+        ['sample2', 'ecoli', 'adk', '1'],
+    ], columns=['Sample', 'Scheme', 'Locus', 'Allele'])
+    batch2 = pd.DataFrame([
+        ['sample3', 'ecoli', 'adk', '1'],
+        ['sample3', 'ecoli', 'fumC', '3'],
+    ], columns=['Sample', 'Scheme', 'Locus', 'Allele'])
+
+    feature_index = {}
+    mlst_service._index_features_batch(batch1, sample_name_ids=sample_name_ids, feature_index=feature_index)
+    assert {'ecoli:adk:1', 'ecoli:fumC:2'} == set(feature_index.keys())
+    mlst_service._index_features_batch(batch2, sample_name_ids=sample_name_ids, feature_index=feature_index)
+    assert {'ecoli:adk:1', 'ecoli:fumC:2', 'ecoli:fumC:3'} == set(feature_index.keys())
+
+    feature_objects = {o.sla: o for o in map(mlst_service._create_feature_object, feature_index.values())}
+    assert {'ecoli:adk:1', 'ecoli:fumC:2', 'ecoli:fumC:3'} == set(feature_objects.keys())
+    assert {1, 2, 3} == set(feature_objects['ecoli:adk:1'].sample_ids)
+    assert {1} == set(feature_objects['ecoli:fumC:2'].sample_ids)
+    assert {3} == set(feature_objects['ecoli:fumC:3'].sample_ids)
@@ -0,0 +1,25 @@
+from genomics_data_index.storage.service.TreeService import TreeService
+
+
+def tree_service() -> TreeService:
+    return TreeService(database_connection=None, reference_service=None, core_alignment_service=None)
+
+
+def test_selected_model():
+    service = tree_service()
+    out = 'ModelFinder will test up to 484 DNA models\n' \
+          'Best-fit model: TVM+F+ASC chosen according to BIC\n' \
+          'All model information printed to input.fasta.model.gz\n'
+
+    assert 'TVM+F+ASC' == service._selected_model(out)
+    assert 'TVM+F+ASC' == service._selected_model(out, extra_params='-m MFP+ASC --seed 42')
+    assert 'GTR+ASC' == service._selected_model('no model', extra_params='--seed 42 -m GTR+ASC')
+    assert service._selected_model('no model', extra_params='-m MFP+ASC') is None
+    assert service._selected_model('no model', extra_params='-m') is None
+    assert service._selected_model('no model') is None
+
+
+def test_remove_model_param():
+    service = tree_service()
+    assert ['--seed', '42'] == service._remove_model_param(['-m', 'MFP+ASC', '--seed', '42'])
+    assert ['--seed', '42'] == service._remove_model_param(['--seed', '42'])
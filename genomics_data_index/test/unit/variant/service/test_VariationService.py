@@ -0,0 +1,84 @@
+import numpy as np
+
+from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.service.VariationService import VariationService
+
+
+def segments_as_tuples(segments):
+    return [(start, stop, set(sample_set)) for start, stop, sample_set in segments]
+
+
+def test_build_unknown_segments_empty():
+    assert [] == VariationService.build_unknown_segments(np.array([], dtype=int), np.array([], dtype=int), [])
+
+
+def test_build_unknown_segments():
+    sample1 = SampleSet([1])
+    sample2 = SampleSet([2])
+    starts = np.array([0, 20, 5, 30])
+    stops = np.array([10, 25, 25, 40])
+    segments = VariationService.build_unknown_segments(starts, stops, [sample1, sample1, sample2, sample2])
+
+    assert [(0, 5, {1}), (5, 10, {1, 2}), (10, 20, {2}), (20, 25, {1, 2}), (30, 40, {2})] == segments_as_tuples(
+        segments)
+
+
+def test_build_unknown_segments_with_existing_segments():
+    existing_starts = np.array([0, 10])
+    existing_stops = np.array([10, 20])
+    existing_sets = [SampleSet([1]), SampleSet([1, 2])]
+
+    # A new sample masked so that the set of samples is the same on both sides of position 10
+    starts = np.concatenate([existing_starts, np.array([0])])
+    stops = np.concatenate([existing_stops, np.array([10])])
+    segments = VariationService.build_unknown_segments(starts, stops, existing_sets + [SampleSet([2])])
+
+    assert [(0, 20, {1, 2})] == segments_as_tuples(segments)
+
+
+def test_build_unknown_segments_same_as_masks():
+    rng = np.random.default_rng(1)
+    sequence_length = 1000
+    masks = {}
+    for sample_id in range(1, 21):
+        starts = rng.integers(0, sequence_length - 50, 10)
+        masks[sample_id] = MaskedGenomicRegions(intervals={'ref': (starts, starts + rng.integers(1, 50, 10))})
+
+    starts = []
+    stops = []
+    sample_sets = []
+    for sample_id, mask in masks.items():
+        mask_starts, mask_stops = mask.sequence_intervals('ref')
+        starts.append(mask_starts)
+        stops.append(mask_stops)
+        sample_sets.extend([SampleSet([sample_id])] * len(mask_starts))
+    segments = VariationService.build_unknown_segments(np.concatenate(starts), np.concatenate(stops), sample_sets)
+
+    # Segments should not overlap
+    for (start1, stop1, set1), (start2, stop2, set2) in zip(segments, segments[1:]):
+        assert start1 < stop1 <= start2 < stop2
+
+    for position in range(sequence_length):
+        expected_samples = {sample_id for sample_id, mask in masks.items() if mask.contains('ref', position)}
+        actual_samples = set()
+        for start, stop, sample_set in segments:
+            if start <= position < stop:
+                actual_samples = set(sample_set)
+        assert expected_samples == actual_samples
+
+
+def test_overlapping_intervals():
+    starts = np.array([0, 10, 20, 30, 40])
+    stops = np.array([5, 15, 25, 35, 50])
+
+    overlaps = VariationService._overlapping_intervals(starts, stops, np.array([], dtype=int),
+                                                       np.array([], dtype=int))
+    assert [False, False, False, False, False] == overlaps.tolist()
+
+    # Book-ended intervals do not overlap
+    overlaps = VariationService._overlapping_intervals(starts, stops, np.array([5, 34, 24]), np.array([10, 36, 30]))
+    assert [False, False, True, True, False] == overlaps.tolist()
+
+    overlaps = VariationService._overlapping_intervals(starts, stops, np.array([12]), np.array([45]))
+    assert [False, True, True, True, True] == overlaps.tolist()
@@ -0,0 +1,104 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from genomics_data_index.storage.CachedAlignment import CachedAlignment
+
+
+@pytest.fixture
+def alignment_dir() -> Path:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield Path(tmp_dir) / 'alignment'
+
+
+def row(sequence: str) -> np.ndarray:
+    return np.frombuffer(sequence.encode(), dtype=np.uint8)
+
+
+def matrix_strings(alignment: CachedAlignment, sequence_name: str):
+    return [r.tobytes().decode() for r in alignment.matrix(sequence_name)]
+
+
+def test_create_append_rows(alignment_dir: Path):
+    assert CachedAlignment.load(alignment_dir) is None
+
+    alignment = CachedAlignment.create(alignment_dir, reference_name='genome', align_type='full',
+                                       sequence_columns={'seq1': None, 'seq2': None},
+                                       sequence_lengths={'seq1': 4, 'seq2': 2})
+    assert 0 == len(alignment)
+    assert ['seq1', 'seq2'] == alignment.sequence_names
+    assert (0, 4) == alignment.matrix('seq1').shape
+    assert alignment.positions('seq1') is None
+
+    assert 2 == alignment.append_rows([(1, 'A', {'seq1': row('ACGT'), 'seq2': row('AA')}),
+                                       (2, 'B', {'seq1': row('ACGA'), 'seq2': row('NA')})])
+    assert 1 == alignment.append_rows([(5, 'C', {'seq1': row('TCGT'), 'seq2': row('AC')})])
+
+    alignment = CachedAlignment.load(alignment_dir)
+    assert [1, 2, 5] == alignment.sample_ids
+    assert ['A', 'B', 'C'] == alignment.sample_names
+    assert ['ACGT', 'ACGA', 'TCGT'] == matrix_strings(alignment, 'seq1')
+    assert ['AA', 'NA', 'AC'] == matrix_strings(alignment, 'seq2')
+
+
+def test_append_rows_invalid(alignment_dir: Path):
+    alignment = CachedAlignment.create(alignment_dir, reference_name='genome', align_type='full',
+                                       sequence_columns={'seq1': None}, sequence_lengths={'seq1': 4})
+    alignment.append_rows([(1, 'A', {'seq1': row('ACGT')})])
+
+    with pytest.raises(Exception) as execinfo:
+        alignment.append_rows([(1, 'A', {'seq1': row('ACGT')})])
+    assert 'Sample [A] with id [1] already exists' in str(execinfo.value)
+
+    with pytest.raises(Exception) as execinfo:
+        alignment.append_rows([(2, 'B', {'seq1': row('ACG')})])
+    assert 'has length [3] but should be [4]' in str(execinfo.value)
+
+    # Partially-appended rows are not part of the alignment
+    alignment = CachedAlignment.load(alignment_dir)
+    assert [1] == alignment.sample_ids
+    assert ['ACGT'] == matrix_strings(alignment, 'seq1')
+
+    alignment.append_rows([(2, 'B', {'seq1': row('TTTT')})])
+    assert ['ACGT', 'TTTT'] == matrix_strings(CachedAlignment.load(alignment_dir), 'seq1')
+
+
+def test_add_columns(alignment_dir: Path):
+    alignment = CachedAlignment.create(alignment_dir, reference_name='genome', align_type='core',
+                                       sequence_columns={'seq1': np.array([2, 5])},
+                                       sequence_lengths={'seq1': 10})
+    alignment.append_rows([(1, 'A', {'seq1': row('AC')}),
+                           (2, 'B', {'seq1': row('GT')})])
+
+    alignment.add_columns('seq1', positions=np.array([7, 1]), columns=np.array([row('NT'), row('CA')]))
+    assert [1, 2, 5, 7] == alignment.positions('seq1').tolist()
+    assert ['TACN', 'AGTC'] == matrix_strings(alignment, 'seq1')
+
+    alignment.append_rows([(3, 'C', {'seq1': row('GGGG')})])
+    alignment = CachedAlignment.load(alignment_dir)
+    assert [1, 2, 5, 7] == alignment.positions('seq1').tolist()
+    assert ['TACN', 'AGTC', 'GGGG'] == matrix_strings(alignment, 'seq1')
+
+    # Files no longer used are removed
+    assert 3 == len(list(alignment_dir.iterdir()))
+
+    with pytest.raises(Exception) as execinfo:
+        alignment.add_columns('seq1', positions=np.array([7]), columns=np.array([[0], [0], [0]], dtype=np.uint8))
+    assert 'Some positions already exist' in str(execinfo.value)
+
+
+def test_add_columns_in_chunks(alignment_dir: Path, monkeypatch):
+    monkeypatch.setattr(CachedAlignment, 'ADD_COLUMNS_CHUNK_BYTES', 5)
+    alignment = CachedAlignment.create(alignment_dir, reference_name='genome', align_type='core',
+                                       sequence_columns={'seq1': np.array([2, 5])},
+                                       sequence_lengths={'seq1': 10})
+    alignment.append_rows([(1, 'A', {'seq1': row('AC')}),
+                           (2, 'B', {'seq1': row('GT')}),
+                           (3, 'C', {'seq1': row('CC')})])
+
+    # Each chunk (of 5 bytes) holds a single row of 4 columns
+    alignment.add_columns('seq1', positions=np.array([7, 1]), columns=np.array([row('NT'), row('CA'), row('GG')]))
+    assert [1, 2, 5, 7] == alignment.positions('seq1').tolist()
+    assert ['TACN', 'AGTC', 'GCCG'] == matrix_strings(CachedAlignment.load(alignment_dir), 'seq1')
@@ -0,0 +1,96 @@
+import logging
+import random
+import time
+
+import pytest
+from ete3 import Tree
+
+from genomics_data_index.storage.CladeIndex import CladeIndex
+from genomics_data_index.storage.SampleSet import SampleSet
+from genomics_data_index.storage.TreeIndex import TreeIndex
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def tree() -> Tree:
+    return Tree('((A:1,B:2,C:3):0.5,(D:1,(E:2,F:1):1,G:4):2,reference:0.1);')
+
+
+@pytest.fixture
+def sample_name_ids():
+    return {'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5, 'F': 6, 'G': 7}
+
+
+def test_mrca_samples(tree: Tree, sample_name_ids):
+    clade_index = CladeIndex(TreeIndex(tree), sample_name_ids)
+
+    assert {1} == set(clade_index.mrca_samples(['A']))
+    assert {1, 2, 3} == set(clade_index.mrca_samples(['A', 'B']))
+    assert {5, 6} == set(clade_index.mrca_samples(['E', 'F']))
+    assert {4, 5, 6, 7} == set(clade_index.mrca_samples(['D', 'F']))
+
+    # The reference genome is not a sample
+    assert {1, 2, 3, 4, 5, 6, 7} == set(clade_index.mrca_samples(['A', 'reference']))
+    assert set() == set(clade_index.mrca_samples(['reference']))
+
+
+def test_clade_samples_cached(tree: Tree, sample_name_ids):
+    clade_index = CladeIndex(TreeIndex(tree), sample_name_ids)
+    samples = clade_index.clade_samples(1)
+
+    assert {1, 2, 3} == set(samples)
+    assert samples is clade_index.clade_samples(1)
+
+
+def test_leaf_names_in(tree: Tree, sample_name_ids):
+    clade_index = CladeIndex(TreeIndex(tree), sample_name_ids)
+
+    assert ['A', 'E', 'G'] == clade_index.leaf_names_in(SampleSet([7, 1, 5]))
+    assert [] == clade_index.leaf_names_in(SampleSet([10]))
+    assert ['A', 'B', 'C', 'D', 'E', 'F', 'G'] == clade_index.leaf_names_in(SampleSet.create_all())
+
+
+def test_leaf_samples(tree: Tree, sample_name_ids):
+    clade_index = CladeIndex(TreeIndex(tree), sample_name_ids)
+    assert {1, 2, 3, 4, 5, 6, 7} == set(clade_index.leaf_samples)
+
+    clade_index = CladeIndex(TreeIndex(tree), {'A': 1, 'E': 5, 'H': 8})
+    assert {1, 5} == set(clade_index.leaf_samples)
+
+
+def test_ancestor_clade_samples(tree: Tree, sample_name_ids):
+    clade_index = CladeIndex(TreeIndex(tree), sample_name_ids)
+
+    assert {5} == set(clade_index.ancestor_clade_samples('E', 0))
+    assert {5, 6} == set(clade_index.ancestor_clade_samples('E', 1))
+    assert {4, 5, 6, 7} == set(clade_index.ancestor_clade_samples('E', 2))
+    assert {1, 2, 3, 4, 5, 6, 7} == set(clade_index.ancestor_clade_samples('E', 3))
+
+
+def test_benchmark_mrca_samples():
+    random.seed(42)
+    tree = Tree()
+    tree.populate(5000, random_branches=True)
+    sample_name_ids = {name: i for i, name in enumerate(tree.get_leaf_names())}
+    names = random.sample(tree.get_leaf_names(), 2)
+    number_queries = 5
+
+    start_time = time.time()
+    for i in range(number_queries):
+        leaves = [tree.get_leaves_by_name(name)[0] for name in names]
+        ancestor_node = leaves[0].get_common_ancestor(leaves[1:])
+        expected_samples = {sample_name_ids[name] for name in ancestor_node.get_leaf_names()}
+    ete3_time = time.time() - start_time
+
+    clade_index = CladeIndex(TreeIndex(tree), sample_name_ids)
+    start_time = time.time()
+    for i in range(number_queries):
+        actual_samples = clade_index.mrca_samples(names)
+    index_time = time.time() - start_time
+
+    logger.info(f'{number_queries} mrca queries on tree with {len(tree)} leaves: ete3 took {ete3_time:0.4f} seconds, '
+                f'index took {index_time:0.4f} seconds')
+
+    assert expected_samples == set(actual_samples)
+    assert index_time < ete3_time
@@ -0,0 +1,93 @@
+import logging
+import random
+import time
+
+import pytest
+from ete3 import Tree
+
+from genomics_data_index.storage.CompactTree import CompactTree
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def tree() -> Tree:
+    return Tree('((A:1,B:2,C:3)0.9:0.5,(D:1,(E:2,F:1)0.8:1,G:4)0.7:2,reference:0.1);')
+
+
+def test_from_tree(tree: Tree):
+    compact_tree = CompactTree.from_tree(tree)
+
+    # Nodes are numbered in preorder
+    assert 12 == len(compact_tree)
+    assert [-1, 0, 1, 1, 1, 0, 5, 5, 7, 7, 5, 0] == compact_tree.parents.tolist()
+    assert [0, 0.5, 1, 2, 3, 2, 1, 1, 2, 1, 4, 0.1] == pytest.approx(compact_tree.branch_lengths.tolist())
+    assert 0.9 == pytest.approx(compact_tree.supports[1])
+    assert ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'reference'] == compact_tree.leaf_names
+    assert [2, 3, 4, 6, 8, 9, 10, 11] == compact_tree.leaf_nodes.tolist()
+
+
+def test_to_tree(tree: Tree):
+    compact_tree = CompactTree.from_tree(tree)
+    actual_tree = compact_tree.to_tree()
+
+    assert tree.write() == actual_tree.write()
+    assert tree.write(format=0) == actual_tree.write(format=0)
+    assert tree.get_leaf_names() == actual_tree.get_leaf_names()
+    assert 6.5 == pytest.approx(actual_tree.get_distance('A', 'E'))
+
+
+def test_to_from_bytes(tree: Tree):
+    compact_tree = CompactTree.from_tree(tree)
+    actual_compact_tree = CompactTree.from_bytes(compact_tree.to_bytes())
+
+    assert compact_tree.parents.tolist() == actual_compact_tree.parents.tolist()
+    assert compact_tree.branch_lengths.tolist() == actual_compact_tree.branch_lengths.tolist()
+    assert compact_tree.supports.tolist() == actual_compact_tree.supports.tolist()
+    assert compact_tree.names == actual_compact_tree.names
+    assert tree.write() == actual_compact_tree.to_tree().write()
+
+
+def test_single_node_and_unicode_names():
+    compact_tree = CompactTree.from_bytes(CompactTree.from_tree(Tree('sämple;')).to_bytes())
+    assert ['sämple'] == compact_tree.leaf_names
+    assert [0] == compact_tree.leaf_nodes.tolist()
+
+
+def test_invalid_compact_tree():
+    compact_tree = CompactTree.from_tree(Tree('(A,B);'))
+
+    with pytest.raises(Exception) as execinfo:
+        CompactTree(parents=compact_tree.parents, branch_lengths=compact_tree.branch_lengths[1:],
+                    supports=compact_tree.supports, names=compact_tree.names)
+    assert 'All arrays defining a CompactTree must have the same length' in str(execinfo.value)
+
+    with pytest.raises(Exception) as execinfo:
+        CompactTree(parents=compact_tree.parents[::-1], branch_lengths=compact_tree.branch_lengths,
+                    supports=compact_tree.supports, names=compact_tree.names)
+    assert 'The first node of a CompactTree must be the root' in str(execinfo.value)
+
+
+def test_benchmark_load_tree():
+    random.seed(42)
+    tree = Tree()
+    tree.populate(5000, random_branches=True)
+    tree_text = tree.write()
+    tree_bytes = CompactTree.from_tree(tree).to_bytes()
+
+    number_loads = 3
+
+    start_time = time.time()
+    for i in range(number_loads):
+        expected_tree = Tree(tree_text)
+    newick_time = time.time() - start_time
+
+    start_time = time.time()
+    for i in range(number_loads):
+        actual_tree = CompactTree.from_bytes(tree_bytes).to_tree()
+    compact_time = time.time() - start_time
+
+    logger.info(f'Loading tree with {len(tree)} leaves {number_loads} times: newick ({len(tree_text)} bytes) '
+                f'took {newick_time:0.4f} seconds, compact ({len(tree_bytes)} bytes) took {compact_time:0.4f} seconds')
+
+    assert expected_tree.write() == actual_tree.write()
@@ -1,6 +1,11 @@
+import logging
+import os
 import tempfile
+import time
 from pathlib import Path
 
+import numpy as np
+import pytest
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
@@ -8,6 +13,8 @@ from pybedtools import BedTool
 
 from genomics_data_index.storage.MaskedGenomicRegions import MaskedGenomicRegions
 
+logger = logging.getLogger(__name__)
+
 
 def test_create_from_sequence():
     sequences = [SeqRecord(seq=Seq('ATCG-NN'), id='record1')]
@@ -141,6 +148,65 @@ def test_write():
         assert not mask2.contains('record1', 7)
 
 
+def test_write_binary():
+    mask = MaskedGenomicRegions(BedTool([('record1', 4, 7), ('record1', 10, 20), ('record2', 0, 1)]))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir) / 'mask.mask.bin'
+        mask.write_binary(file)
+
+        mask2 = MaskedGenomicRegions.from_binary_file(file)
+        assert 14 == len(mask2), 'Invalid length'
+        assert {'record1', 'record2'} == mask2.sequence_names()
+        assert not mask2.contains('record1', 3)
+        assert mask2.contains('record1', 4)
+        assert mask2.contains('record1', 19)
+        assert not mask2.contains('record1', 20)
+        assert mask2.contains('record2', 0)
+        assert not mask2.contains('record2', 1)
+
+
+def test_write_binary_empty():
+    mask = MaskedGenomicRegions.empty_mask()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir) / 'mask.mask.bin'
+        mask.write_binary(file)
+
+        mask2 = MaskedGenomicRegions.from_binary_file(file)
+        assert mask2.is_empty()
+        assert set() == mask2.sequence_names()
+
+
+def test_from_binary_file_invalid():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = Path(tmp_dir) / 'mask.bed'
+        file.write_text('record1\t0\t10\n')
+
+        with pytest.raises(Exception) as execinfo:
+            MaskedGenomicRegions.from_binary_file(file)
+        assert 'is not a binary mask file' in str(execinfo.value)
+
+
+def test_from_file_prefers_binary():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bed_file = Path(tmp_dir) / 'mask.bed.gz'
+        binary_file = MaskedGenomicRegions.binary_file(bed_file)
+        assert Path(tmp_dir) / 'mask.mask.bin' == binary_file
+
+        MaskedGenomicRegions(BedTool([('record1', 0, 10)])).write(bed_file)
+        assert 10 == len(MaskedGenomicRegions.from_file(bed_file))
+
+        MaskedGenomicRegions(BedTool([('record1', 0, 5)])).write_binary(binary_file)
+        assert 5 == len(MaskedGenomicRegions.from_file(bed_file))
+        assert 10 == len(MaskedGenomicRegions.from_file(bed_file, use_binary=False))
+
+        # Binary file older than BED file is not used
+        bed_mtime = bed_file.stat().st_mtime
+        os.utime(binary_file, (bed_mtime - 10, bed_mtime - 10))
+        assert 10 == len(MaskedGenomicRegions.from_file(bed_file))
+
+
 def test_mask_genome():
     with tempfile.TemporaryDirectory() as tmp_dir:
         genome_file = Path(tmp_dir) / 'genome.fasta'
@@ -206,6 +272,7 @@ def test_overlaps_region_one_region():
     assert not masked_region.overlaps_range('ref', 21, 25)
 
     assert masked_region.overlaps_range('ref', 9, 25)
+    assert masked_region.overlaps_range('ref', 5, 15)
 
     assert not masked_region.overlaps_range('no_exist', 11, 15)
 
@@ -227,3 +294,85 @@ def test_overlaps_region_multiple_regions():
     assert masked_region.overlaps_range('ref2', 31, 35)
     assert masked_region.overlaps_range('ref2', 39, 45)
     assert not masked_region.overlaps_range('ref2', 40, 45)
+
+
+def test_contains_many():
+    masked_region = MaskedGenomicRegions(BedTool([('ref', 10, 20),
+                                                  ('ref', 30, 40),
+                                                  ('ref2', 5, 6)]))
+
+    assert [False, False, True, True, False, True, True, False] == masked_region.contains_many(
+        'ref', np.array([0, 9, 10, 19, 20, 30, 39, 40])).tolist()
+    assert [False, True, True, False] == masked_region.contains_many(
+        'ref', np.array([10, 11, 20, 21]), start_position_index='1').tolist()
+    assert [False, True, False] == masked_region.contains_many('ref2', np.array([4, 5, 6])).tolist()
+    assert [False, False] == masked_region.contains_many('no_exist', np.array([10, 15])).tolist()
+    assert [] == masked_region.contains_many('ref', np.array([], dtype=int)).tolist()
+
+
+def test_missing_intervals():
+    starts, stops = MaskedGenomicRegions._missing_intervals('ATCG-NN')
+    assert [4] == starts.tolist()
+    assert [7] == stops.tolist()
+
+    starts, stops = MaskedGenomicRegions._missing_intervals('nN-GATN-A')
+    assert [0, 6] == starts.tolist()
+    assert [3, 8] == stops.tolist()
+
+    starts, stops = MaskedGenomicRegions._missing_intervals('ATCG')
+    assert [] == starts.tolist()
+    assert [] == stops.tolist()
+
+    starts, stops = MaskedGenomicRegions._missing_intervals('')
+    assert [] == starts.tolist()
+    assert [] == stops.tolist()
+
+
+def test_intersection_multiple_overlaps():
+    mask1 = MaskedGenomicRegions(BedTool([('ref', 0, 10), ('ref', 20, 30), ('ref2', 0, 5)]))
+    mask2 = MaskedGenomicRegions(BedTool([('ref', 5, 22), ('ref', 25, 26), ('ref', 28, 40), ('ref3', 0, 5)]))
+
+    mask_intersect = mask1.intersect(mask2)
+
+    assert {'ref'} == mask_intersect.sequence_names()
+    assert 5 + 2 + 1 + 2 == len(mask_intersect)
+    assert [False, True, True, False, True, False, True, True, False, True, True, False] == \
+           mask_intersect.contains_many('ref', np.array([4, 5, 9, 10, 20, 22, 21, 25, 26, 28, 29, 30])).tolist()
+
+
+def test_merge_overlapping_and_adjacent_intervals():
+    mask = MaskedGenomicRegions(BedTool([('ref', 10, 20), ('ref', 0, 5), ('ref', 5, 8), ('ref', 15, 30),
+                                         ('ref', 40, 40)]))
+
+    assert 8 + 20 == len(mask)
+    assert mask.contains('ref', 7)
+    assert not mask.contains('ref', 8)
+    assert mask.contains('ref', 29)
+    assert not mask.contains('ref', 40)
+
+
+def test_benchmark_union_all():
+    number_masks = 2000
+    intervals_per_mask = 100
+    sequence_length = 5000000
+    rng = np.random.default_rng(42)
+
+    masks = []
+    expected_masked_positions = np.zeros(sequence_length, dtype=bool)
+    for i in range(number_masks):
+        starts = rng.integers(0, sequence_length - 100, intervals_per_mask)
+        ends = starts + rng.integers(1, 100, intervals_per_mask)
+        masks.append(MaskedGenomicRegions(intervals={'reference': (starts, ends)}))
+        for start, end in zip(starts, ends):
+            expected_masked_positions[start:end] = True
+
+    start_time = time.time()
+    union = MaskedGenomicRegions.union_all(masks)
+    union_time = time.time() - start_time
+
+    logger.info(f'Union of {number_masks} masks with {intervals_per_mask} intervals each '
+                f'took {union_time:0.2f} seconds')
+
+    assert number_masks == len(masks)
+    assert expected_masked_positions.sum() == len(union)
+    assert (expected_masked_positions == union._masked_positions('reference', sequence_length)).all()
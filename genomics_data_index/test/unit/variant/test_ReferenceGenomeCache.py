@@ -0,0 +1,87 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from Bio import SeqIO
+
+from genomics_data_index.storage.ReferenceGenomeCache import ReferenceGenomeCache
+
+
+@pytest.fixture
+def cache_dir() -> Path:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield Path(tmp_dir) / 'cache'
+
+
+def test_store_get_sequence(cache_dir: Path):
+    cache = ReferenceGenomeCache(cache_dir)
+    assert not cache.has_sequence('seq1')
+
+    cache.store_sequence('seq1', 'ACGTN')
+    assert cache.has_sequence('seq1')
+    assert not cache.has_sequence('seq2')
+
+    assert 'ACGTN' == cache.get_sequence('seq1')
+    sequence_array = cache.get_sequence_array('seq1')
+    assert np.uint8 == sequence_array.dtype
+    assert 'CG' == sequence_array[1:3].tobytes().decode()
+
+    # Sequences are persisted on disk
+    assert 'ACGTN' == ReferenceGenomeCache(cache_dir).get_sequence('seq1')
+
+
+def test_store_sequence_special_names_and_empty(cache_dir: Path):
+    cache = ReferenceGenomeCache(cache_dir)
+    cache.store_sequence('gi|123|ref/seq:1', 'AC')
+    cache.store_sequence('empty', '')
+
+    assert 'AC' == cache.get_sequence('gi|123|ref/seq:1')
+    assert '' == cache.get_sequence('empty')
+
+
+def test_get_sequence_missing(cache_dir: Path):
+    cache = ReferenceGenomeCache(cache_dir)
+    with pytest.raises(Exception) as execinfo:
+        cache.get_sequence_array('seq1')
+    assert 'Sequence [seq1] does not exist in cache' in str(execinfo.value)
+
+
+def test_max_open_sequences(cache_dir: Path):
+    cache = ReferenceGenomeCache(cache_dir, max_open=2)
+    for i in range(5):
+        cache.store_sequence(f'seq{i}', 'A' * (i + 1))
+
+    for i in range(5):
+        assert 'A' * (i + 1) == cache.get_sequence(f'seq{i}')
+
+    assert ['seq3', 'seq4'] == list(cache._open_sequences.keys())
+
+    # Accessing an open sequence marks it as most recently used
+    cache.get_sequence_array('seq3')
+    assert ['seq4', 'seq3'] == list(cache._open_sequences.keys())
+
+
+def test_get_reference_file(cache_dir: Path):
+    cache = ReferenceGenomeCache(cache_dir)
+    sequence1 = 'ACGT' * 30 + 'A'
+    sequence2 = 'T' * 60
+    cache.store_sequence('seq1', sequence1)
+    cache.store_sequence('seq2', sequence2)
+
+    reference_file = cache.get_reference_file('genome', ['seq1', 'seq2'])
+    records = list(SeqIO.parse(reference_file, 'fasta'))
+    assert ['seq1', 'seq2'] == [r.id for r in records]
+    assert [sequence1, sequence2] == [str(r.seq) for r in records]
+
+    # Lines are wrapped and the index is consistent with the file
+    lines = reference_file.read_text().split('\n')
+    assert ['>seq1', 'ACGT' * 15, 'ACGT' * 15, 'A', '>seq2', 'T' * 60, ''] == lines
+
+    index = Path(f'{reference_file}.fai').read_text()
+    assert 'seq1\t121\t6\t60\t61\nseq2\t60\t136\t60\t61\n' == index
+
+    # File is re-used
+    modified_time = reference_file.stat().st_mtime_ns
+    assert reference_file == cache.get_reference_file('genome', ['seq1', 'seq2'])
+    assert modified_time == reference_file.stat().st_mtime_ns
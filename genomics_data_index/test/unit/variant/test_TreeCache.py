@@ -0,0 +1,90 @@
+import logging
+import random
+import time
+
+import pytest
+from ete3 import Tree
+
+from genomics_data_index.storage.CompactTree import CompactTree
+from genomics_data_index.storage.TreeCache import TreeCache
+
+logger = logging.getLogger(__name__)
+
+
+def test_get_tree():
+    cache = TreeCache()
+    tree_text = '((A:1,B:2):0.5,C:3);'
+
+    tree = cache.get(1, tree_text)
+    assert ['A', 'B', 'C'] == tree.get_leaf_names()
+    assert tree is cache.get(1, tree_text)
+
+    # Different trees or ids are cached separately
+    assert tree is not cache.get(1, '((A:1,C:2):0.5,B:3);')
+    assert tree is not cache.get(2, tree_text)
+    assert 3 == len(cache)
+
+
+def test_get_copy():
+    cache = TreeCache()
+    tree_text = '((A:1,B:2):0.5,C:3);'
+
+    tree_copy = cache.get_copy(1, tree_text)
+    assert tree_copy is not cache.get(1, tree_text)
+    tree_copy.prune(['A', 'C'])
+
+    assert {'A', 'C'} == set(tree_copy.get_leaf_names())
+    assert ['A', 'B', 'C'] == cache.get(1, tree_text).get_leaf_names()
+
+
+def test_get_tree_compact():
+    cache = TreeCache()
+    tree_bytes = CompactTree.from_tree(Tree('((A:1,B:2):0.5,C:3);')).to_bytes()
+
+    tree = cache.get(1, tree_bytes)
+    assert ['A', 'B', 'C'] == tree.get_leaf_names()
+    assert '((A:1,B:2)1:0.5,C:3);' == tree.write()
+    assert tree is cache.get(1, tree_bytes)
+    assert tree is not cache.get(1, '((A:1,B:2):0.5,C:3);')
+
+
+def test_invalidate_and_max_trees():
+    cache = TreeCache(max_trees=2)
+    cache.get(1, '(A,B);')
+    cache.get(1, '(A,C);')
+    cache.get(2, '(A,B);')
+    assert 2 == len(cache)
+
+    cache.invalidate(1)
+    assert 1 == len(cache)
+    cache.invalidate(2)
+    assert 0 == len(cache)
+
+    with pytest.raises(Exception) as execinfo:
+        TreeCache(max_trees=0)
+    assert 'max_trees=[0] must be a positive integer' in str(execinfo.value)
+
+
+def test_benchmark_get_tree():
+    random.seed(42)
+    tree = Tree()
+    tree.populate(5000, random_branches=True)
+    tree_text = tree.write()
+    number_accesses = 5
+
+    start_time = time.time()
+    for i in range(number_accesses):
+        expected_tree = Tree(tree_text)
+    parse_time = time.time() - start_time
+
+    cache = TreeCache()
+    start_time = time.time()
+    for i in range(number_accesses):
+        actual_tree = cache.get(1, tree_text)
+    cache_time = time.time() - start_time
+
+    logger.info(f'Accessing tree with {len(tree)} leaves {number_accesses} times: parsing took '
+                f'{parse_time:0.4f} seconds, cache took {cache_time:0.4f} seconds')
+
+    assert expected_tree.get_leaf_names() == actual_tree.get_leaf_names()
+    assert cache_time < parse_time
@@ -0,0 +1,137 @@
+import logging
+import random
+import time
+
+import numpy as np
+import pytest
+from ete3 import Tree
+
+from genomics_data_index.storage.TreeIndex import TreeIndex
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def tree() -> Tree:
+    return Tree('((A:1,B:2,C:3):0.5,(D:1,(E:2,F:1):1,G:4):2,H:0.1);')
+
+
+def test_leaf_distances(tree: Tree):
+    tree_index = TreeIndex(tree)
+    assert ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'] == tree_index.leaf_names
+
+    for leaf_name in tree.get_leaf_names():
+        leaf = tree & leaf_name
+        expected_distances = [leaf.get_distance(tree & other) for other in tree_index.leaf_names]
+        assert expected_distances == pytest.approx(tree_index.leaf_distances(leaf_name).tolist())
+
+    assert [0, 3, 4, 4.5, 6.5, 5.5, 7.5, 1.6] == pytest.approx(tree_index.leaf_distances('A').tolist())
+
+
+def test_lca(tree: Tree):
+    tree_index = TreeIndex(tree)
+    leaf_nodes = {name: tree_index.leaf_node(name) for name in tree_index.leaf_names}
+
+    # Nodes are numbered in preorder
+    assert 0 == tree_index.lca(leaf_nodes['A'], leaf_nodes['H'])[0]
+    assert 1 == tree_index.lca(leaf_nodes['A'], leaf_nodes['C'])[0]
+    assert [5, 7, leaf_nodes['E']] == tree_index.lca(np.array([leaf_nodes['D'], leaf_nodes['E'], leaf_nodes['E']]),
+                                                     np.array([leaf_nodes['G'], leaf_nodes['F'],
+                                                               leaf_nodes['E']])).tolist()
+
+
+def test_leaves_within(tree: Tree):
+    tree_index = TreeIndex(tree)
+    assert ['A'] == tree_index.leaves_within('A', 0)
+    assert ['A', 'B', 'H'] == tree_index.leaves_within('A', 3)
+    assert ['D', 'F'] == tree_index.leaves_within('D', 3)
+
+
+def test_single_leaf_and_invalid_leaf():
+    tree_index = TreeIndex(Tree('A:1;'))
+    assert [0] == tree_index.leaf_distances('A').tolist()
+
+    tree_index = TreeIndex(Tree('(A:1,A:2,B:1);'))
+    with pytest.raises(Exception) as execinfo:
+        tree_index.leaf_distances('A')
+    assert 'Invalid number of matching leaves for sample [A]' in str(execinfo.value)
+
+    with pytest.raises(Exception) as execinfo:
+        tree_index.leaf_distances('C')
+    assert 'Invalid number of matching leaves for sample [C]' in str(execinfo.value)
+
+
+def test_clade_leaf_range_and_ancestor(tree: Tree):
+    tree_index = TreeIndex(tree)
+    leaf_names = tree_index.leaf_names
+
+    assert (0, 8) == tree_index.clade_leaf_range(0)
+    assert ['A', 'B', 'C'] == leaf_names[slice(*tree_index.clade_leaf_range(1))]
+    assert ['D', 'E', 'F', 'G'] == leaf_names[slice(*tree_index.clade_leaf_range(5))]
+    assert ['E'] == leaf_names[slice(*tree_index.clade_leaf_range(tree_index.leaf_node('E')))]
+
+    assert tree_index.leaf_node('E') == tree_index.ancestor(tree_index.leaf_node('E'), 0)
+    assert 7 == tree_index.ancestor(tree_index.leaf_node('E'), 1)
+    assert 5 == tree_index.ancestor(tree_index.leaf_node('E'), 2)
+    assert 0 == tree_index.ancestor(tree_index.leaf_node('E'), 3)
+    assert 0 == tree_index.ancestor(tree_index.leaf_node('E'), 10)
+
+
+def test_mrca(tree: Tree):
+    tree_index = TreeIndex(tree)
+
+    assert tree_index.leaf_node('A') == tree_index.mrca(['A'])
+    assert 1 == tree_index.mrca(['A', 'C'])
+    assert 5 == tree_index.mrca(['G', 'E', 'D'])
+    assert 7 == tree_index.mrca(['F', 'E'])
+    assert 0 == tree_index.mrca(['E', 'H', 'B'])
+
+    with pytest.raises(Exception) as execinfo:
+        tree_index.mrca([])
+    assert 'Should at least have some leaves in the tree matching names=[]' in str(execinfo.value)
+
+    with pytest.raises(Exception) as execinfo:
+        tree_index.mrca(['A', 'I'])
+    assert 'Invalid number of matching leaves for sample [I]' in str(execinfo.value)
+
+
+def test_get_cached(tree: Tree):
+    tree_index = TreeIndex.get(tree)
+    assert tree_index is TreeIndex.get(tree)
+    assert tree_index is not TreeIndex.get(tree.copy())
+
+
+def test_random_trees():
+    random.seed(42)
+    for number_leaves in [2, 3, 50, 257]:
+        tree = Tree()
+        tree.populate(number_leaves, random_branches=True)
+        tree_index = TreeIndex(tree)
+        leaves = [tree & name for name in tree_index.leaf_names]
+
+        for leaf_name in random.sample(tree_index.leaf_names, 2):
+            leaf = tree & leaf_name
+            expected_distances = [leaf.get_distance(other) for other in leaves]
+            assert expected_distances == pytest.approx(tree_index.leaf_distances(leaf_name).tolist())
+
+
+def test_benchmark_leaf_distances():
+    random.seed(42)
+    tree = Tree()
+    tree.populate(2000, random_branches=True)
+    leaf_name = tree.get_leaf_names()[0]
+
+    start_time = time.time()
+    leaf = tree & leaf_name
+    expected_distances = [leaf.get_distance(other) for other in tree.get_leaves()]
+    ete3_time = time.time() - start_time
+
+    start_time = time.time()
+    tree_index = TreeIndex(tree)
+    distances = tree_index.leaf_distances(leaf_name)
+    index_time = time.time() - start_time
+
+    logger.info(f'Distances to {len(expected_distances)} leaves: ete3 took {ete3_time:0.4f} seconds, '
+                f'index (including building) took {index_time:0.4f} seconds')
+
+    assert expected_distances == pytest.approx(distances.tolist())
@@ -0,0 +1,52 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from genomics_data_index.storage.util import atomic_output_files, link_or_copy_file
+
+
+def test_atomic_output_files():
+    with tempfile.TemporaryDirectory() as tmp_dir_str:
+        tmp_dir = Path(tmp_dir_str)
+        output_file = tmp_dir / 'file.vcf.gz'
+        output_index = tmp_dir / 'file.vcf.gz.csi'
+
+        with atomic_output_files([output_index, output_file]) as temp_files:
+            temp_index, temp_file = temp_files
+            assert temp_index.parent == tmp_dir
+            assert Path(str(temp_file) + '.csi') == temp_index
+            temp_file.write_text('data')
+            temp_index.write_text('index')
+            assert not output_file.exists()
+
+        assert 'data' == output_file.read_text()
+        assert 'index' == output_index.read_text()
+        assert {output_file, output_index} == set(tmp_dir.iterdir())
+
+
+def test_atomic_output_files_failure():
+    with tempfile.TemporaryDirectory() as tmp_dir_str:
+        tmp_dir = Path(tmp_dir_str)
+        output_file = tmp_dir / 'file.bed.gz'
+
+        with pytest.raises(Exception) as execinfo:
+            with atomic_output_files([output_file]) as temp_files:
+                temp_files[0].write_text('partial')
+                raise Exception('failed writing')
+
+        assert 'failed writing' in str(execinfo.value)
+        assert [] == list(tmp_dir.iterdir())
+
+
+def test_link_or_copy_file():
+    with tempfile.TemporaryDirectory() as tmp_dir_str:
+        tmp_dir = Path(tmp_dir_str)
+        source = tmp_dir / 'source.txt'
+        source.write_text('data')
+        destination = tmp_dir / 'destination.txt'
+
+        link_or_copy_file(source, destination)
+
+        assert 'data' == destination.read_text()
+        assert {source, destination} == set(tmp_dir.iterdir())
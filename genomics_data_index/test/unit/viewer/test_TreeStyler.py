@@ -0,0 +1,62 @@
+import pytest
+from ete3 import Tree, NodeStyle
+
+from genomics_data_index.api.viewer.TreeStyler import TreeStyler
+
+
+@pytest.fixture
+def tree() -> Tree:
+    return Tree('((A:1,B:2,C:3):0.5,(D:1,(E:2,F:1):1,G:4):2,genome:0.1);')
+
+
+def test_annotate(tree: Tree):
+    tree_text = tree.write()
+    styler = TreeStyler.create(tree, annotate_color_present='red', annotate_color_absent='white')
+    styler = styler.annotate(['A', 'B'], label='Column 1', legend_label='Legend 1') \
+        .annotate(['B', 'C'], label='Column 2', color_present='blue')
+
+    # The passed tree is not modified
+    assert tree_text == tree.write()
+
+    styled_tree = styler.tree
+    leaves = {leaf.name: leaf for leaf in styled_tree.iter_leaves()}
+    assert {1, 2} == set(leaves['A']._faces.aligned.keys())
+    assert 'red' == leaves['A']._faces.aligned[1][0].background.color
+    assert 'white' == leaves['A']._faces.aligned[2][0].background.color
+    assert 'blue' == leaves['B']._faces.aligned[2][0].background.color
+    assert 'white' == leaves['genome']._faces.aligned[1][0].background.color
+
+    # Faces are shared by the leaves in a column
+    assert leaves['A']._faces.aligned[1][0] is leaves['B']._faces.aligned[1][0]
+    assert leaves['A']._faces.aligned[1][0] is not leaves['C']._faces.aligned[1][0]
+
+    tree_style = styler.tree_style
+    assert {1, 2} == set(tree_style.aligned_header.keys())
+    assert ['Legend 1'] == [face.text for face in tree_style.legend[1]]
+
+
+def test_highlight(tree: Tree):
+    tree_text = tree.write()
+    nstyle_1 = NodeStyle()
+    nstyle_1['bgcolor'] = 'red'
+    nstyle_2 = NodeStyle()
+    nstyle_2['bgcolor'] = 'blue'
+
+    styler = TreeStyler.create(tree).highlight(['A', 'B'], nstyle=nstyle_1, legend_color='red') \
+        .highlight(['B', 'C', 'H'], nstyle=nstyle_2, legend_color='blue', legend_label='Blue')
+    assert tree_text == tree.write()
+
+    leaves = {leaf.name: leaf for leaf in styler.tree.iter_leaves()}
+    assert 'red' == leaves['A'].img_style['bgcolor']
+    assert 'blue' == leaves['B'].img_style['bgcolor']
+    assert 'blue' == leaves['C'].img_style['bgcolor']
+    assert '#FFFFFF' == leaves['D'].img_style['bgcolor']
+    assert ['Blue'] == [face.text for face in styler.tree_style.legend[1]]
+
+
+def test_highlight_duplicate_leaves():
+    styler = TreeStyler.create(Tree('(A,(A,B));')).highlight(['A'])
+
+    with pytest.raises(Exception) as execinfo:
+        styler.tree
+    assert 'More than one node in the tree matched sample=[A]' in str(execinfo.value)